@@ -0,0 +1,117 @@
+"""
+Size / CPU tradeoff of payload compression (delivery/payloads.py).
+
+Every line of a JSONL file is used as one event payload; by default the
+sample requests.jsonl at the repository root:
+
+    cd backend
+    python benchmarks/compression.py
+    python benchmarks/compression.py --group 100       # 100 lines per payload, for 10-200 KB payloads
+    python benchmarks/compression.py path/to/payloads.jsonl --min-bytes 0
+
+For each codec and level it reports:
+    - stored size: total encoded bytes and what compression leaves of them
+      (payloads under --min-bytes, or that don't shrink, are stored as-is)
+    - compress: CPU per payload at ingestion
+    - decompress: CPU per payload each time the body is read (every delivery
+      attempt, and API reads of payloads stored only compressed)
+    - gzip transport: CPU per attempt for a destination with gzip_requests on
+      (nothing when the body is already stored as gzip, it's sent as-is)
+
+No database is used.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+
+from delivery import payloads  # noqa: E402
+
+DEFAULT_INPUT = Path(__file__).resolve().parents[2] / 'requests.jsonl'
+
+CODECS = [('gzip', 1), ('gzip', 6), ('gzip', 9), ('zstd', 1), ('zstd', 3), ('zstd', 9)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', nargs='?', default=str(DEFAULT_INPUT), help='JSONL file, one payload per line')
+    parser.add_argument('--group', type=int, default=1, help='lines combined into one payload (a JSON array)')
+    parser.add_argument('--min-bytes', type=int, default=None,
+                        help='WEBHOOK_PAYLOAD_COMPRESSION_MIN_BYTES (default: the current setting)')
+    parser.add_argument('--rounds', type=int, default=5, help='timing rounds, the median is reported')
+    return parser.parse_args()
+
+
+def load_bodies(path, group):
+    with open(path) as lines:
+        items = [json.loads(line) for line in lines if line.strip()]
+    if group > 1:
+        items = [items[start:start + group] for start in range(0, len(items), group)]
+    return [payloads.encode_payload(item) for item in items]
+
+
+def median_us_per_item(func, items, rounds):
+    """Median over ``rounds`` of the time func() takes per item, in microseconds."""
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for item in items:
+            func(item)
+        timings.append((time.perf_counter() - started) / len(items) * 1e6)
+    return statistics.median(timings)
+
+
+def main():
+    args = parse_args()
+    bodies = load_bodies(args.input, args.group)
+    if not bodies:
+        sys.exit(f"No payloads in {args.input}")
+
+    min_bytes = settings.WEBHOOK_PAYLOAD_COMPRESSION_MIN_BYTES if args.min_bytes is None else args.min_bytes
+    raw_total = sum(len(body) for body in bodies)
+    sizes = sorted(len(body) for body in bodies)
+
+    print(f"{len(bodies)} payloads from {args.input}: {raw_total:,} bytes, "
+          f"median {sizes[len(sizes) // 2]:,} B, max {sizes[-1]:,} B, min-bytes {min_bytes}")
+    print(f"{'codec':<8} {'level':>5} {'stored':>12} {'ratio':>7} {'compressed':>11} "
+          f"{'compress':>12} {'decompress':>12} {'gzip transport':>15}")
+    print(f"{'none':<8} {'':>5} {raw_total:>12,} {1:>7.2f} {'0%':>11} {'-':>12} {'-':>12} "
+          f"{median_us_per_item(lambda body: payloads.transport_body(body, True), bodies, args.rounds):>12.1f} us")
+
+    for codec, level in CODECS:
+        if codec == 'zstd' and payloads.zstandard is None:
+            print(f"{codec:<8} {level:>5}  skipped (pip install zstandard)")
+            continue
+
+        with override_settings(
+            WEBHOOK_PAYLOAD_COMPRESSION_MIN_BYTES=min_bytes,
+            WEBHOOK_GZIP_LEVEL=level if codec == 'gzip' else settings.WEBHOOK_GZIP_LEVEL,
+            WEBHOOK_ZSTD_LEVEL=level if codec == 'zstd' else settings.WEBHOOK_ZSTD_LEVEL,
+        ):
+            stored = [payloads.compress_body(body, codec) for body in bodies]
+            stored_total = sum(len(body) for body in stored)
+            compressed_share = sum(1 for body, kept in zip(bodies, stored) if kept is not body) / len(bodies)
+
+            compress_us = median_us_per_item(lambda body: payloads.compress_body(body, codec), bodies, args.rounds)
+            decompress_us = median_us_per_item(payloads.decompress_body, stored, args.rounds)
+            transport_us = median_us_per_item(lambda body: payloads.transport_body(body, True), stored, args.rounds)
+
+        print(f"{codec:<8} {level:>5} {stored_total:>12,} {raw_total / stored_total:>7.2f} "
+              f"{compressed_share:>10.0%} {compress_us:>9.1f} us {decompress_us:>9.1f} us {transport_us:>12.1f} us")
+
+
+if __name__ == '__main__':
+    main()
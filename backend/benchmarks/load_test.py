@@ -0,0 +1,316 @@
+"""
+End-to-end load test: ingest events at a target rate and deliver them to
+local stand-in receivers, then report latency, throughput and SQL cost.
+
+Everything runs in this one process, against a throwaway test database
+(test_<NAME>, or a temporary SQLite file that is removed afterwards), never
+your real data:
+
+    cd backend
+    python benchmarks/load_test.py --events 2000 --rate 200 --workers 4
+    python benchmarks/load_test.py --mix fast=50,slow=20,flaky=20,hang=10 --timeout 2
+    DATABASE_URL=postgresql://... CELERY_BROKER_URL=redis://... python benchmarks/load_test.py
+
+How it works:
+    - the Django app is served on a random local port (threaded WSGI server),
+      including the fake receivers at /api/receivers/<fast|slow|flaky|hang>/
+    - destinations point at a mix of those receivers (--mix)
+    - client threads POST /api/events/ over HTTP at --rate events/sec
+    - instead of going through the broker, accepted events are put on an
+      in-memory queue; --workers threads run process_webhook_event on them
+      eagerly (Celery's task.apply()), exactly as a worker would
+    - Redis (circuit breaker, rate limits, latency, metrics) is used when it
+      is reachable; otherwise those fail open like they do in production
+
+Retries and deferrals go back on the in-memory queue right away instead of
+through the Redis retry schedule, so flaky and hanging receivers show the
+cost of every attempt, not the backoff between them.
+
+Reported: ingest p50/p99, end-to-end delivery latency p50/p99 (POST sent ->
+final status), deliveries/sec per worker, and SQL queries per event for
+ingestion and delivery.
+"""
+import argparse
+import logging
+import os
+import queue
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+os.environ['WEBHOOK_FAKE_RECEIVERS'] = 'True'
+os.environ.setdefault('WEBHOOK_DELIVERY_MODE', 'celery')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=100, help='target ingestion rate, events/sec')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent ingestion clients')
+    parser.add_argument('--workers', type=int, default=4, help='delivery worker threads')
+    parser.add_argument('--destinations', type=int, default=20)
+    parser.add_argument('--mix', default='fast=70,slow=15,flaky=10,hang=5',
+                        help='share of destinations per receiver kind')
+    parser.add_argument('--slow-ms', type=int, default=200)
+    parser.add_argument('--failure-rate', type=float, default=0.3, help='for the flaky receivers')
+    parser.add_argument('--timeout', type=float, default=2,
+                        help='delivery read timeout cap in seconds (WEBHOOK_READ_TIMEOUT_MAX)')
+    parser.add_argument('--payload-bytes', type=int, default=512)
+    parser.add_argument('--verbose', action='store_true', help='keep application logging on')
+    return parser.parse_args()
+
+
+args = parse_args()
+os.environ['WEBHOOK_READ_TIMEOUT_MAX'] = str(args.timeout)
+os.environ.setdefault('WEBHOOK_CONNECT_TIMEOUT_MAX', str(args.timeout))
+
+import django  # noqa: E402
+
+django.setup()
+
+import redis  # noqa: E402
+import requests  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.core.handlers.wsgi import WSGIHandler  # noqa: E402
+from django.core.servers.basehttp import ThreadedWSGIServer  # noqa: E402
+from django.db import close_old_connections, connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.testcases import QuietWSGIRequestHandler  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+
+from delivery.models import Destination, Event  # noqa: E402
+from delivery.redis_client import get_redis  # noqa: E402
+from delivery.tasks import process_webhook_event  # noqa: E402
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+def parse_mix(mix):
+    shares = {}
+    for part in mix.split(','):
+        kind, _, share = part.partition('=')
+        shares[kind.strip()] = float(share)
+    return shares
+
+
+def create_test_database():
+    """Returns the database name to restore afterwards, and a temporary directory to remove (SQLite)."""
+    temp_dir = None
+    if connection.vendor == 'sqlite':
+        # A file (not :memory:) so the server and worker threads all see the same data.
+        # The configured db.sqlite3 is swapped out too: any connection opened around
+        # the test database (e.g. while tearing down) would create it empty otherwise
+        temp_dir = tempfile.mkdtemp(prefix='load_test-')
+        connection.settings_dict['NAME'] = os.path.join(temp_dir, 'unused.sqlite3')
+        connection.settings_dict['TEST']['NAME'] = os.path.join(temp_dir, 'load_test.sqlite3')
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
+    return old_name, temp_dir
+
+
+def start_server():
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietWSGIRequestHandler, allow_reuse_address=False)
+    server.daemon_threads = True
+    server.set_app(WSGIHandler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def create_destinations(base_url, count, shares):
+    total = sum(shares.values())
+    kinds = []
+    for kind, share in shares.items():
+        kinds += [kind] * round(count * share / total)
+    kinds = kinds[:count] or ['fast']
+
+    query = {
+        'fast': '',
+        'slow': f'?delay_ms={args.slow_ms}',
+        'flaky': f'?failure_rate={args.failure_rate}',
+        'hang': f'?delay_ms={int(args.timeout * 1000 * 10)}',
+    }
+    destinations = Destination.objects.bulk_create([
+        Destination(url=f"{base_url}/api/receivers/{kind}/{query[kind]}") for kind in kinds
+    ])
+    return [(destination, kind) for destination, kind in zip(destinations, kinds)]
+
+
+def measure_ingest_queries(destination, payload, samples=20):
+    """SQL queries per POST /api/events/, measured in this thread with the test client."""
+    client = Client()
+    with mock.patch('delivery.views.enqueue_deliveries'), CaptureQueriesContext(connection) as queries:
+        for _ in range(samples):
+            client.post('/api/events/', {'destination': str(destination.id), 'payload': payload},
+                        content_type='application/json')
+    Event.objects.all().delete()
+    return len(queries) / samples
+
+
+class Workers:
+    """Delivery worker threads fed from an in-memory queue instead of the broker."""
+
+    def __init__(self, count):
+        self.queue = queue.Queue()
+        self.finished = {}          # event id -> monotonic time its delivery task returned
+        self.queries = Counter()    # worker index -> SQL queries run
+        self.delivered = Counter()  # worker index -> tasks run
+        self.busy = Counter()       # worker index -> seconds spent delivering
+        self.threads = [threading.Thread(target=self.run, args=(index,), daemon=True) for index in range(count)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def enqueue(self, events):
+        for event in events:
+            self.queue.put((str(event.id), 0))
+
+    def schedule(self, task, args, delay, retries, queue):
+        # Stands in for delivery.scheduler.schedule(): no waiting for the backoff
+        self.queue.put((args[0], retries))
+        return 0
+
+    def stop(self):
+        self.queue.join()
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def run(self, index):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            event_id, retries = item
+            started = time.monotonic()
+            try:
+                with CaptureQueriesContext(connection) as queries:
+                    process_webhook_event.apply(args=(event_id,), retries=retries)
+                self.queries[index] += len(queries)
+            finally:
+                finished = time.monotonic()
+                self.finished[event_id] = finished
+                self.delivered[index] += 1
+                self.busy[index] += finished - started
+                close_old_connections()
+                self.queue.task_done()
+        connection.close()
+
+
+def ingest(base_url, destinations, payload):
+    """POST every event at the target rate; returns {event id: (sent_at, latency)}."""
+    session = requests.Session()
+    results = {}
+    lock = threading.Lock()
+    started = time.monotonic()
+
+    def send(index):
+        due = started + index / args.rate
+        time.sleep(max(0, due - time.monotonic()))
+        destination, _ = destinations[index % len(destinations)]
+        sent_at = time.monotonic()
+        response = session.post(
+            f"{base_url}/api/events/",
+            json={'destination': str(destination.id), 'payload': payload},
+            timeout=30,
+        )
+        latency = time.monotonic() - sent_at
+        if response.status_code == 202:
+            with lock:
+                results[response.json()['task_id']] = (sent_at, latency)
+
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        list(pool.map(send, range(args.events)))
+
+    elapsed = time.monotonic() - started
+    return results, elapsed
+
+
+def report(results, ingest_seconds, workers, ingest_queries, destinations):
+    ingest_ms = [latency * 1000 for _, latency in results.values()]
+    end_to_end_ms = [
+        (workers.finished[event_id] - sent_at) * 1000
+        for event_id, (sent_at, _) in results.items() if event_id in workers.finished
+    ]
+    delivered = sum(workers.delivered.values())
+    busy = sum(workers.busy.values())
+    per_worker = [
+        workers.delivered[index] / workers.busy[index]
+        for index in range(len(workers.threads)) if workers.busy[index]
+    ]
+
+    kinds = Counter(kind for _, kind in destinations)
+    statuses = Counter(Event.objects.values_list('status', flat=True))
+
+    print(f"\nDatabase: {connection.vendor}, destinations: {dict(kinds)}")
+    print(f"Ingested {len(results)}/{args.events} events in {ingest_seconds:.2f}s "
+          f"({len(results) / ingest_seconds:.1f}/s, target {args.rate}/s)")
+    print(f"  ingest latency      p50 {percentile(ingest_ms, 50):8.2f} ms   p99 {percentile(ingest_ms, 99):8.2f} ms")
+    print(f"  end-to-end delivery p50 {percentile(end_to_end_ms, 50):8.2f} ms   "
+          f"p99 {percentile(end_to_end_ms, 99):8.2f} ms")
+    print(f"  deliveries/sec per worker: {statistics.mean(per_worker) if per_worker else 0:.1f} "
+          f"({args.workers} workers, {delivered} tasks, {busy:.1f} worker-seconds busy)")
+    print(f"  SQL queries per event: ingest {ingest_queries:.1f}, "
+          f"delivery {sum(workers.queries.values()) / max(delivered, 1):.1f} (including retries)")
+    print(f"  final statuses: {dict(statuses)}")
+
+
+def main():
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    try:
+        get_redis().ping()
+        print(f"Redis: {settings.WEBHOOK_REDIS_URL}")
+    except redis.RedisError:
+        print("Redis: unavailable (circuit breaker, rate limits and metrics fail open)")
+
+    old_name, temp_dir = create_test_database()
+    server = None
+    try:
+        server, base_url = start_server()
+        destinations = create_destinations(base_url, args.destinations, parse_mix(args.mix))
+        payload = {'data': 'x' * args.payload_bytes}
+
+        ingest_queries = measure_ingest_queries(destinations[0][0], payload)
+
+        workers = Workers(args.workers)
+        workers.start()
+        with mock.patch('delivery.views.enqueue_deliveries', side_effect=workers.enqueue), \
+                mock.patch('delivery.tasks.scheduler.schedule', side_effect=workers.schedule):
+            print(f"Sending {args.events} events at {args.rate}/s to {base_url} ...")
+            results, ingest_seconds = ingest(base_url, destinations, payload)
+            workers.stop()
+
+        report(results, ingest_seconds, workers, ingest_queries, destinations)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        connection.close()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Query plans for the hot Event / DeliveryAttempt access patterns,
+with and without the indexes added in migration 0007.
+
+Runs against a throwaway test database (test_<NAME>), never your real data:
+
+    cd backend
+    python benchmarks/query_plans.py --events 200000
+    DATABASE_URL=postgresql://... python benchmarks/query_plans.py --events 1000000
+
+For every query it prints the plan and median time WITH the indexes, then
+drops them inside a transaction that gets rolled back, and prints the plan
+and time WITHOUT them. The drop happens on a fresh connection: SQLite's
+statement cache would otherwise keep answering EXPLAIN with the plans it
+already has, so on SQLite the test database is a temporary file instead of
+the usual in-memory one (which wouldn't survive closing the connection).
+"""
+import argparse
+import os
+import random
+import statistics
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection, transaction  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from delivery.models import DeliveryAttempt, Destination, Event  # noqa: E402
+
+STATUSES = ['SUCCESS'] * 85 + ['FAILED'] * 8 + ['PENDING'] * 5 + ['PROCESSING'] * 2
+
+
+def seed(event_count, destination_count, days):
+    """Spread events and attempts over the last ``days`` days."""
+    now = timezone.now()
+    destinations = Destination.objects.bulk_create(
+        [Destination(url=f'http://receiver-{i}:8000/hook') for i in range(destination_count)]
+    )
+
+    # created_at / timestamp are auto_now_add; turn that off so we can backdate rows
+    Event._meta.get_field('created_at').auto_now_add = False
+    DeliveryAttempt._meta.get_field('timestamp').auto_now_add = False
+
+    batch = 5000
+    for start in range(0, event_count, batch):
+        events = []
+        attempts = []
+        for _ in range(min(batch, event_count - start)):
+            created_at = now - timedelta(seconds=random.randint(0, days * 86400))
+            status = random.choice(STATUSES)
+            event = Event(
+                id=uuid.uuid4(),
+                destination=random.choice(destinations),
+                payload={'n': start},
+                status=status,
+                attempts_count=1,
+                next_attempt_at=now + timedelta(minutes=random.randint(-5, 5)) if status == 'PROCESSING' else None,
+                created_at=created_at,
+            )
+            events.append(event)
+            attempts.append(DeliveryAttempt(
+                event=event,
+                status='SUCCESS' if status == 'SUCCESS' else 'FAILED',
+                response_status_code=200 if status == 'SUCCESS' else 500,
+                timestamp=created_at + timedelta(seconds=1),
+            ))
+        Event.objects.bulk_create(events)
+        DeliveryAttempt.objects.bulk_create(attempts)
+
+    return destinations
+
+
+def queries(destinations):
+    now = timezone.now()
+    sample_event = Event.objects.order_by('?').only('id').first()
+    return {
+        'failed events, newest first': lambda: Event.objects.filter(status='FAILED').order_by('-created_at')[:50],
+        'destination history, last 24h': lambda: Event.objects.filter(
+            destination=destinations[0], created_at__gte=now - timedelta(days=1)
+        ).order_by('-created_at')[:50],
+        'due retries': lambda: Event.objects.filter(status='PROCESSING', next_attempt_at__lte=now)[:100],
+        "an event's attempts": lambda: DeliveryAttempt.objects.filter(event=sample_event).order_by('timestamp'),
+        'attempts older than 30 days': lambda: DeliveryAttempt.objects.filter(
+            timestamp__lt=now - timedelta(days=30)
+        ).only('id')[:1000],
+    }
+
+
+def measure(build_queryset, runs):
+    plan = build_queryset().explain(**({'analyze': True} if connection.vendor == 'postgresql' else {}))
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        list(build_queryset())
+        timings.append((time.perf_counter() - started) * 1000)
+    return plan, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--destinations', type=int, default=50)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    old_name = connection.settings_dict['NAME']
+    temp_dir = None
+    if connection.vendor == 'sqlite':
+        temp_dir = tempfile.mkdtemp(prefix='query_plans-')
+        connection.settings_dict['TEST']['NAME'] = os.path.join(temp_dir, 'query_plans.sqlite3')
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        print(f"Seeding {args.events} events on {connection.vendor}...")
+        destinations = seed(args.events, args.destinations, args.days)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        workload = queries(destinations)
+        with_indexes = {name: measure(build, args.runs) for name, build in workload.items()}
+
+        index_names = [index.name for model in (Event, DeliveryAttempt) for index in model._meta.indexes]
+        connection.close()
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for name in index_names:
+                    cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+            without_indexes = {name: measure(build, args.runs) for name, build in workload.items()}
+            transaction.set_rollback(True)
+
+        for name in with_indexes:
+            before_plan, before_ms = without_indexes[name]
+            after_plan, after_ms = with_indexes[name]
+            print(f"\n=== {name}")
+            print(f"--- before (no indexes): {before_ms:.2f} ms\n{before_plan}")
+            print(f"--- after (indexes):     {after_ms:.2f} ms\n{after_plan}")
+            if before_plan == after_plan:
+                print("(same plan: the indexes aren't used for this query)")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
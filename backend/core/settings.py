@@ -1,6 +1,9 @@
 import os
 from pathlib import Path
 
+from celery.schedules import crontab
+from kombu import Queue
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = os.environ.get('SECRET_KEY', 'django-insecure-1k9ngt$sn7^dogzr3cor#()rtr_9=w1ov9tlh6kvb-ca394pqe')
@@ -114,5 +117,146 @@ CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 300      
 CELERY_TASK_SOFT_TIME_LIMIT = 240 
 
+# Periodic tasks run by the celery_beat service
+CELERY_BEAT_SCHEDULE = {
+    'create-future-partitions': {
+        'task': 'delivery.tasks.create_future_partitions',
+        'schedule': crontab(hour=0, minute=30),
+    },
+    'dispatch-due-retries': {
+        'task': 'delivery.tasks.dispatch_due_retries',
+        'schedule': float(os.environ.get('WEBHOOK_RETRY_DISPATCH_INTERVAL', 1)),
+        'options': {'expires': 10},
+    },
+    'purge-expired-events': {
+        'task': 'delivery.tasks.purge_expired_events',
+        'schedule': crontab(minute=15),  # hourly, so each run has a small backlog
+    },
+}
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+
+# Webhook delivery settings
+
+# Max number of events accepted by a single POST /api/events/bulk/ request
+WEBHOOK_BULK_MAX_EVENTS = int(os.environ.get('WEBHOOK_BULK_MAX_EVENTS', 1000))
+
+# Pooled HTTP client used by the delivery worker (delivery/http_client.py)
+WEBHOOK_HTTP_POOL_SIZE = int(os.environ.get('WEBHOOK_HTTP_POOL_SIZE', 100))                              # destination origins kept open per worker process
+WEBHOOK_HTTP_MAX_CONNECTIONS_PER_HOST = int(os.environ.get('WEBHOOK_HTTP_MAX_CONNECTIONS_PER_HOST', 10))  # keep-alive connections per origin
+WEBHOOK_HTTP_IDLE_TIMEOUT = float(os.environ.get('WEBHOOK_HTTP_IDLE_TIMEOUT', 90))                        # seconds before an unused origin is closed
+
+# Idempotent ingestion (delivery/idempotency.py)
+WEBHOOK_IDEMPOTENCY_TTL = int(os.environ.get('WEBHOOK_IDEMPOTENCY_TTL', 24 * 60 * 60))  # seconds a key stays in the Redis fast path
+
+# Payload compression (delivery/payloads.py)
+WEBHOOK_PAYLOAD_COMPRESSION = os.environ.get('WEBHOOK_PAYLOAD_COMPRESSION', '')                          # '', 'gzip' or 'zstd' (needs zstandard): store new payloads compressed
+WEBHOOK_PAYLOAD_COMPRESSION_MIN_BYTES = int(os.environ.get('WEBHOOK_PAYLOAD_COMPRESSION_MIN_BYTES', 1024))  # smaller bodies are stored as-is
+WEBHOOK_GZIP_LEVEL = int(os.environ.get('WEBHOOK_GZIP_LEVEL', 6))                                        # storage and Content-Encoding: gzip deliveries
+WEBHOOK_ZSTD_LEVEL = int(os.environ.get('WEBHOOK_ZSTD_LEVEL', 3))
+
+# Captured destination responses (delivery/response_bodies.py)
+WEBHOOK_RESPONSE_CAPTURE_BYTES = int(os.environ.get('WEBHOOK_RESPONSE_CAPTURE_BYTES', 1024))        # read at most this much of a response body, then close
+WEBHOOK_RESPONSE_BODY_CACHE_SIZE = int(os.environ.get('WEBHOOK_RESPONSE_BODY_CACHE_SIZE', 10000))   # body hashes each process remembers as already stored
+WEBHOOK_RESPONSE_BODY_CACHE_TTL = int(os.environ.get('WEBHOOK_RESPONSE_BODY_CACHE_TTL', 3600))      # seconds; keep well below the shortest retention period
+
+# How events get delivered:
+#   'celery' -> one process_webhook_event task per event (default)
+#   'async'  -> python manage.py run_delivery_engine, many in-flight deliveries per process
+WEBHOOK_DELIVERY_MODE = os.environ.get('WEBHOOK_DELIVERY_MODE', 'celery')
+WEBHOOK_ASYNC_CONCURRENCY = int(os.environ.get('WEBHOOK_ASYNC_CONCURRENCY', 200))      # max in-flight deliveries per engine process
+WEBHOOK_ASYNC_BATCH_SIZE = int(os.environ.get('WEBHOOK_ASYNC_BATCH_SIZE', 100))        # max events claimed per database poll
+WEBHOOK_ASYNC_POLL_INTERVAL = float(os.environ.get('WEBHOOK_ASYNC_POLL_INTERVAL', 1))  # seconds to sleep when nothing is due
+
+# Redis used for state shared by every worker replica (circuit breakers, rate limits, ...)
+WEBHOOK_REDIS_URL = os.environ.get('WEBHOOK_REDIS_URL', CELERY_BROKER_URL)
+WEBHOOK_REDIS_SOCKET_TIMEOUT = float(os.environ.get('WEBHOOK_REDIS_SOCKET_TIMEOUT', 2))
+
+# How POST /api/events/ stores events:
+#   'direct' -> INSERT before answering (default)
+#   'stream' -> append to a Redis stream and answer; python manage.py run_ingest_persister writes them (delivery/ingest_stream.py)
+WEBHOOK_INGEST_MODE = os.environ.get('WEBHOOK_INGEST_MODE', 'direct')
+WEBHOOK_INGEST_BATCH_SIZE = int(os.environ.get('WEBHOOK_INGEST_BATCH_SIZE', 500))           # entries persisted per bulk_create
+WEBHOOK_INGEST_BLOCK_MS = int(os.environ.get('WEBHOOK_INGEST_BLOCK_MS', 1000))              # XREADGROUP wait; keep below WEBHOOK_REDIS_SOCKET_TIMEOUT
+WEBHOOK_INGEST_CLAIM_IDLE_MS = int(os.environ.get('WEBHOOK_INGEST_CLAIM_IDLE_MS', 60000))   # entries a persister left pending this long are taken over
+WEBHOOK_INGEST_MAX_LAG = int(os.environ.get('WEBHOOK_INGEST_MAX_LAG', 100000))              # unpersisted entries before the API answers 503
+WEBHOOK_INGEST_RETRY_AFTER = int(os.environ.get('WEBHOOK_INGEST_RETRY_AFTER', 5))           # Retry-After (seconds) sent with that 503
+
+# Per-destination circuit breaker (delivery/circuit_breaker.py)
+WEBHOOK_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('WEBHOOK_CIRCUIT_FAILURE_THRESHOLD', 5))  # consecutive failures before opening
+WEBHOOK_CIRCUIT_COOLDOWN = int(os.environ.get('WEBHOOK_CIRCUIT_COOLDOWN', 60))                   # seconds open before a probe is allowed
+WEBHOOK_CIRCUIT_PROBE_TIMEOUT = int(os.environ.get('WEBHOOK_CIRCUIT_PROBE_TIMEOUT', 45))         # seconds before a lost probe can be retaken
+
+# Per-destination rate limits / concurrency caps (delivery/rate_limits.py)
+WEBHOOK_THROTTLE_RETRY_DELAY = float(os.environ.get('WEBHOOK_THROTTLE_RETRY_DELAY', 1))            # base seconds to defer a delivery over its concurrency cap
+WEBHOOK_CONCURRENCY_LEASE_SECONDS = int(os.environ.get('WEBHOOK_CONCURRENCY_LEASE_SECONDS', 60))  # a slot held longer than this is reclaimed
+
+# Ordered (FIFO) delivery for Destination.ordered (delivery/ordering.py)
+WEBHOOK_ORDERED_LEASE_SECONDS = int(os.environ.get('WEBHOOK_ORDERED_LEASE_SECONDS', 120))  # keep above one delivery's connect + read timeouts
+WEBHOOK_ORDERED_MAX_PER_RUN = int(os.environ.get('WEBHOOK_ORDERED_MAX_PER_RUN', 100))      # events one deliver_ordered run sends before handing over
+WEBHOOK_ORDERED_MAX_SECONDS_PER_RUN = int(os.environ.get('WEBHOOK_ORDERED_MAX_SECONDS_PER_RUN', 150))  # ...or after this long (plus one delivery, below CELERY_TASK_SOFT_TIME_LIMIT)
+WEBHOOK_ORDERED_RETRY_DELAY = int(os.environ.get('WEBHOOK_ORDERED_RETRY_DELAY', 5))        # seconds to wait when the lease can't be taken (Redis down)
+
+# After a secret rotation, deliveries are signed with the old secret too for this long
+WEBHOOK_SECRET_ROTATION_GRACE_SECONDS = int(os.environ.get('WEBHOOK_SECRET_ROTATION_GRACE_SECONDS', 24 * 60 * 60))
+
+# Buffered DeliveryAttempt writes (delivery/attempt_recorder.py). 0 = one INSERT per attempt
+WEBHOOK_ATTEMPT_BUFFER_SIZE = int(os.environ.get('WEBHOOK_ATTEMPT_BUFFER_SIZE', 0))            # flush after this many attempts
+WEBHOOK_ATTEMPT_FLUSH_INTERVAL = float(os.environ.get('WEBHOOK_ATTEMPT_FLUSH_INTERVAL', 1))    # ...or after this many seconds
+WEBHOOK_ATTEMPT_SPOOL_DIR = os.environ.get('WEBHOOK_ATTEMPT_SPOOL_DIR') or None                # set to enable the crash-safe spool files
+WEBHOOK_ATTEMPT_SPOOL_FSYNC = os.environ.get('WEBHOOK_ATTEMPT_SPOOL_FSYNC', 'False') == 'True'  # fsync every spooled attempt (survives power loss too)
+
+# Optional monthly table partitioning, PostgreSQL only (delivery/partitioning.py)
+# e.g. WEBHOOK_PARTITIONED_MODELS=deliveryattempt or event,deliveryattempt
+WEBHOOK_PARTITIONED_MODELS = [name for name in os.environ.get('WEBHOOK_PARTITIONED_MODELS', '').split(',') if name]
+WEBHOOK_PARTITION_MONTHS_AHEAD = int(os.environ.get('WEBHOOK_PARTITION_MONTHS_AHEAD', 3))
+
+# Retention (delivery/retention.py): days to keep events per status before archiving + deleting
+WEBHOOK_RETENTION_DAYS = {
+    'SUCCESS': int(os.environ.get('WEBHOOK_RETENTION_SUCCESS_DAYS', 7)),
+    'FAILED': int(os.environ.get('WEBHOOK_RETENTION_FAILED_DAYS', 30)),
+}
+WEBHOOK_ARCHIVE_DIR = os.environ.get('WEBHOOK_ARCHIVE_DIR', str(BASE_DIR / 'archives'))
+WEBHOOK_RETENTION_CHUNK_SIZE = int(os.environ.get('WEBHOOK_RETENTION_CHUNK_SIZE', 1000))  # events archived + deleted per transaction
+WEBHOOK_RETENTION_MAX_SECONDS = int(os.environ.get('WEBHOOK_RETENTION_MAX_SECONDS', 180))  # time budget per run (below CELERY_TASK_SOFT_TIME_LIMIT)
+
+# GET /api/events/ cursor pagination
+WEBHOOK_EVENTS_PAGE_SIZE = int(os.environ.get('WEBHOOK_EVENTS_PAGE_SIZE', 100))
+WEBHOOK_EVENTS_MAX_PAGE_SIZE = int(os.environ.get('WEBHOOK_EVENTS_MAX_PAGE_SIZE', 1000))
+
+# Events per server-side cursor fetch for the NDJSON export (delivery/exports.py)
+WEBHOOK_EXPORT_CHUNK_SIZE = int(os.environ.get('WEBHOOK_EXPORT_CHUNK_SIZE', 2000))
+
+# Adaptive delivery timeouts from observed latency (delivery/latency.py), in seconds
+WEBHOOK_CONNECT_TIMEOUT_MAX = float(os.environ.get('WEBHOOK_CONNECT_TIMEOUT_MAX', 10))  # not adapted: the estimate is of whole requests
+WEBHOOK_READ_TIMEOUT_MIN = float(os.environ.get('WEBHOOK_READ_TIMEOUT_MIN', 2))
+WEBHOOK_READ_TIMEOUT_MAX = float(os.environ.get('WEBHOOK_READ_TIMEOUT_MAX', 30))   # also used until enough samples exist
+WEBHOOK_LATENCY_MIN_SAMPLES = int(os.environ.get('WEBHOOK_LATENCY_MIN_SAMPLES', 5))
+WEBHOOK_TIMEOUT_LEASE_MARGIN = float(os.environ.get('WEBHOOK_TIMEOUT_LEASE_MARGIN', 5))  # per-destination overrides stay this far below the shortest lease
+
+# Delayed retries / deferrals kept in Redis until due (delivery/scheduler.py)
+WEBHOOK_RETRY_JITTER = float(os.environ.get('WEBHOOK_RETRY_JITTER', 0.2))                       # +/- this fraction of every delay
+WEBHOOK_RETRY_DISPATCH_BATCH = int(os.environ.get('WEBHOOK_RETRY_DISPATCH_BATCH', 500))         # published per producer round trip
+WEBHOOK_RETRY_VISIBILITY_TIMEOUT = int(os.environ.get('WEBHOOK_RETRY_VISIBILITY_TIMEOUT', 60))  # seconds before a lost dispatch is retaken
+
+# Delivery queue routing (delivery/routing.py)
+# Standard-tier destinations are spread over WEBHOOK_DELIVERY_SHARDS queues by a hash of their id;
+# a destination can be pinned to one of WEBHOOK_ISOLATED_QUEUES through its delivery_queue field
+WEBHOOK_DELIVERY_SHARDS = int(os.environ.get('WEBHOOK_DELIVERY_SHARDS', 4))
+WEBHOOK_ISOLATED_QUEUES = [
+    name.strip() for name in os.environ.get('WEBHOOK_ISOLATED_QUEUES', 'deliveries.isolated').split(',') if name.strip()
+]
+WEBHOOK_DELIVERY_QUEUES = (
+    ['deliveries.priority']
+    + [f'deliveries.shard{n}' for n in range(WEBHOOK_DELIVERY_SHARDS)]
+    + ['deliveries.bulk']
+    + WEBHOOK_ISOLATED_QUEUES
+)
+
+# A worker started without -Q consumes all of these, taking turns between queues
+CELERY_TASK_DEFAULT_QUEUE = 'celery'
+CELERY_TASK_QUEUES = [Queue(name) for name in [CELERY_TASK_DEFAULT_QUEUE] + WEBHOOK_DELIVERY_QUEUES]
+
+# Serve the fake receivers used by benchmarks/load_test.py under /api/receivers/ (never in production)
+WEBHOOK_FAKE_RECEIVERS = os.environ.get('WEBHOOK_FAKE_RECEIVERS', 'False') == 'True'
@@ -1,7 +1,11 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from delivery.views import DestinationViewSet, EventViewSet, echo_webhook
+from delivery.views import (
+    DestinationViewSet, EventTypeViewSet, EventViewSet, MessageViewSet, SubscriptionViewSet, echo_webhook,
+    fake_receiver, metrics_view,
+)
 
 
 router = DefaultRouter()
@@ -9,6 +13,9 @@ router = DefaultRouter()
 
 router.register(r'destinations', DestinationViewSet)
 router.register(r'events', EventViewSet)
+router.register(r'event-types', EventTypeViewSet)
+router.register(r'subscriptions', SubscriptionViewSet)
+router.register(r'messages', MessageViewSet)
 
 
 urlpatterns = [
@@ -16,6 +23,9 @@ urlpatterns = [
     # http://localhost:8000/admin/ 
     path('admin/', admin.site.urls),
     
+    # Prometheus scrape endpoint
+    path('metrics', metrics_view, name='metrics'),
+
     # Echo endpoint for testing webhook deliveries
     path('api/echo/', echo_webhook, name='echo_webhook'),
     
@@ -24,3 +34,6 @@ urlpatterns = [
     path('api/', include(router.urls)),
 ]
 
+if settings.WEBHOOK_FAKE_RECEIVERS:
+    # Stand-in destinations for load tests (benchmarks/load_test.py)
+    urlpatterns.append(path('api/receivers/<str:behavior>/', fake_receiver, name='fake_receiver'))
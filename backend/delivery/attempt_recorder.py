@@ -0,0 +1,191 @@
+"""
+Buffered writer for DeliveryAttempt rows.
+
+By default every attempt is its own INSERT (WEBHOOK_ATTEMPT_BUFFER_SIZE = 0).
+With buffering on, attempts are collected in memory and written with one
+bulk_create when any of these happens:
+    - WEBHOOK_ATTEMPT_BUFFER_SIZE rows are buffered
+    - WEBHOOK_ATTEMPT_FLUSH_INTERVAL seconds have passed
+    - the worker process shuts down
+
+Response bodies go to the content-addressed ResponseBody table
+(delivery/response_bodies.py) right before the attempts that reference them.
+
+Crash safety (WEBHOOK_ATTEMPT_SPOOL_DIR set): every attempt is first appended
+to a per-process NDJSON spool file, which is emptied after each successful
+flush. Each process holds an exclusive lock on its own spool file; when a
+worker starts it replays (and removes) any spool file whose lock is free,
+i.e. whose owner died before flushing. Replay is at-least-once: a crash
+between bulk_create and emptying the spool can log an attempt twice.
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from celery.signals import worker_process_init, worker_process_shutdown
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.utils.dateparse import parse_datetime
+
+from . import response_bodies
+from .models import DeliveryAttempt
+
+logger = logging.getLogger(__name__)
+
+
+class AttemptRecorder:
+
+    def __init__(self, batch_size, flush_interval, spool_dir=None, spool_fsync=False):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_dir = Path(spool_dir) if spool_dir else None
+        self.spool_fsync = spool_fsync
+
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._pid = None
+        self._spool = None
+        self._flusher = None
+
+    @property
+    def enabled(self):
+        return self.batch_size > 0
+
+    def record(self, **fields):
+        """Log one attempt; ``fields`` are DeliveryAttempt model fields."""
+        if not self.enabled:
+            DeliveryAttempt.objects.create(**response_bodies.store([fields])[0])
+            return
+
+        with self._lock:
+            self._ensure_process_state()
+            if self._spool is not None:
+                self._spool.write(json.dumps(fields, cls=DjangoJSONEncoder) + '\n')
+                self._spool.flush()
+                if self.spool_fsync:
+                    os.fsync(self._spool.fileno())
+            self._buffer.append(fields)
+            should_flush = (
+                len(self._buffer) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+
+        if should_flush:
+            self.flush()
+
+    def record_many(self, rows):
+        """Log several attempts at once (one bulk_create when buffering is off)."""
+        if not self.enabled:
+            DeliveryAttempt.objects.bulk_create([DeliveryAttempt(**fields) for fields in response_bodies.store(rows)])
+            return
+        for fields in rows:
+            self.record(**fields)
+
+    def flush(self):
+        """Write everything buffered so far with a single bulk_create."""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._buffer:
+                return
+
+            rows = self._buffer
+            try:
+                response_bodies.store(rows)
+                DeliveryAttempt.objects.bulk_create([DeliveryAttempt(**fields) for fields in rows])
+            except Exception:
+                # Keep the rows (and the spool) so the next flush tries again
+                logger.exception(f"Failed to flush {len(rows)} delivery attempts")
+                return
+
+            self._buffer = []
+            if self._spool is not None:
+                self._spool.seek(0)
+                self._spool.truncate()
+
+    def replay_spools(self):
+        """
+        Write out attempts left in spool files by worker processes that died.
+
+        Must run before this process records anything (it's hooked to worker start).
+        """
+        if self.spool_dir is None:
+            return
+
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        for path in self.spool_dir.glob('attempts-*.ndjson'):
+            with open(path, 'r+') as spool:
+                try:
+                    fcntl.flock(spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # owned by a live process
+
+                rows = [json.loads(line) for line in spool if line.strip()]
+                if rows:
+                    response_bodies.store(rows)
+                    DeliveryAttempt.objects.bulk_create([self._from_spool(row) for row in rows])
+                    logger.warning(f"Replayed {len(rows)} delivery attempts from {path}")
+                path.unlink()
+
+    def _from_spool(self, row):
+        if isinstance(row.get('timestamp'), str):
+            row['timestamp'] = parse_datetime(row['timestamp'])
+        return DeliveryAttempt(**row)
+
+    def _spool_path(self):
+        return self.spool_dir / f'attempts-{os.getpid()}.ndjson'
+
+    def _ensure_process_state(self):
+        # Buffers, spool handles and threads don't survive a fork: start fresh per process
+        if self._pid == os.getpid():
+            return
+
+        self._pid = os.getpid()
+        self._buffer = []
+        self._spool = None
+
+        if self.spool_dir is not None:
+            self.spool_dir.mkdir(parents=True, exist_ok=True)
+            self._spool = open(self._spool_path(), 'a+')
+            fcntl.flock(self._spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def _flush_periodically(self):
+        # Makes sure a quiet worker still writes its last few attempts out in time
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                logger.exception("Periodic delivery attempt flush failed")
+
+
+recorder = AttemptRecorder(
+    batch_size=settings.WEBHOOK_ATTEMPT_BUFFER_SIZE,
+    flush_interval=settings.WEBHOOK_ATTEMPT_FLUSH_INTERVAL,
+    spool_dir=settings.WEBHOOK_ATTEMPT_SPOOL_DIR,
+    spool_fsync=settings.WEBHOOK_ATTEMPT_SPOOL_FSYNC,
+)
+
+
+@worker_process_init.connect
+def _replay_on_start(**kwargs):
+    if recorder.enabled:
+        try:
+            recorder.replay_spools()
+        except Exception:
+            logger.exception("Failed to replay delivery attempt spool files")
+
+
+@worker_process_shutdown.connect
+def _flush_on_shutdown(**kwargs):
+    if recorder.enabled:
+        recorder.flush()
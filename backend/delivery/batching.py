@@ -0,0 +1,126 @@
+"""
+Opt-in batched delivery: several events to the same destination in one request.
+
+Turned on per destination by setting Destination.batch_max_size (2 or more):
+
+    batch_max_size   at most this many events per request
+    batch_linger_ms  how long the first event waits for others to join it
+    batch_max_bytes  optional cap on the request body size
+
+Instead of one process_webhook_event task per event, enqueue_deliveries()
+schedules a single deliver_batch task per destination, batch_linger_ms in
+the future. A Redis key (SET NX) makes sure only one such flush is pending
+per destination, however many events arrive in the meantime. The flush
+claims the oldest due events (SELECT ... FOR UPDATE SKIP LOCKED) and POSTs
+them as one signed JSON array:
+
+    [{"id": "<event id>", "payload": {...}}, ...]
+
+Each element embeds the event's stored body as-is, so nothing is re-encoded.
+The outcome is logged as a DeliveryAttempt on every event in the batch, and
+a failed batch is retried as a whole with the same backoff as single events.
+
+Claimed events are PROCESSING with next_attempt_at as a lease: if a worker
+dies mid-batch, the next flush for that destination picks them up again.
+A flush that finds batching switched off since it was scheduled claims
+nothing and gives the waiting events tasks of their own instead.
+Batching only applies to the Celery delivery mode.
+"""
+import logging
+from datetime import timedelta
+
+import redis
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Event
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# A pending flush whose task got lost stops blocking new ones after this long
+FLUSH_KEY_GRACE_MS = 30000
+
+
+def is_batched(destination):
+    return (destination.batch_max_size or 0) > 1
+
+
+def _flush_key(destination_id):
+    return f"webhook:batch:{destination_id}"
+
+
+def reserve_flush(destination):
+    """
+    True if the caller should schedule a flush for this destination,
+    False if one is already pending.
+    """
+    try:
+        return bool(get_redis().set(
+            _flush_key(destination.id), 1, nx=True,
+            px=destination.batch_linger_ms + FLUSH_KEY_GRACE_MS,
+        ))
+    except redis.RedisError as exc:
+        # An extra flush is harmless: claims skip events another flush holds
+        logger.warning(f"Batch scheduler unavailable, scheduling flush anyway: {exc}")
+        return True
+
+
+def clear_flush(destination_id):
+    """Called as a flush starts, so events arriving from now on schedule the next one."""
+    try:
+        get_redis().delete(_flush_key(destination_id))
+    except redis.RedisError as exc:
+        logger.warning(f"Batch scheduler unavailable, could not clear pending flush: {exc}")
+
+
+def encode_batch(claimed):
+    """The JSON array body for a list of (event, body) pairs."""
+    return b'[' + b','.join(
+        b'{"id":"' + str(event.id).encode() + b'","payload":' + body + b'}'
+        for event, body in claimed
+    ) + b']'
+
+
+def claim_batch(destination, get_body, lease_seconds):
+    """
+    Claim the next batch of due events for ``destination`` and mark them PROCESSING.
+
+    ``get_body(event)`` returns the stored bytes of an event. Returns
+    (list of (event, body), more_pending).
+    """
+    now = timezone.now()
+    due = (
+        Q(status='PENDING', next_attempt_at__isnull=True)
+        | Q(status='PENDING', next_attempt_at__lte=now)
+        | Q(status='PROCESSING', next_attempt_at__lte=now)
+    )
+
+    with transaction.atomic():
+        candidates = list(
+            Event.objects.select_for_update(skip_locked=True, of=('self',))
+            .select_related('message')
+            .defer('payload', 'message__payload')
+            .filter(due, destination=destination)
+            .order_by('created_at', 'id')[:destination.batch_max_size]
+        )
+
+        claimed = []
+        size = 2  # the enclosing brackets
+        for event in candidates:
+            body = get_body(event)
+            size += len(body) + len(str(event.id)) + 21  # element wrapper and separator
+            # A single event over the byte cap still goes out, on its own
+            if claimed and destination.batch_max_bytes and size > destination.batch_max_bytes:
+                break
+            claimed.append((event, body))
+
+        Event.objects.filter(id__in=[event.id for event, _ in claimed]).update(
+            status='PROCESSING',
+            attempts_count=F('attempts_count') + 1,
+            next_attempt_at=now + timedelta(seconds=lease_seconds),
+        )
+
+    more_pending = len(claimed) < len(candidates) or len(candidates) == destination.batch_max_size
+    return claimed, more_pending
@@ -0,0 +1,173 @@
+"""
+Per-destination circuit breaker, stored in Redis so every worker replica shares it.
+
+    CLOSED     -> deliveries go out normally, consecutive failures are counted
+    OPEN       -> after WEBHOOK_CIRCUIT_FAILURE_THRESHOLD failures in a row;
+                  events are parked without making any HTTP call
+    HALF_OPEN  -> once WEBHOOK_CIRCUIT_COOLDOWN has passed, exactly ONE worker
+                  gets to send a probe delivery. Success closes the circuit,
+                  failure opens it again for another cooldown.
+
+Only timeouts, connection errors and 5xx responses count as failures.
+A 4xx means the destination is up (it just didn't like the request).
+
+If Redis itself is unavailable the breaker fails open: deliveries are
+allowed rather than blocking the whole pipeline on it.
+"""
+import logging
+import math
+import time
+from datetime import datetime, timezone
+
+import redis
+from django.conf import settings
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# KEYS[1] = circuit hash, KEYS[2] = probe lock
+# ARGV    = now, cooldown, probe_timeout
+# Returns {allowed (0/1), retry_after_seconds}
+_ALLOW_SCRIPT = """
+local state = redis.call('HGET', KEYS[1], 'state')
+if not state or state == 'closed' then
+    return {1, 0}
+end
+
+local now = tonumber(ARGV[1])
+local opened_at = tonumber(redis.call('HGET', KEYS[1], 'opened_at') or '0')
+local remaining = opened_at + tonumber(ARGV[2]) - now
+if remaining > 0 then
+    return {0, math.ceil(remaining)}
+end
+
+if redis.call('SET', KEYS[2], '1', 'NX', 'EX', ARGV[3]) then
+    redis.call('HSET', KEYS[1], 'state', 'half_open')
+    return {1, 0}
+end
+return {0, tonumber(ARGV[3])}
+"""
+
+# KEYS[1] = circuit hash, KEYS[2] = probe lock
+# ARGV    = now, failure_threshold
+_FAILURE_SCRIPT = """
+local failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+local state = redis.call('HGET', KEYS[1], 'state')
+if state == 'half_open' or (state ~= 'open' and failures >= tonumber(ARGV[2])) then
+    redis.call('HSET', KEYS[1], 'state', 'open', 'opened_at', ARGV[1])
+    redis.call('DEL', KEYS[2])
+    return 1
+end
+return 0
+"""
+
+
+# KEYS[1] = circuit hash, KEYS[2] = probe lock
+_RELEASE_PROBE_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'state') == 'half_open' then
+    return redis.call('DEL', KEYS[2])
+end
+return 0
+"""
+
+
+def _keys(destination_id):
+    return [f"webhook:circuit:{destination_id}", f"webhook:circuit:{destination_id}:probe"]
+
+
+def allow_request(destination_id):
+    """
+    Ask whether a delivery to this destination may go out right now.
+
+    Returns (allowed, retry_after_seconds).
+    """
+    try:
+        allowed, retry_after = get_redis().eval(
+            _ALLOW_SCRIPT, 2, *_keys(destination_id),
+            time.time(), settings.WEBHOOK_CIRCUIT_COOLDOWN, settings.WEBHOOK_CIRCUIT_PROBE_TIMEOUT,
+        )
+    except redis.RedisError as exc:
+        logger.warning(f"Circuit breaker unavailable, allowing delivery: {exc}")
+        return True, 0
+    return bool(allowed), int(retry_after)
+
+
+def release_probe(destination_id):
+    """
+    Give the probe back without a result, when the delivery allowed through
+    didn't go out after all (e.g. deferred by the rate limits). Otherwise no
+    other worker could probe until WEBHOOK_CIRCUIT_PROBE_TIMEOUT runs out.
+    A no-op unless the circuit is half open.
+    """
+    try:
+        get_redis().eval(_RELEASE_PROBE_SCRIPT, 2, *_keys(destination_id))
+    except redis.RedisError as exc:
+        logger.warning(f"Circuit breaker unavailable, could not release the probe: {exc}")
+
+
+def record_success(destination_id):
+    """Close the circuit and reset the consecutive failure counter."""
+    try:
+        get_redis().delete(*_keys(destination_id))
+    except redis.RedisError as exc:
+        logger.warning(f"Circuit breaker unavailable, could not record success: {exc}")
+
+
+def record_failure(destination_id):
+    """Count a failure, opening the circuit when the threshold is reached."""
+    try:
+        opened = get_redis().eval(
+            _FAILURE_SCRIPT, 2, *_keys(destination_id),
+            time.time(), settings.WEBHOOK_CIRCUIT_FAILURE_THRESHOLD,
+        )
+    except redis.RedisError as exc:
+        logger.warning(f"Circuit breaker unavailable, could not record failure: {exc}")
+        return
+    if opened:
+        logger.warning(f"Circuit opened for destination {destination_id}")
+
+
+def record_result(destination_id, response_status_code):
+    """Feed a delivery outcome into the breaker (0 = timeout / connection error)."""
+    if response_status_code == 0 or response_status_code >= 500:
+        record_failure(destination_id)
+    else:
+        record_success(destination_id)
+
+
+def state_key(destination_id):
+    """The Redis hash behind get_state(), for callers reading many destinations in one pipeline."""
+    return _keys(destination_id)[0]
+
+
+def state_from(data):
+    """get_state() from the HGETALL of state_key(), or None if it couldn't be read."""
+    if data is None:
+        return {"state": "unknown", "consecutive_failures": None, "opened_at": None, "retry_after": None}
+
+    state = data.get('state', CLOSED)
+    opened_at = float(data['opened_at']) if 'opened_at' in data else None
+    retry_after = None
+    if state == OPEN and opened_at is not None:
+        retry_after = max(0, math.ceil(opened_at + settings.WEBHOOK_CIRCUIT_COOLDOWN - time.time()))
+
+    return {
+        "state": state,
+        "consecutive_failures": int(data.get('failures', 0)),
+        "opened_at": datetime.fromtimestamp(opened_at, tz=timezone.utc).isoformat() if opened_at else None,
+        "retry_after": retry_after,
+    }
+
+
+def get_state(destination_id):
+    """Current breaker state for display, e.g. on the destinations API."""
+    try:
+        data = get_redis().hgetall(state_key(destination_id))
+    except redis.RedisError:
+        data = None
+    return state_from(data)
@@ -0,0 +1,301 @@
+"""
+Asyncio delivery engine (WEBHOOK_DELIVERY_MODE = 'async').
+
+The Celery worker blocks one process slot per delivery for up to 30 seconds,
+so a couple of slow destinations can eat all delivery capacity. This engine
+runs a single event loop per process instead and keeps hundreds of deliveries
+in flight at once with an async HTTP client.
+
+How it works:
+    1. Claim a batch of due events straight from the database
+       (SELECT ... FOR UPDATE SKIP LOCKED, so several engines can run side by side)
+    2. Deliver each one as its own asyncio task, capped at WEBHOOK_ASYNC_CONCURRENCY
+    3. Log a DeliveryAttempt and move the event to SUCCESS / FAILED, or schedule
+       the retry (on next_attempt_at) with the destination's backoff policy,
+       like process_webhook_event
+
+Status transitions are the same as in the Celery task:
+    PENDING -> PROCESSING -> SUCCESS | FAILED
+
+While an event is PROCESSING, next_attempt_at works as a lease: if the engine
+dies mid-delivery the event becomes claimable again once the lease expires.
+
+Run it with:
+    python manage.py run_delivery_engine
+"""
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from . import attempt_recorder, circuit_breaker, latency, metrics, rate_limits, scheduler
+from .models import Event
+from .tasks import (
+    ACTIVE_STATUSES, build_delivery_headers, get_delivery_body, get_max_retries, get_retry_delay, process_webhook_event,
+    set_event_status,
+)
+
+logger = logging.getLogger(__name__)
+
+# Per-request timeouts come from delivery/latency.py, this is only the upper bound
+REQUEST_TIMEOUT = settings.WEBHOOK_READ_TIMEOUT_MAX
+
+# How long a claimed event may stay in flight before another engine may take it over
+LEASE_SECONDS = REQUEST_TIMEOUT * 2
+
+
+def claim_events(limit):
+    """
+    Atomically claim up to ``limit`` due events and mark them PROCESSING.
+
+    Events whose destination went inactive are marked FAILED (like the Celery
+    task does) instead of being handed out. Events of an ordered destination
+    wait until every earlier one is finished (see delivery/ordering.py).
+    """
+    close_old_connections()
+    now = timezone.now()
+
+    due = (
+        Q(status='PENDING', next_attempt_at__isnull=True)
+        | Q(status='PENDING', next_attempt_at__lte=now)
+        | Q(status='PROCESSING', next_attempt_at__lte=now)
+    )
+    # An earlier event of the same destination is still in flight, retrying or waiting
+    behind_head = Exists(
+        Event.objects.filter(destination_id=OuterRef('destination_id'), status__in=ACTIVE_STATUSES).filter(
+            Q(created_at__lt=OuterRef('created_at'))
+            | Q(created_at=OuterRef('created_at'), id__lt=OuterRef('id'))
+        )
+    )
+
+    with transaction.atomic():
+        event_ids = list(
+            Event.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(due)
+            .filter(Q(destination__ordered=False) | ~behind_head)
+            .order_by('created_at')
+            .values_list('id', flat=True)[:limit]
+        )
+        if not event_ids:
+            return []
+
+        inactive = Event.objects.filter(id__in=event_ids, destination__is_active=False)
+        inactive.update(status='FAILED', next_attempt_at=None)
+
+        Event.objects.filter(id__in=event_ids, destination__is_active=True).update(
+            status='PROCESSING',
+            attempts_count=F('attempts_count') + 1,
+            next_attempt_at=now + timedelta(seconds=LEASE_SECONDS),
+        )
+
+    return list(
+        Event.objects.select_related('destination', 'message').defer('payload', 'message__payload')
+        .filter(id__in=event_ids, status='PROCESSING')
+    )
+
+
+def record_outcome(event, response_status_code, response_body, timings):
+    """Log the attempt and move the event to its next state. Returns the new status."""
+    close_old_connections()
+
+    is_successful = 200 <= response_status_code < 300
+    is_client_error = 400 <= response_status_code < 500
+
+    attempt_recorder.recorder.record(
+        event_id=event.id,
+        status='SUCCESS' if is_successful else 'FAILED',
+        response_status_code=response_status_code,
+        response_body=response_body,
+        timestamp=timezone.now(),
+        **timings
+    )
+    metrics.record_attempt(str(event.destination_id), is_successful, timings['duration_ms'] / 1000)
+
+    retries_used = event.attempts_count - 1
+    max_retries = get_max_retries(process_webhook_event, event.destination)
+
+    if is_successful:
+        new_status, next_attempt_at = 'SUCCESS', None
+        logger.info(f" Event {event.id} delivered successfully!")
+    elif is_client_error:
+        new_status, next_attempt_at = 'FAILED', None
+        metrics.inc('webhook_events_failed_total', reason='client_error')
+        logger.error(f" Client error {response_status_code}, not retrying")
+    elif retries_used < max_retries:
+        retry_delay = scheduler.jittered(get_retry_delay(retries_used, event.destination))
+        new_status = 'PROCESSING'
+        next_attempt_at = timezone.now() + timedelta(seconds=retry_delay)
+        metrics.inc('webhook_delivery_retries_total')
+        logger.warning(
+            f"Retry {retries_used + 1}/{max_retries} "
+            f"for event {event.id} in {retry_delay:.0f} seconds"
+        )
+    else:
+        new_status, next_attempt_at = 'FAILED', None
+        metrics.inc('webhook_events_failed_total', reason='max_retries')
+        logger.error(f" Max retries reached for event {event.id}, marking as FAILED")
+
+    set_event_status(event.id, new_status, from_statuses=('PROCESSING',), next_attempt_at=next_attempt_at)
+    return new_status
+
+
+def park_event(event, retry_after):
+    """Hand a claimed event back without counting it as an attempt."""
+    close_old_connections()
+    Event.objects.filter(id=event.id).update(
+        # An event that was never attempted goes back to PENDING
+        status='PENDING' if event.attempts_count <= 1 else 'PROCESSING',
+        attempts_count=F('attempts_count') - 1,
+        next_attempt_at=timezone.now() + timedelta(seconds=retry_after),
+    )
+
+
+async def read_capped(response, limit=None):
+    """Async twin of http_client.read_capped(): at most ``limit`` bytes, then close."""
+    limit = settings.WEBHOOK_RESPONSE_CAPTURE_BYTES if limit is None else limit
+    data = bytearray()
+    try:
+        if limit > 0:
+            async for chunk in response.aiter_bytes(chunk_size=min(limit, 8192)):
+                data += chunk
+                if len(data) >= limit:
+                    break
+    finally:
+        await response.aclose()
+    return bytes(data[:limit])
+
+
+class AsyncDeliveryEngine:
+
+    def __init__(self, concurrency=None, batch_size=None, poll_interval=None):
+        self.concurrency = concurrency or settings.WEBHOOK_ASYNC_CONCURRENCY
+        self.batch_size = batch_size or settings.WEBHOOK_ASYNC_BATCH_SIZE
+        self.poll_interval = poll_interval or settings.WEBHOOK_ASYNC_POLL_INTERVAL
+        self._stopping = asyncio.Event()
+        self._in_flight = set()
+
+    def stop(self):
+        self._stopping.set()
+
+    async def run(self):
+        limits = httpx.Limits(
+            max_connections=self.concurrency,
+            max_keepalive_connections=self.concurrency,
+            keepalive_expiry=settings.WEBHOOK_HTTP_IDLE_TIMEOUT,
+        )
+        async with httpx.AsyncClient(limits=limits, timeout=REQUEST_TIMEOUT) as client:
+            logger.info(f"Delivery engine started (concurrency={self.concurrency}, batch_size={self.batch_size})")
+
+            while not self._stopping.is_set():
+                free_slots = self.concurrency - len(self._in_flight)
+                if free_slots <= 0:
+                    await asyncio.wait(self._in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+
+                events = await sync_to_async(claim_events)(min(free_slots, self.batch_size))
+                if not events:
+                    await self._sleep(self.poll_interval)
+                    continue
+
+                for event in events:
+                    task = asyncio.create_task(self.deliver(client, event))
+                    self._in_flight.add(task)
+                    task.add_done_callback(self._in_flight.discard)
+
+            # Let in-flight deliveries finish before closing the client
+            if self._in_flight:
+                logger.info(f"Waiting for {len(self._in_flight)} in-flight deliveries")
+                await asyncio.wait(self._in_flight)
+
+        logger.info("Delivery engine stopped")
+
+    async def _sleep(self, seconds):
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def deliver(self, client, event):
+        destination = event.destination
+        allowed, retry_after = await sync_to_async(circuit_breaker.allow_request, thread_sensitive=False)(destination.id)
+        if not allowed:
+            logger.info(f"Circuit open for destination {destination.id}, parking event {event.id} for {retry_after}s")
+            await sync_to_async(park_event)(event, retry_after)
+            return
+
+        allowed, retry_after, lease = await sync_to_async(rate_limits.acquire, thread_sensitive=False)(destination)
+        if not allowed:
+            await sync_to_async(circuit_breaker.release_probe, thread_sensitive=False)(destination.id)
+            logger.info(f"Destination {destination.id} is over its limits, deferring event {event.id} by {retry_after:.2f}s")
+            await sync_to_async(park_event)(event, retry_after)
+            return
+
+        # The concurrency slot is given back however this ends
+        try:
+            logger.info(f"Processing event {event.id} for destination {destination.url}")
+
+            if event.attempts_count == 1:
+                await sync_to_async(metrics.observe, thread_sensitive=False)(
+                    'webhook_enqueue_latency_seconds', [(timezone.now() - event.created_at).total_seconds()]
+                )
+
+            connect_timeout, read_timeout = await sync_to_async(latency.timeouts_for, thread_sensitive=False)(destination)
+            started = time.monotonic()
+            timings = {'duration_ms': None, 'ttfb_ms': None}
+            try:
+                body = await sync_to_async(get_delivery_body)(event, destination)
+                headers = build_delivery_headers(event, destination, body)
+                request = client.build_request(
+                    'POST',
+                    destination.url,
+                    content=body,
+                    headers=headers,
+                    timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                )
+                # stream=True returns as soon as the headers are in: that's the time to first byte
+                response = await client.send(request, stream=True)
+                timings['ttfb_ms'] = round((time.monotonic() - started) * 1000)
+                captured = await read_capped(response)
+                await sync_to_async(latency.observe, thread_sensitive=False)(destination.id, time.monotonic() - started)
+
+                response_status_code = response.status_code
+                response_body = captured.decode(response.encoding or 'utf-8', errors='replace')
+
+                logger.info(f"Webhook delivered to {destination.url}, status: {response_status_code}")
+
+            except httpx.TimeoutException as exc:
+                if isinstance(exc, httpx.ReadTimeout):
+                    # Counts as a (slow) sample, so the estimate backs off
+                    await sync_to_async(latency.observe, thread_sensitive=False)(destination.id, read_timeout)
+                logger.error(f"Timeout delivering to {destination.url}")
+                response_status_code = 0
+                response_body = f"Request timeout (connect {connect_timeout:.1f}s, read {read_timeout:.1f}s)"
+
+            except httpx.TransportError:
+                logger.error(f"Connection error to {destination.url}")
+                response_status_code = 0
+                response_body = "Connection error - destination unreachable"
+
+            except Exception as e:
+                logger.error(f"Unexpected error delivering webhook: {str(e)}")
+                response_status_code = 0
+                response_body = f"Unexpected error: {str(e)}"
+
+            timings['duration_ms'] = round((time.monotonic() - started) * 1000)
+        finally:
+            await sync_to_async(rate_limits.release, thread_sensitive=False)(destination, lease)
+
+        await sync_to_async(circuit_breaker.record_result, thread_sensitive=False)(destination.id, response_status_code)
+
+        try:
+            await sync_to_async(record_outcome)(event, response_status_code, response_body, timings)
+        except Exception:
+            # The lease on next_attempt_at makes the event claimable again later
+            logger.exception(f"Failed to record delivery outcome for event {event.id}")
@@ -0,0 +1,118 @@
+"""
+Streaming NDJSON export of events together with their delivery attempts.
+
+Used by GET /api/events/export/ and `manage.py export_events`, and for the
+retention archives. Memory stays bounded no matter how many events match:
+    - events are read through a server-side cursor (.iterator(chunk_size=...))
+    - attempts are fetched with one query per chunk of events
+    - output is produced chunk by chunk, optionally gzip-compressed on the fly
+
+One line per event:
+    {"id": ..., "destination_id": ..., "message_id": ..., "payload": ..., "status": ..., "attempts": [{...}, ...]}
+
+Fanned out events (message_id set) are written with their message's payload,
+so every line is self-contained.
+"""
+import datetime
+import json
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import DeliveryAttempt, Event, Message
+from .payloads import decode_payload
+
+EVENT_FIELDS = ['id', 'destination_id', 'message_id', 'payload', 'status', 'attempts_count', 'created_at']
+ATTEMPT_FIELDS = [
+    'event_id', 'status', 'response_status_code', 'response_body', 'duration_ms', 'ttfb_ms', 'timestamp',
+]
+
+
+def attach_attempts(events):
+    """Add an 'attempts' list to each event dict, using a single query."""
+    attempts = {}
+    event_ids = [event['id'] for event in events]
+    rows = (
+        DeliveryAttempt.objects.filter(event_id__in=event_ids).order_by('timestamp')
+        .values(*ATTEMPT_FIELDS, 'response_content__body')
+    )
+    for attempt in rows:
+        # Deduplicated bodies are written out in full, like the older inline ones
+        content = attempt.pop('response_content__body')
+        if content is not None:
+            attempt['response_body'] = content
+        attempts.setdefault(attempt['event_id'], []).append(attempt)
+
+    for event in events:
+        event['attempts'] = attempts.get(event['id'], [])
+    return events
+
+
+def attach_message_payloads(events):
+    """
+    Fill in the payload of fanned out events from their messages, using a single query.
+
+    Payloads stored only as a compressed body (see delivery/payloads.py) are
+    decoded, with one more query for just those bodies.
+    """
+    message_ids = {event['message_id'] for event in events if event['message_id'] is not None}
+    if message_ids:
+        payloads = dict(Message.objects.filter(id__in=message_ids).values_list('id', 'payload'))
+        compressed = [message_id for message_id, payload in payloads.items() if payload is None]
+        for message_id, body in Message.objects.filter(id__in=compressed).values_list('id', 'body'):
+            payloads[message_id] = decode_payload(body)
+        for event in events:
+            if event['message_id'] is not None:
+                event['payload'] = payloads.get(event['message_id'])
+
+    compressed = [event['id'] for event in events if event['payload'] is None and event['message_id'] is None]
+    if compressed:
+        bodies = dict(Event.objects.filter(id__in=compressed, body__isnull=False).values_list('id', 'body'))
+        for event in events:
+            if event['id'] in bodies:
+                event['payload'] = decode_payload(bodies[event['id']])
+    return events
+
+
+def iter_event_chunks(queryset, chunk_size=None):
+    """Yield lists of event dicts (attempts attached), ``chunk_size`` events at a time."""
+    chunk_size = chunk_size or settings.WEBHOOK_EXPORT_CHUNK_SIZE
+    chunk = []
+    for event in queryset.values(*EVENT_FIELDS).iterator(chunk_size=chunk_size):
+        chunk.append(event)
+        if len(chunk) >= chunk_size:
+            yield attach_attempts(attach_message_payloads(chunk))
+            chunk = []
+    if chunk:
+        yield attach_attempts(attach_message_payloads(chunk))
+
+
+class ExportEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder truncates datetimes to milliseconds; archives keep them exact, so restores are too."""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def to_ndjson(events):
+    return ''.join(json.dumps(event, cls=ExportEncoder) + '\n' for event in events)
+
+
+def iter_ndjson(queryset, chunk_size=None, compress=False):
+    """Yield the export as bytes, one piece per chunk of events."""
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 -> gzip format
+
+    for events in iter_event_chunks(queryset, chunk_size):
+        data = to_ndjson(events).encode('utf-8')
+        if compressor is None:
+            yield data
+        else:
+            compressed = compressor.compress(data)
+            if compressed:
+                yield compressed
+
+    if compressor is not None:
+        yield compressor.flush()
@@ -0,0 +1,51 @@
+"""
+Fan-out: publish one message to every destination subscribed to its event type.
+
+    POST /api/messages/ {"event_type": "order.created", "payload": {...}}
+
+The payload is stored and encoded ONCE, on a Message row. Each active
+subscription (with an active destination) gets its own Event row pointing at
+that message: the per-destination delivery record with its own status,
+attempts and retries, delivered by the same process_webhook_event task or
+async engine as any other event.
+
+Everything is written in one transaction (one INSERT for the message, one
+bulk INSERT for the deliveries) and, once committed, all deliveries are
+published with a single enqueue_deliveries() call.
+"""
+import logging
+
+from django.db import transaction
+
+from .models import Destination, Event, Message
+from .payloads import storage_fields
+from .tasks import enqueue_deliveries
+
+logger = logging.getLogger(__name__)
+
+
+def publish(event_type, payload):
+    """
+    Store ``payload`` once and create one delivery per subscribed destination.
+
+    Returns (message, deliveries). A message nobody subscribes to is still
+    stored, with no deliveries.
+    """
+    destinations = Destination.objects.filter(
+        is_active=True,
+        subscriptions__event_type=event_type,
+        subscriptions__is_active=True,
+    )
+
+    with transaction.atomic():
+        message = Message.objects.create(event_type=event_type, **storage_fields(payload))
+        deliveries = Event.objects.bulk_create([
+            Event(destination=destination, message=message)
+            for destination in destinations
+        ])
+        # Only publish once the rows are committed, otherwise a fast
+        # worker could look up an event that isn't visible yet
+        transaction.on_commit(lambda: enqueue_deliveries(deliveries))
+
+    logger.info(f"Published message {message.id} ({event_type}) to {len(deliveries)} destinations")
+    return message, deliveries
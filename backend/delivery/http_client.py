@@ -0,0 +1,131 @@
+"""
+Pooled HTTP client used by the delivery worker.
+
+Calling the module level requests.post() opens a brand new TCP connection
+(plus a TLS handshake for https) on every single delivery. Instead we keep
+one requests.Session per destination origin (scheme://host:port) for the
+lifetime of the worker process, so keep-alive connections are reused
+across tasks that hit the same destination.
+
+Tuning (see settings.py):
+    WEBHOOK_HTTP_POOL_SIZE                -> how many origins we keep sessions for (LRU)
+    WEBHOOK_HTTP_MAX_CONNECTIONS_PER_HOST -> keep-alive connections kept per origin
+    WEBHOOK_HTTP_IDLE_TIMEOUT             -> seconds before an unused origin is closed
+
+Responses are only read up to WEBHOOK_RESPONSE_CAPTURE_BYTES (see
+read_capped()): a destination answering with a huge or endless body can't
+make a worker buffer all of it.
+"""
+import threading
+import time
+from collections import OrderedDict
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from celery.signals import worker_process_init, worker_process_shutdown
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+# origin -> (session, last_used), least recently used first
+_sessions = OrderedDict()
+_lock = threading.Lock()
+
+
+def _origin(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def _build_session():
+    session = requests.Session()
+
+    # Never carry cookies set by one delivery over to the next one
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+    adapter = HTTPAdapter(
+        pool_connections=1,  # a session only ever talks to one origin
+        pool_maxsize=settings.WEBHOOK_HTTP_MAX_CONNECTIONS_PER_HOST,
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _evict_idle(now):
+    idle_timeout = settings.WEBHOOK_HTTP_IDLE_TIMEOUT
+    for origin, (session, last_used) in list(_sessions.items()):
+        if now - last_used < idle_timeout:
+            # Entries are kept in LRU order, everything after this is fresher
+            break
+        del _sessions[origin]
+        session.close()
+
+
+def get_session(url):
+    """Return the pooled session for the origin of ``url``, creating it if needed."""
+    origin = _origin(url)
+    now = time.monotonic()
+
+    with _lock:
+        _evict_idle(now)
+
+        entry = _sessions.pop(origin, None)
+        if entry is not None:
+            session = entry[0]
+        else:
+            # Make room by closing the least recently used origin
+            while len(_sessions) >= settings.WEBHOOK_HTTP_POOL_SIZE:
+                _, (stale_session, _) = _sessions.popitem(last=False)
+                stale_session.close()
+            session = _build_session()
+
+        _sessions[origin] = (session, now)
+
+    return session
+
+
+def post(url, **kwargs):
+    """Drop-in replacement for requests.post() that reuses pooled connections."""
+    return get_session(url).post(url, **kwargs)
+
+
+def read_capped(response, limit=None):
+    """
+    Read at most ``limit`` bytes of a ``stream=True`` response body, then close it.
+
+    A body read to the end releases its connection back to the pool; one cut
+    off at the limit closes the connection instead, so the rest is never read.
+    """
+    limit = settings.WEBHOOK_RESPONSE_CAPTURE_BYTES if limit is None else limit
+    data = bytearray()
+    try:
+        if limit > 0:
+            for chunk in response.iter_content(chunk_size=min(limit, 8192)):
+                data += chunk
+                if len(data) >= limit:
+                    break
+    finally:
+        response.close()
+    return bytes(data[:limit])
+
+
+def close_all():
+    """Close every pooled session (and its open connections)."""
+    with _lock:
+        while _sessions:
+            _, (session, _) = _sessions.popitem()
+            session.close()
+
+
+@worker_process_init.connect
+def _reset_after_fork(**kwargs):
+    # Sockets inherited from the parent process must never be shared
+    # between forked worker processes
+    with _lock:
+        _sessions.clear()
+
+
+@worker_process_shutdown.connect
+def _close_on_shutdown(**kwargs):
+    close_all()
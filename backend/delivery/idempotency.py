@@ -0,0 +1,132 @@
+"""
+Idempotent ingestion: a retried POST returns the event it already created.
+
+Producers retry on timeouts, and without this every retry is another Event
+and another delivery. An event is a duplicate when its destination already
+has an event with the same key:
+
+    Idempotency-Key header                      -> that key
+    no header, Destination.deduplicate_payloads -> "sha256:<hash of the encoded payload>"
+    otherwise                                   -> never a duplicate
+
+Two layers:
+    1. Redis cache (fast path): webhook:idempotency:<destination id>:<sha256 of key>
+       -> event id, kept for WEBHOOK_IDEMPOTENCY_TTL seconds. A hit answers
+       the request without touching the database.
+    2. Unique constraint on (destination, idempotency_key) (authoritative):
+       a miss just INSERTs, and if that violates the constraint, the existing
+       event is looked up and returned instead. No extra query is spent on
+       events that aren't duplicates.
+
+Either way a duplicate is neither inserted nor enqueued again, and gets the
+original event id back. If Redis is unavailable, only the constraint is used.
+
+With buffered ingestion (delivery/ingest_stream.py) the event isn't in the
+database yet when the request is answered, so the key is reserved with
+SET NX instead; the constraint still drops a duplicate the cache missed
+when the persister writes it.
+"""
+import hashlib
+import logging
+
+import redis
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Event
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = Event._meta.get_field('idempotency_key').max_length
+
+
+def key_for(destination, body, header_value=None):
+    """The idempotency key of a new event (None: no deduplication). ``body`` is the encoded payload."""
+    if header_value:
+        return header_value
+    if destination.deduplicate_payloads:
+        return 'sha256:' + hashlib.sha256(body).hexdigest()
+    return None
+
+
+def _cache_key(destination_id, key):
+    # Keys are arbitrary producer strings: hash them into a bounded, safe Redis key
+    return f"webhook:idempotency:{destination_id}:{hashlib.sha256(key.encode('utf-8')).hexdigest()}"
+
+
+def lookup(pairs):
+    """{(destination_id, key): event_id} for the pairs found in the cache."""
+    pairs = list(pairs)
+    if not pairs:
+        return {}
+    try:
+        values = get_redis().mget([_cache_key(*pair) for pair in pairs])
+    except redis.RedisError as exc:
+        logger.warning(f"Idempotency cache unavailable, falling back to the database: {exc}")
+        return {}
+    return {pair: event_id for pair, event_id in zip(pairs, values) if event_id is not None}
+
+
+def remember(found):
+    """Cache {(destination_id, key): event_id}."""
+    if not found:
+        return
+    pipe = get_redis().pipeline(transaction=False)
+    for pair, event_id in found.items():
+        pipe.set(_cache_key(*pair), str(event_id), ex=settings.WEBHOOK_IDEMPOTENCY_TTL)
+    try:
+        pipe.execute()
+    except redis.RedisError as exc:
+        logger.warning(f"Idempotency cache unavailable: {exc}")
+
+
+def claim(pair, event_id):
+    """
+    Reserve ``pair`` for a new event that isn't in the database yet (buffered
+    ingestion). Returns the event id that already holds it, or None.
+    """
+    try:
+        client = get_redis()
+        if client.set(_cache_key(*pair), str(event_id), ex=settings.WEBHOOK_IDEMPOTENCY_TTL, nx=True):
+            return None
+        return client.get(_cache_key(*pair))
+    except redis.RedisError as exc:
+        logger.warning(f"Idempotency cache unavailable: {exc}")
+        return None
+
+
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def release(pair, event_id):
+    """Undo claim() when the event couldn't be buffered after all."""
+    try:
+        get_redis().eval(_RELEASE_SCRIPT, 1, _cache_key(*pair), str(event_id))
+    except redis.RedisError as exc:
+        logger.warning(f"Idempotency cache unavailable: {exc}")
+
+
+def find_existing(pairs):
+    """{(destination_id, key): event_id} for the pairs that already have an event, cache first, then one query."""
+    pairs = set(pairs)
+    found = dict(lookup(pairs))
+    missing = pairs - set(found)
+    if missing:
+        condition = Q()
+        for destination_id, key in missing:
+            condition |= Q(destination_id=destination_id, idempotency_key=key)
+        from_db = {
+            (destination_id, key): event_id
+            for event_id, destination_id, key in
+            Event.objects.filter(condition).values_list('id', 'destination_id', 'idempotency_key')
+        }
+        remember(from_db)
+        found.update(from_db)
+    return found
@@ -0,0 +1,118 @@
+"""
+Write-ahead ingestion buffer (WEBHOOK_INGEST_MODE = 'stream').
+
+In the default 'direct' mode POST /api/events/ INSERTs the event before
+answering, so ingestion latency and availability follow the database's.
+In 'stream' mode the request only validates the event and appends it to a
+Redis stream (one XADD, persisted by Redis AOF), then returns 202 with the
+event id it will have. Persister processes (manage.py run_ingest_persister,
+delivery/persister.py) drain the stream:
+
+    XREADGROUP  up to WEBHOOK_INGEST_BATCH_SIZE entries for this consumer
+    bulk_create them in one INSERT (ignoring rows that already exist)
+    enqueue their deliveries
+    XACK + XDEL
+
+An entry is only acknowledged once its event is committed, so a persister
+that dies mid-batch loses nothing: its pending entries are taken over with
+XAUTOCLAIM by another persister after WEBHOOK_INGEST_CLAIM_IDLE_MS. Event ids
+are assigned at ingestion, so replaying an entry never creates a second row
+(at-least-once enqueue, which the tasks' conditional status updates tolerate).
+
+Backpressure: acknowledged entries are deleted, so the stream length is the
+persisters' lag. Once it reaches WEBHOOK_INGEST_MAX_LAG entries, appends are
+refused and the API answers 503 with Retry-After instead of letting the
+buffer grow without bound. If Redis itself is unavailable the API falls back
+to a direct INSERT.
+
+Entries that can never be persisted (malformed, or a row the database
+rejects) are moved to the webhook:ingest:dead stream with the error, so they
+don't hold up the rest of their batch; the API has already answered 202 for
+them. At most DEAD_LETTER_MAX_LEN of them are kept.
+
+Only POST /api/events/ goes through the stream; bulk ingestion already
+writes a whole request with one INSERT, and fan-out messages stay direct.
+"""
+import logging
+
+import redis
+from django.conf import settings
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = 'webhook:ingest'
+GROUP = 'persisters'
+DEAD_LETTER_KEY = 'webhook:ingest:dead'
+DEAD_LETTER_MAX_LEN = 10000
+
+# KEYS[1] = stream
+# ARGV    = max_lag, event id, destination id, body, idempotency key ('' for none)
+# Returns the entry id, or false when the stream is full
+_APPEND_SCRIPT = """
+if redis.call('XLEN', KEYS[1]) >= tonumber(ARGV[1]) then
+    return false
+end
+return redis.call('XADD', KEYS[1], '*', 'id', ARGV[2], 'destination', ARGV[3], 'body', ARGV[4], 'key', ARGV[5])
+"""
+
+
+class Backpressure(Exception):
+    """The persisters are too far behind; the producer should retry later."""
+
+
+def append(event_id, destination_id, body, idempotency_key=None):
+    """Buffer one validated event (``body``: its canonical encoded payload). Raises Backpressure when full."""
+    entry_id = get_redis().eval(
+        _APPEND_SCRIPT, 1, STREAM_KEY,
+        settings.WEBHOOK_INGEST_MAX_LAG, str(event_id), str(destination_id), body, idempotency_key or '',
+    )
+    if not entry_id:
+        raise Backpressure(f"Ingestion buffer is full ({settings.WEBHOOK_INGEST_MAX_LAG} entries)")
+    return entry_id
+
+
+def lag():
+    """Entries not persisted yet (including ones a persister is working on)."""
+    return get_redis().xlen(STREAM_KEY)
+
+
+def ensure_group():
+    try:
+        get_redis().xgroup_create(STREAM_KEY, GROUP, id='0', mkstream=True)
+    except redis.ResponseError as exc:
+        if 'BUSYGROUP' not in str(exc):
+            raise
+
+
+def read(consumer, count, block_ms):
+    """New entries for ``consumer``: [(entry id, fields), ...]."""
+    response = get_redis().xreadgroup(GROUP, consumer, {STREAM_KEY: '>'}, count=count, block=block_ms)
+    return response[0][1] if response else []
+
+
+def reclaim(consumer, count):
+    """Entries other consumers left unacknowledged for longer than WEBHOOK_INGEST_CLAIM_IDLE_MS."""
+    response = get_redis().xautoclaim(
+        STREAM_KEY, GROUP, consumer, min_idle_time=settings.WEBHOOK_INGEST_CLAIM_IDLE_MS, start_id='0-0', count=count,
+    )
+    # [next start id, claimed entries, deleted ids]; entries deleted meanwhile come back as None
+    return [(entry_id, fields) for entry_id, fields in response[1] if fields]
+
+
+def ack(entry_ids):
+    if not entry_ids:
+        return
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.xack(STREAM_KEY, GROUP, *entry_ids)
+    pipe.xdel(STREAM_KEY, *entry_ids)
+    pipe.execute()
+
+
+def dead_letter(entry_id, fields, reason):
+    """Set aside an entry that can't be persisted, with the reason (acknowledge it afterwards)."""
+    get_redis().xadd(
+        DEAD_LETTER_KEY, {**fields, 'entry': entry_id, 'error': reason},
+        maxlen=DEAD_LETTER_MAX_LEN, approximate=True,
+    )
@@ -0,0 +1,134 @@
+"""
+Adaptive delivery timeouts from each destination's observed latency.
+
+A single fixed timeout is wrong both ways: an endpoint that normally answers
+in 50ms and then hangs holds a worker for the full timeout, while a
+legitimately slow endpoint gets cut off. Instead every delivery's response
+time is fed into a per-destination estimate kept in Redis (shared by all
+workers), computed the way TCP computes its retransmission timeout:
+
+    srtt   = 7/8 * srtt   + 1/8 * sample            (smoothed latency)
+    rttvar = 3/4 * rttvar + 1/4 * |srtt - sample|   (smoothed deviation)
+    timeout = srtt + 4 * rttvar
+
+The result is the read timeout, clamped to WEBHOOK_READ_TIMEOUT_MIN/MAX.
+Until a destination has WEBHOOK_LATENCY_MIN_SAMPLES samples, the MAX is
+used. A timed out delivery counts as a sample of the timeout it hit, so the
+estimate backs off when a destination slows down. The samples are whole
+requests, dominated by the receiver's processing time, so they say nothing
+about connection setup: the connect timeout stays WEBHOOK_CONNECT_TIMEOUT_MAX
+(a receiver that's slow to answer doesn't get longer to connect).
+Destination.connect_timeout / read_timeout override both; together they must fit in max_override() seconds,
+so a delivery can't outlive the leases held while it runs.
+
+If Redis is unavailable the MAX read timeout is used.
+"""
+import logging
+
+import redis
+from django.conf import settings
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Estimates for destinations that stop receiving deliveries expire after a week
+ESTIMATE_TTL = 7 * 24 * 60 * 60
+
+# KEYS[1] = estimate hash
+# ARGV    = sample_ms, ttl
+_OBSERVE_SCRIPT = """
+local sample = tonumber(ARGV[1])
+local state = redis.call('HMGET', KEYS[1], 'srtt', 'rttvar')
+local srtt = tonumber(state[1])
+local rttvar = tonumber(state[2])
+
+if srtt == nil then
+    srtt = sample
+    rttvar = sample / 2
+else
+    rttvar = 0.75 * rttvar + 0.25 * math.abs(srtt - sample)
+    srtt = 0.875 * srtt + 0.125 * sample
+end
+
+redis.call('HSET', KEYS[1], 'srtt', tostring(srtt), 'rttvar', tostring(rttvar))
+redis.call('HINCRBY', KEYS[1], 'samples', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def estimate_key(destination_id):
+    """The Redis hash behind get_estimate(), for callers reading many destinations in one pipeline."""
+    return f"webhook:latency:{destination_id}"
+
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+def max_override():
+    """
+    Longest connect + read timeout a destination may override to, in seconds.
+
+    A delivery holds several leases while its request runs: the event's claim
+    (twice WEBHOOK_READ_TIMEOUT_MAX in the engine and for batches), a
+    concurrency slot, the circuit breaker's probe and an ordered
+    destination's lease. A request outliving any of them lets a second worker
+    in, so the overrides stay WEBHOOK_TIMEOUT_LEASE_MARGIN below the shortest.
+    """
+    lease = min(
+        settings.WEBHOOK_READ_TIMEOUT_MAX * 2,
+        settings.WEBHOOK_CONCURRENCY_LEASE_SECONDS,
+        settings.WEBHOOK_CIRCUIT_PROBE_TIMEOUT,
+        settings.WEBHOOK_ORDERED_LEASE_SECONDS,
+    )
+    return lease - settings.WEBHOOK_TIMEOUT_LEASE_MARGIN
+
+
+def observe(destination_id, seconds):
+    """Feed one response time (in seconds) into the destination's estimate."""
+    try:
+        get_redis().eval(_OBSERVE_SCRIPT, 1, estimate_key(destination_id), round(seconds * 1000, 3), ESTIMATE_TTL)
+    except redis.RedisError as exc:
+        logger.warning(f"Latency tracker unavailable, sample dropped: {exc}")
+
+
+def get_estimate(destination_id):
+    """{"srtt_ms", "rttvar_ms", "samples"}, or None if nothing was observed yet."""
+    try:
+        state = get_redis().hgetall(estimate_key(destination_id))
+    except redis.RedisError as exc:
+        logger.warning(f"Latency tracker unavailable: {exc}")
+        return None
+    return estimate_from(state)
+
+
+def estimate_from(state):
+    """get_estimate() from the HGETALL of estimate_key()."""
+    if not state:
+        return None
+    return {
+        "srtt_ms": float(state['srtt']),
+        "rttvar_ms": float(state['rttvar']),
+        "samples": int(state.get('samples', 0)),
+    }
+
+
+def timeouts_from(destination, estimate):
+    """(connect, read) timeouts in seconds for a destination, given its estimate."""
+    connect = settings.WEBHOOK_CONNECT_TIMEOUT_MAX
+    read = settings.WEBHOOK_READ_TIMEOUT_MAX
+
+    if estimate is not None and estimate['samples'] >= settings.WEBHOOK_LATENCY_MIN_SAMPLES:
+        timeout = (estimate['srtt_ms'] + 4 * estimate['rttvar_ms']) / 1000
+        read = _clamp(timeout, settings.WEBHOOK_READ_TIMEOUT_MIN, settings.WEBHOOK_READ_TIMEOUT_MAX)
+
+    return destination.connect_timeout or connect, destination.read_timeout or read
+
+
+def timeouts_for(destination):
+    """(connect, read) timeouts in seconds to use for the next delivery to ``destination``."""
+    if destination.connect_timeout and destination.read_timeout:
+        return destination.connect_timeout, destination.read_timeout
+    return timeouts_from(destination, get_estimate(destination.id))
@@ -0,0 +1,42 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from delivery.exports import iter_ndjson
+from delivery.models import Event
+
+
+class Command(BaseCommand):
+    help = "Stream events and their delivery attempts out as NDJSON (optionally gzipped)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', default='-', help="File to write to, '-' for stdout (default)")
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output')
+        parser.add_argument('--status', help='Comma separated statuses to export')
+        parser.add_argument('--destination', help='Only events for this destination id')
+        parser.add_argument('--created-after', help='ISO datetime, inclusive')
+        parser.add_argument('--created-before', help='ISO datetime, exclusive')
+        parser.add_argument('--chunk-size', type=int, help='Events fetched per database round trip')
+
+    def handle(self, *args, **options):
+        queryset = Event.objects.order_by('created_at', 'id')
+
+        if options['status']:
+            queryset = queryset.filter(status__in=options['status'].split(','))
+        if options['destination']:
+            queryset = queryset.filter(destination_id=options['destination'])
+        for option, lookup in (('created_after', 'created_at__gte'), ('created_before', 'created_at__lt')):
+            if options[option]:
+                value = parse_datetime(options[option])
+                if value is None:
+                    raise CommandError(f"--{option.replace('_', '-')} must be an ISO 8601 datetime")
+                queryset = queryset.filter(**{lookup: value})
+
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        try:
+            for data in iter_ndjson(queryset, chunk_size=options['chunk_size'], compress=options['gzip']):
+                output.write(data)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
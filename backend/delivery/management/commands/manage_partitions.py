@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from delivery import partitioning
+
+
+class Command(BaseCommand):
+    help = "Create upcoming monthly partitions, or convert tables listed in WEBHOOK_PARTITIONED_MODELS"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true', help='Convert configured tables that are not partitioned yet')
+        parser.add_argument('--months-ahead', type=int, help='How many future months to create partitions for')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Table partitioning is only supported on PostgreSQL")
+
+        if options['convert']:
+            with transaction.atomic(), connection.schema_editor() as schema_editor:
+                for model, column in partitioning.configured_models():
+                    partitioning.convert_to_partitioned(schema_editor, model, column, options['months_ahead'])
+                    self.stdout.write(f"{model._meta.db_table} is partitioned by {column}")
+
+        partitioning.ensure_future_partitions(options['months_ahead'])
+        self.stdout.write(self.style.SUCCESS("Partitions are up to date"))
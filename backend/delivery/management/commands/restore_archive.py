@@ -0,0 +1,21 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from delivery.retention import restore_archive
+
+
+class Command(BaseCommand):
+    help = "Load events and delivery attempts back from a retention archive (.ndjson.gz)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Archive file(s) written by the retention job')
+        parser.add_argument('--batch-size', type=int, help='Events inserted per transaction')
+
+    def handle(self, *args, **options):
+        for path in options['paths']:
+            if not Path(path).is_file():
+                raise CommandError(f"Archive {path} does not exist")
+
+            events, attempts = restore_archive(path, batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"{path}: restored {events} events and {attempts} delivery attempts"))
@@ -0,0 +1,36 @@
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand
+
+from delivery.attempt_recorder import recorder
+from delivery.engine import AsyncDeliveryEngine
+
+
+class Command(BaseCommand):
+    help = "Run the asyncio delivery engine (used when WEBHOOK_DELIVERY_MODE='async')"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, help='Max deliveries in flight at once')
+        parser.add_argument('--batch-size', type=int, help='Max events claimed from the database per poll')
+        parser.add_argument('--poll-interval', type=float, help='Seconds to wait when there is nothing to deliver')
+
+    def handle(self, *args, **options):
+        engine = AsyncDeliveryEngine(
+            concurrency=options['concurrency'],
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+        )
+        if recorder.enabled:
+            recorder.replay_spools()
+        try:
+            asyncio.run(self._run(engine))
+        finally:
+            if recorder.enabled:
+                recorder.flush()
+
+    async def _run(self, engine):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, engine.stop)
+        await engine.run()
@@ -0,0 +1,24 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from delivery.persister import Persister
+
+
+class Command(BaseCommand):
+    help = "Write events buffered in the ingestion stream to the database (WEBHOOK_INGEST_MODE='stream')"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumer', help='Consumer name in the stream group (default: hostname-pid)')
+        parser.add_argument('--batch-size', type=int, help='Max entries persisted per bulk_create')
+        parser.add_argument('--block-ms', type=int, help='How long to wait for new entries per read')
+
+    def handle(self, *args, **options):
+        persister = Persister(
+            consumer=options['consumer'],
+            batch_size=options['batch_size'],
+            block_ms=options['block_ms'],
+        )
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: persister.stop())
+        persister.run()
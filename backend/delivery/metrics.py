@@ -0,0 +1,184 @@
+"""
+Prometheus metrics, aggregated in Redis so every web and worker process
+contributes to the same numbers. Served by GET /metrics.
+
+Recording is a couple of HINCRBY / HINCRBYFLOAT calls sent in one pipeline;
+nothing is ever computed with COUNT(*) queries. Counters and histogram
+buckets live in two Redis hashes, keyed by the Prometheus series name:
+
+    webhook:metrics:counters    'webhook_delivery_attempts_total{outcome="success"}' -> 1234
+    webhook:metrics:histograms  'webhook_delivery_duration_seconds{destination="..."}|0.25' -> 17
+
+Histogram buckets are stored as plain (non-cumulative) counts and added up
+when rendered. Queue depth is read from the broker (LLEN) and the ingestion
+buffer's lag from its stream (XLEN) at scrape time.
+
+Metrics are best effort: if Redis is unavailable, samples are dropped, and
+a scrape renders whatever could still be read (e.g. only the queue depths).
+"""
+import logging
+
+import redis
+from django.conf import settings
+
+from .ingest_stream import STREAM_KEY
+from .redis_client import get_redis
+from .scheduler import SCHEDULE_KEY
+
+logger = logging.getLogger(__name__)
+
+COUNTERS_KEY = 'webhook:metrics:counters'
+HISTOGRAMS_KEY = 'webhook:metrics:histograms'
+
+# Seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+METRICS = {
+    'webhook_events_ingested_total': ('counter', 'Events accepted by the API'),
+    'webhook_enqueue_latency_seconds': ('histogram', 'Time from ingestion until the first delivery attempt starts'),
+    'webhook_delivery_duration_seconds': ('histogram', 'Delivery request duration per destination'),
+    'webhook_delivery_attempts_total': ('counter', 'Delivery attempts by outcome'),
+    'webhook_delivery_retries_total': ('counter', 'Delivery attempts scheduled for a retry'),
+    'webhook_events_failed_total': ('counter', 'Events given up on after their last retry'),
+    'webhook_queue_depth': ('gauge', 'Delivery tasks waiting in each Celery queue'),
+    'webhook_scheduled_deliveries': ('gauge', 'Retries and deferred deliveries waiting to be due'),
+    'webhook_ingest_stream_lag': ('gauge', 'Buffered events not persisted yet (WEBHOOK_INGEST_MODE=stream)'),
+}
+
+_broker = None
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{key}="{value}"' for key, value in sorted(labels.items())) + '}'
+
+
+def _bucket(value):
+    for bound in LATENCY_BUCKETS:
+        if value <= bound:
+            return str(bound)
+    return '+Inf'
+
+
+def _execute(pipe):
+    try:
+        pipe.execute()
+    except redis.RedisError as exc:
+        logger.warning(f"Metrics unavailable, samples dropped: {exc}")
+
+
+def _add_observation(pipe, name, value, labels):
+    series = _series(name, labels)
+    pipe.hincrby(HISTOGRAMS_KEY, f"{series}|{_bucket(value)}", 1)
+    pipe.hincrby(HISTOGRAMS_KEY, f"{series}|count", 1)
+    pipe.hincrbyfloat(HISTOGRAMS_KEY, f"{series}|sum", value)
+
+
+def inc(name, amount=1, **labels):
+    if not amount:
+        return
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.hincrby(COUNTERS_KEY, _series(name, labels), amount)
+    _execute(pipe)
+
+
+def observe(name, values, **labels):
+    """Add one or more samples (seconds) to a histogram."""
+    if not values:
+        return
+    pipe = get_redis().pipeline(transaction=False)
+    for value in values:
+        _add_observation(pipe, name, value, labels)
+    _execute(pipe)
+
+
+def record_attempt(destination_id, successful, seconds, count=1):
+    """One delivery request: ``count`` attempts (events) and its duration, in one round trip."""
+    pipe = get_redis().pipeline(transaction=False)
+    outcome = 'success' if successful else 'failure'
+    pipe.hincrby(COUNTERS_KEY, _series('webhook_delivery_attempts_total', {'outcome': outcome}), count)
+    if seconds is not None:
+        _add_observation(pipe, 'webhook_delivery_duration_seconds', seconds, {'destination': destination_id})
+    _execute(pipe)
+
+
+def _broker_redis():
+    global _broker
+    if _broker is None:
+        _broker = redis.Redis.from_url(
+            settings.CELERY_BROKER_URL,
+            socket_timeout=settings.WEBHOOK_REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.WEBHOOK_REDIS_SOCKET_TIMEOUT,
+        )
+    return _broker
+
+
+def _queue_depths():
+    # With the Redis broker each Celery queue is a plain list named after it
+    queues = [queue.name for queue in settings.CELERY_TASK_QUEUES]
+    pipe = _broker_redis().pipeline(transaction=False)
+    for queue in queues:
+        pipe.llen(queue)
+    return dict(zip(queues, pipe.execute()))
+
+
+def _render_histogram(name, fields, lines):
+    # series -> {bucket: count, 'sum': ..., 'count': ...}
+    by_series = {}
+    for field, value in fields.items():
+        series, _, part = field.rpartition('|')
+        if series.split('{', 1)[0] == name:
+            by_series.setdefault(series, {})[part] = float(value)
+
+    for series, parts in sorted(by_series.items()):
+        labels = series[len(name):].strip('{}')
+        prefix = labels + ',' if labels else ''
+        cumulative = 0
+        for bound in [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf']:
+            cumulative += parts.get(bound, 0)
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {int(cumulative)}')
+        lines.append(f'{series.replace(name, name + "_sum", 1)} {parts.get("sum", 0)}')
+        lines.append(f'{series.replace(name, name + "_count", 1)} {int(parts.get("count", 0))}')
+
+
+def render():
+    """Every metric in the Prometheus text exposition format."""
+    client = get_redis()
+    pipe = client.pipeline(transaction=False)
+    pipe.hgetall(COUNTERS_KEY)
+    pipe.hgetall(HISTOGRAMS_KEY)
+    pipe.zcard(SCHEDULE_KEY)
+    pipe.xlen(STREAM_KEY)
+    try:
+        counters, histograms, scheduled, ingest_lag = pipe.execute()
+    except redis.RedisError as exc:
+        # Still serve what the broker can tell: a scrape shouldn't 500 over one Redis
+        logger.warning(f"Could not read metrics from Redis: {exc}")
+        counters, histograms, scheduled, ingest_lag = {}, {}, None, None
+
+    try:
+        depths = _queue_depths()
+    except redis.RedisError as exc:
+        logger.warning(f"Could not read queue depths from the broker: {exc}")
+        depths = {}
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for series, value in sorted(counters.items()):
+                if series.split('{', 1)[0] == name:
+                    lines.append(f'{series} {value}')
+        elif kind == 'histogram':
+            _render_histogram(name, histograms, lines)
+        elif name == 'webhook_queue_depth':
+            for queue, depth in sorted(depths.items()):
+                lines.append(f'{_series(name, {"queue": queue})} {depth}')
+        elif name == 'webhook_scheduled_deliveries' and scheduled is not None:
+            lines.append(f'{name} {scheduled}')
+        elif name == 'webhook_ingest_stream_lag' and ingest_lag is not None:
+            lines.append(f'{name} {ingest_lag}')
+
+    return '\n'.join(lines) + '\n'
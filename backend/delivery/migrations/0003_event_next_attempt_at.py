@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0002_alter_destination_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, help_text='When the async delivery engine may (re)try this event', null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0003_event_next_attempt_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='destination',
+            name='max_concurrent_deliveries',
+            field=models.PositiveIntegerField(blank=True, help_text='Optional cap on deliveries in flight at the same time', null=True),
+        ),
+        migrations.AddField(
+            model_name='destination',
+            name='max_requests_per_second',
+            field=models.PositiveIntegerField(blank=True, help_text='Optional cap on deliveries per second, shared by all workers', null=True),
+        ),
+    ]
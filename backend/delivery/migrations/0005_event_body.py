@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0004_destination_rate_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='body',
+            field=models.BinaryField(blank=True, help_text='Canonical encoded payload bytes, exactly as signed and sent', null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0005_event_body'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='destination',
+            name='previous_secret_key',
+            field=models.CharField(blank=True, help_text='Secret replaced by the last rotation, still signed with during the grace window', max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='destination',
+            name='secret_rotated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='destination',
+            name='secret_version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
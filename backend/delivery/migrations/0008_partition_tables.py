@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-18 12:58
+
+from django.db import migrations
+
+
+def partition_tables(apps, schema_editor):
+    # Opt-in and PostgreSQL only, see delivery/partitioning.py
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    from delivery import partitioning
+
+    for model, column in partitioning.configured_models(apps):
+        partitioning.convert_to_partitioned(schema_editor, model, column)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0007_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_tables, migrations.RunPython.noop),
+    ]
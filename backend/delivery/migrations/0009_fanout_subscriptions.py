@@ -0,0 +1,57 @@
+# Generated by Django 6.0 on 2026-10-18 14:02
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0008_partition_tables'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventType',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.SlugField(help_text='e.g. "order.created"', max_length=100, unique=True)),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Message',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('payload', models.JSONField()),
+                ('body', models.BinaryField(help_text='Canonical encoded payload bytes, exactly as signed and sent')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('event_type', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='messages', to='delivery.eventtype')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Subscription',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('destination', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subscriptions', to='delivery.destination')),
+                ('event_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subscriptions', to='delivery.eventtype')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('event_type', 'destination'), name='unique_subscription')],
+            },
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='payload',
+            field=models.JSONField(blank=True, help_text='The raw JSON body received from the webhook source (empty when it lives on the message)', null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='message',
+            field=models.ForeignKey(blank=True, help_text="Set when this event is one destination's copy of a fanned out message", null=True, on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='delivery.message'),
+        ),
+    ]
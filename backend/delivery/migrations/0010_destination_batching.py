@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-18 14:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0009_fanout_subscriptions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='destination',
+            name='batch_linger_ms',
+            field=models.PositiveIntegerField(default=1000, help_text='Batched delivery: how long to wait for more events before sending'),
+        ),
+        migrations.AddField(
+            model_name='destination',
+            name='batch_max_bytes',
+            field=models.PositiveIntegerField(blank=True, help_text='Batched delivery: optional cap on the size of one request body', null=True),
+        ),
+        migrations.AddField(
+            model_name='destination',
+            name='batch_max_size',
+            field=models.PositiveIntegerField(blank=True, help_text='Opt in to batched delivery: up to this many events per request (2 or more)', null=True),
+        ),
+    ]
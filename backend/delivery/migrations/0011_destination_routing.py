@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0010_destination_batching'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='destination',
+            name='delivery_queue',
+            field=models.CharField(blank=True, default='', help_text='Pin deliveries to this queue (one of WEBHOOK_ISOLATED_QUEUES) instead of routing by tier', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='destination',
+            name='tier',
+            field=models.CharField(choices=[('priority', 'Priority'), ('standard', 'Standard'), ('bulk', 'Bulk')], default='standard', max_length=20),
+        ),
+    ]
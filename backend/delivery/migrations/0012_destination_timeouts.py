@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0011_destination_routing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='destination',
+            name='connect_timeout',
+            field=models.FloatField(blank=True, help_text='Seconds; overrides the connect timeout derived from observed latency', null=True),
+        ),
+        migrations.AddField(
+            model_name='destination',
+            name='read_timeout',
+            field=models.FloatField(blank=True, help_text='Seconds; overrides the read timeout derived from observed latency', null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 16:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0012_destination_timeouts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliveryattempt',
+            name='duration_ms',
+            field=models.PositiveIntegerField(blank=True, help_text='Whole request, until the body was read', null=True),
+        ),
+        migrations.AddField(
+            model_name='deliveryattempt',
+            name='ttfb_ms',
+            field=models.PositiveIntegerField(blank=True, help_text='Until the response headers arrived', null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-18 16:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0013_deliveryattempt_timings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='destination',
+            name='max_retries',
+            field=models.PositiveSmallIntegerField(blank=True, help_text="Retries after the first attempt (defaults to the task's max_retries, 3)", null=True),
+        ),
+        migrations.AddField(
+            model_name='destination',
+            name='retry_base_delay',
+            field=models.PositiveIntegerField(default=60, help_text='Seconds before the first retry'),
+        ),
+        migrations.AddField(
+            model_name='destination',
+            name='retry_max_delay',
+            field=models.PositiveIntegerField(blank=True, help_text='Optional cap on any single backoff', null=True),
+        ),
+        migrations.AddField(
+            model_name='destination',
+            name='retry_policy',
+            field=models.CharField(choices=[('exponential', 'Exponential'), ('linear', 'Linear'), ('fixed', 'Fixed')], default='exponential', max_length=20),
+        ),
+    ]
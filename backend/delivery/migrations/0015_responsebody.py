@@ -0,0 +1,32 @@
+# Generated by Django 6.0 on 2026-10-18 17:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0014_destination_retry_policy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResponseBody',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('body', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='deliveryattempt',
+            name='response_body',
+            field=models.TextField(blank=True, help_text='Inline body of attempts logged before response_content', null=True),
+        ),
+        migrations.AddField(
+            model_name='deliveryattempt',
+            name='response_content',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='attempts', to='delivery.responsebody'),
+        ),
+    ]
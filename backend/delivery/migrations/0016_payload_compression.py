@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0015_responsebody'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='destination',
+            name='gzip_requests',
+            field=models.BooleanField(default=False, help_text='Send deliveries gzip-compressed (Content-Encoding: gzip); the signature covers the compressed bytes'),
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='body',
+            field=models.BinaryField(blank=True, help_text='Encoded payload bytes as signed and sent, possibly stored compressed', null=True),
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='payload',
+            field=models.JSONField(blank=True, help_text='The raw JSON body received from the webhook source (empty when it lives on the message or only the body is stored)', null=True),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='body',
+            field=models.BinaryField(help_text='Encoded payload bytes as signed and sent, possibly stored compressed'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='payload',
+            field=models.JSONField(blank=True, help_text='Empty when only the (compressed) body is stored', null=True),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 6.0 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+from delivery.partitioning import is_partitioned
+
+CONSTRAINT = models.UniqueConstraint(
+    fields=['destination', 'idempotency_key'],
+    condition=models.Q(idempotency_key__isnull=False),
+    name='unique_event_idempotency_key',
+)
+
+
+def add_constraint(apps, schema_editor):
+    Event = apps.get_model('delivery', 'Event')
+    with schema_editor.connection.cursor() as cursor:
+        if schema_editor.connection.vendor == 'postgresql' and is_partitioned(cursor, Event._meta.db_table):
+            # Unique indexes on a partitioned table must include the partition
+            # column, so duplicates are only caught by the Redis cache there
+            return
+    schema_editor.add_constraint(Event, CONSTRAINT)
+
+
+def remove_constraint(apps, schema_editor):
+    Event = apps.get_model('delivery', 'Event')
+    with schema_editor.connection.cursor() as cursor:
+        if schema_editor.connection.vendor == 'postgresql' and is_partitioned(cursor, Event._meta.db_table):
+            return
+    schema_editor.remove_constraint(Event, CONSTRAINT)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0016_payload_compression'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='destination',
+            name='deduplicate_payloads',
+            field=models.BooleanField(default=False, help_text='Treat an event with the same payload as an earlier one as a duplicate, even without an Idempotency-Key'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='idempotency_key',
+            field=models.CharField(blank=True, help_text='Idempotency-Key sent by the producer (or payload hash), unique per destination', max_length=255, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddConstraint(model_name='event', constraint=CONSTRAINT),
+            ],
+            database_operations=[
+                migrations.RunPython(add_constraint, remove_constraint),
+            ],
+        ),
+    ]
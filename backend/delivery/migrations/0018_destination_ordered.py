@@ -0,0 +1,22 @@
+# Generated by Django 6.0 on 2026-10-18 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0017_event_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='destination',
+            name='ordered',
+            field=models.BooleanField(default=False, help_text='Deliver events strictly one at a time in the order they were received (see delivery/ordering.py)'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('status__in', ['PENDING', 'PROCESSING'])), fields=['destination', 'created_at', 'id'], name='event_dest_active_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-18 20:40
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0018_destination_ordered'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='eventtype',
+            name='name',
+            field=models.CharField(help_text='e.g. "order.created"', max_length=100, unique=True, validators=[django.core.validators.RegexValidator('^[a-z0-9_.-]+$', 'Use lowercase letters, digits, dots, hyphens and underscores (e.g. order.created).')]),
+        ),
+    ]
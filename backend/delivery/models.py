@@ -1,9 +1,12 @@
 from django.db import models
-from django.core.validators import URLValidator
+from django.core.validators import RegexValidator, URLValidator
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 import uuid
 import re
 
+from .payloads import decode_payload
+
 
 class FlexibleURLValidator(URLValidator):
     """
@@ -41,6 +44,18 @@ class FlexibleURLValidator(URLValidator):
 class Destination(models.Model):
     """Represents a client/endpoint that wants to receive webhooks."""
     
+    RETRY_POLICY_CHOICES = [
+        ('exponential', 'Exponential'),   # base, 2x base, 4x base, ...
+        ('linear', 'Linear'),             # base, 2x base, 3x base, ...
+        ('fixed', 'Fixed'),               # base every time
+    ]
+
+    TIER_CHOICES = [
+        ('priority', 'Priority'),
+        ('standard', 'Standard'),
+        ('bulk', 'Bulk'),
+    ]
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     url = models.CharField(
         max_length=500,
@@ -48,15 +63,158 @@ class Destination(models.Model):
         help_text="The endpoint where we send the webhook"
     )
     secret_key = models.CharField(max_length=255, default=uuid.uuid4, help_text="Used for HMAC signature verification")
+    previous_secret_key = models.CharField(
+        max_length=255,
+        null=True,
+        blank=True,
+        help_text="Secret replaced by the last rotation, still signed with during the grace window"
+    )
+    secret_version = models.PositiveIntegerField(default=1)
+    secret_rotated_at = models.DateTimeField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
+    max_requests_per_second = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Optional cap on deliveries per second, shared by all workers"
+    )
+    max_concurrent_deliveries = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Optional cap on deliveries in flight at the same time"
+    )
+    batch_max_size = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Opt in to batched delivery: up to this many events per request (2 or more)"
+    )
+    batch_linger_ms = models.PositiveIntegerField(
+        default=1000,
+        help_text="Batched delivery: how long to wait for more events before sending"
+    )
+    batch_max_bytes = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Batched delivery: optional cap on the size of one request body"
+    )
+    gzip_requests = models.BooleanField(
+        default=False,
+        help_text="Send deliveries gzip-compressed (Content-Encoding: gzip); the signature covers the compressed bytes"
+    )
+    deduplicate_payloads = models.BooleanField(
+        default=False,
+        help_text="Treat an event with the same payload as an earlier one as a duplicate, even without an Idempotency-Key"
+    )
+    ordered = models.BooleanField(
+        default=False,
+        help_text="Deliver events strictly one at a time in the order they were received (see delivery/ordering.py)"
+    )
+    connect_timeout = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="Seconds; overrides the connect timeout derived from observed latency"
+    )
+    read_timeout = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="Seconds; overrides the read timeout derived from observed latency"
+    )
+    retry_policy = models.CharField(max_length=20, choices=RETRY_POLICY_CHOICES, default='exponential')
+    retry_base_delay = models.PositiveIntegerField(default=60, help_text="Seconds before the first retry")
+    retry_max_delay = models.PositiveIntegerField(null=True, blank=True, help_text="Optional cap on any single backoff")
+    max_retries = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        help_text="Retries after the first attempt (defaults to the task's max_retries, 3)"
+    )
+    tier = models.CharField(max_length=20, choices=TIER_CHOICES, default='standard')
+    delivery_queue = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+        help_text="Pin deliveries to this queue (one of WEBHOOK_ISOLATED_QUEUES) instead of routing by tier"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"Destination {self.url}"
 
+    def rotate_secret(self):
+        """Swap in a new secret, keeping the old one valid for the grace window."""
+        self.previous_secret_key = str(self.secret_key)
+        self.secret_key = str(uuid.uuid4())
+        self.secret_version += 1
+        self.secret_rotated_at = timezone.now()
+        self.save(update_fields=['previous_secret_key', 'secret_key', 'secret_version', 'secret_rotated_at'])
+
+
+# Dotted names like "order.created" are the convention, which a slug doesn't allow
+validate_event_type_name = RegexValidator(
+    r'^[a-z0-9_.-]+$',
+    "Use lowercase letters, digits, dots, hyphens and underscores (e.g. order.created).",
+)
+
+
+class EventType(models.Model):
+    """A named kind of event (e.g. "order.created") that destinations can subscribe to."""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = models.CharField(
+        max_length=100, unique=True, validators=[validate_event_type_name], help_text='e.g. "order.created"'
+    )
+    description = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class Subscription(models.Model):
+    """Destination X wants every message of event type Y."""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    event_type = models.ForeignKey(EventType, on_delete=models.CASCADE, related_name='subscriptions')
+    destination = models.ForeignKey(Destination, on_delete=models.CASCADE, related_name='subscriptions')
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event_type', 'destination'], name='unique_subscription'),
+        ]
+
+    def __str__(self):
+        return f"{self.destination} <- {self.event_type}"
+
+
+class Message(models.Model):
+    """
+    One published payload, stored ONCE no matter how many destinations receive it.
+
+    Each subscribed destination gets its own Event row (the delivery record,
+    with its own status and attempts) pointing back here.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    event_type = models.ForeignKey(EventType, on_delete=models.PROTECT, related_name='messages')
+    payload = models.JSONField(null=True, blank=True, help_text="Empty when only the (compressed) body is stored")
+    body = models.BinaryField(help_text="Encoded payload bytes as signed and sent, possibly stored compressed")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Message {self.id} ({self.event_type})"
+
+    def get_payload(self):
+        return self.payload if self.payload is not None else decode_payload(self.body)
+
 
 class Event(models.Model):
-    """Represents a single webhook event received from an external source."""
+    """
+    Represents a single webhook event received from an external source,
+    i.e. one payload to deliver to one destination.
+
+    Events created by fanning out a Message don't store the payload
+    themselves; it lives (once) on the message.
+    """
     
     STATUS_CHOICES = [
         ('PENDING', 'Pending'),
@@ -67,14 +225,88 @@ class Event(models.Model):
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     destination = models.ForeignKey(Destination, on_delete=models.CASCADE, related_name='events')
-    payload = models.JSONField(help_text="The raw JSON body received from the webhook source")
+    message = models.ForeignKey(
+        Message,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='deliveries',
+        help_text="Set when this event is one destination's copy of a fanned out message"
+    )
+    payload = models.JSONField(
+        null=True,
+        blank=True,
+        help_text="The raw JSON body received from the webhook source (empty when it lives on the message or only the body is stored)"
+    )
+    body = models.BinaryField(
+        null=True,
+        blank=True,
+        help_text="Encoded payload bytes as signed and sent, possibly stored compressed"
+    )
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
     attempts_count = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When the async delivery engine may (re)try this event"
+    )
+    idempotency_key = models.CharField(
+        max_length=255,
+        null=True,
+        blank=True,
+        help_text="Idempotency-Key sent by the producer (or payload hash), unique per destination"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # Authoritative duplicate check behind the Redis cache (delivery/idempotency.py)
+            models.UniqueConstraint(
+                fields=['destination', 'idempotency_key'],
+                condition=models.Q(idempotency_key__isnull=False),
+                name='unique_event_idempotency_key',
+            ),
+        ]
+        indexes = [
+            # Dashboards / listings: "all FAILED events, newest first"
+            models.Index(fields=['status', 'created_at'], name='event_status_created_idx'),
+            # Per-destination history and time range filters
+            models.Index(fields=['destination', 'created_at'], name='event_dest_created_idx'),
+            # Async engine / retry sweeps: "what is due now?"
+            models.Index(fields=['status', 'next_attempt_at'], name='event_status_next_idx'),
+            # Ordered delivery: "oldest unfinished event of this destination"
+            models.Index(
+                fields=['destination', 'created_at', 'id'],
+                condition=models.Q(status__in=['PENDING', 'PROCESSING']),
+                name='event_dest_active_idx',
+            ),
+        ]
+
     def __str__(self):
         return f"Event {self.id} - {self.status}"
 
+    def get_payload(self):
+        if self.message_id:
+            return self.message.get_payload()
+        if self.payload is None and self.body is not None:
+            return decode_payload(self.body)
+        return self.payload
+
+
+class ResponseBody(models.Model):
+    """
+    A captured destination response body, stored once no matter how many
+    attempts got it back (an endpoint typically answers "ok" or the same
+    error page every time). Addressed by the SHA-256 of its text.
+    """
+
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    body = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
+
 
 class DeliveryAttempt(models.Model):
     """Logs every single attempt to deliver an event to its destination."""
@@ -82,9 +314,38 @@ class DeliveryAttempt(models.Model):
     event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='attempts')
     status = models.CharField(max_length=20)
     response_status_code = models.IntegerField(null=True, blank=True)
-    response_body = models.TextField(null=True, blank=True)
+    # No database-level FK: bodies are written ahead of (possibly buffered)
+    # attempts and purged by retention once nothing references them
+    response_content = models.ForeignKey(
+        ResponseBody,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name='attempts',
+    )
+    response_body = models.TextField(null=True, blank=True, help_text="Inline body of attempts logged before response_content")
+    duration_ms = models.PositiveIntegerField(null=True, blank=True, help_text="Whole request, until the body was read")
+    ttfb_ms = models.PositiveIntegerField(null=True, blank=True, help_text="Until the response headers arrived")
     timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # An event's attempt history in order (also covers the plain event FK lookups)
+            models.Index(fields=['event', 'timestamp'], name='attempt_event_ts_idx'),
+            # Time range scans: dashboards, retention
+            models.Index(fields=['timestamp'], name='attempt_ts_idx'),
+        ]
     
     def __str__(self):
         return f"Attempt for Event {self.event_id} at {self.timestamp}"
 
+    def get_response_body(self):
+        if not self.response_content_id:
+            return self.response_body
+        try:
+            return self.response_content.body
+        except ResponseBody.DoesNotExist:
+            # Purged by retention meanwhile (see delivery/response_bodies.py)
+            return None
+
@@ -0,0 +1,85 @@
+"""
+Ordered (FIFO) delivery for destinations with Destination.ordered on.
+
+Normally every event gets its own task, so a destination receives its events
+in whatever order workers happen to finish them, and a retrying event is
+overtaken by everything behind it. An ordered destination gets its events
+strictly one at a time, in the order they were received (created_at, then id),
+while other destinations are still delivered in parallel.
+
+Celery mode: a per-destination lease in Redis
+    webhook:ordered:<destination id> -> token, SET NX with a TTL of
+    WEBHOOK_ORDERED_LEASE_SECONDS. Events of an ordered destination don't get
+    a process_webhook_event task of their own; enqueue_deliveries() publishes
+    one deliver_ordered task per destination instead (a stray per-event task
+    redirects to it). The run that holds the lease delivers the destination's
+    oldest unfinished event (its "head"), then the next, ... until none is
+    left, renewing the lease after each one. After WEBHOOK_ORDERED_MAX_PER_RUN
+    events or WEBHOOK_ORDERED_MAX_SECONDS_PER_RUN seconds it hands over to a
+    fresh run. Runs that can't get the lease
+    exit at once: the holder is already working through the same events.
+
+Async mode (delivery/engine.py): the same rule straight from the database,
+    an event of an ordered destination is only claimed once no earlier event
+    of that destination is PENDING or PROCESSING.
+
+Head-of-line semantics, in both modes:
+    - the head blocks every later event until it is finished: delivered
+      (SUCCESS), or given up on (FAILED after a 4xx or its last retry)
+    - a head waiting for a retry, or deferred by the circuit breaker or the
+      rate limits, keeps blocking; its next_attempt_at says until when, and
+      the scheduled run at that time resumes the destination (a run that
+      comes too early schedules another one for next_attempt_at)
+    - a FAILED head doesn't stop the destination: the next event goes out
+      right after it, so a poison event costs at most max_retries backoffs
+
+Delivery stays at-least-once: a worker that dies mid-delivery, or outlives
+its lease, can make the head go out twice, but never after a later event.
+
+Ordered destinations can't use batched delivery, and ordering only holds
+from the moment the flag is on: tasks already running keep going.
+If Redis is unavailable the lease can't be taken and delivery to ordered
+destinations pauses (fails closed) instead of giving up the order.
+"""
+import uuid
+
+from django.conf import settings
+
+from .redis_client import get_redis
+
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def _lease_key(destination_id):
+    return f"webhook:ordered:{destination_id}"
+
+
+def acquire(destination_id):
+    """Take the destination's lease. Returns its token, or None if another run holds it."""
+    token = uuid.uuid4().hex
+    if get_redis().set(_lease_key(destination_id), token, nx=True, px=settings.WEBHOOK_ORDERED_LEASE_SECONDS * 1000):
+        return token
+    return None
+
+
+def renew(destination_id, token):
+    """Extend the lease for another WEBHOOK_ORDERED_LEASE_SECONDS; False if it was lost meanwhile."""
+    return bool(get_redis().eval(
+        _RENEW_SCRIPT, 1, _lease_key(destination_id), token, settings.WEBHOOK_ORDERED_LEASE_SECONDS * 1000
+    ))
+
+
+def release(destination_id, token):
+    get_redis().eval(_RELEASE_SCRIPT, 1, _lease_key(destination_id), token)
@@ -0,0 +1,17 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class EventCursorPagination(CursorPagination):
+    """
+    Keyset (cursor) pagination for events, oldest first.
+
+    Every page is an index range scan on created_at (plus id to break ties),
+    so page 10,000 is as cheap as page 1, unlike OFFSET based pagination.
+    Follow the "next" link to walk the whole table.
+    """
+
+    ordering = ('created_at', 'id')
+    page_size = settings.WEBHOOK_EVENTS_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.WEBHOOK_EVENTS_MAX_PAGE_SIZE
@@ -0,0 +1,160 @@
+"""
+Optional monthly range partitioning for the big tables (PostgreSQL only).
+
+    WEBHOOK_PARTITIONED_MODELS=deliveryattempt          -> partition attempts by timestamp
+    WEBHOOK_PARTITIONED_MODELS=event,deliveryattempt    -> events by created_at as well
+
+Converting a table (migration 0008, or `manage.py manage_partitions --convert`):
+    1. the table is renamed out of the way and an empty partitioned copy created
+    2. monthly partitions are created from the oldest row up to
+       WEBHOOK_PARTITION_MONTHS_AHEAD months from now, plus a DEFAULT partition
+    3. rows are copied over, the old table dropped, and the primary key,
+       indexes and foreign keys recreated on the partitioned table
+
+PostgreSQL requires the partition column in every unique index, so the
+primary key becomes (id, <column>). Nothing can hold a foreign key to a
+partitioned Event, so partitioning events drops the database-level FK from
+delivery attempts; Django still cascades deletes itself. For the same reason
+the (destination, idempotency_key) unique constraint is dropped: duplicate
+ingestion is then only caught by the Redis cache (delivery/idempotency.py).
+
+With the new primary key, bulk_create(ignore_conflicts=True) no longer skips
+a row whose id is already stored: created_at is set on every INSERT, so
+(id, created_at) is always new. The ingestion persister (delivery/persister.py)
+therefore looks up the ids of a batch before inserting it when events are
+partitioned. Two persisters replaying the same entries at the very same
+moment can still both insert them; the bulk endpoint always generates fresh
+ids and isn't affected.
+
+Future partitions are created every night by the create_future_partitions task.
+"""
+import logging
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.db import connection, models
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Model name -> column the table is partitioned by
+PARTITION_COLUMNS = {
+    'event': 'created_at',
+    'deliveryattempt': 'timestamp',
+}
+
+
+def configured_models(apps=django_apps):
+    """(model, column) pairs to partition, events first since attempts reference them."""
+    names = [name for name in PARTITION_COLUMNS if name in settings.WEBHOOK_PARTITIONED_MODELS]
+    return [(apps.get_model('delivery', name), PARTITION_COLUMNS[name]) for name in names]
+
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def _month_start(value):
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _add_months(month, count):
+    year, index = divmod(month.month - 1 + count, 12)
+    return month.replace(year=month.year + year, month=index + 1)
+
+
+def create_partition(cursor, table, month):
+    """Create the partition holding ``month`` (a month start), if it doesn't exist yet."""
+    name = f"{table}_p{month:%Y_%m}"
+    cursor.execute(
+        f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}" FOR VALUES FROM (%s) TO (%s)',
+        [month, _add_months(month, 1)]
+    )
+
+
+def ensure_future_partitions(months_ahead=None):
+    """Make sure every partitioned table has partitions for the coming months."""
+    if connection.vendor != 'postgresql':
+        return
+
+    months_ahead = settings.WEBHOOK_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    this_month = _month_start(timezone.now())
+
+    with connection.cursor() as cursor:
+        for model, _ in configured_models():
+            table = model._meta.db_table
+            if not is_partitioned(cursor, table):
+                continue
+            for offset in range(months_ahead + 1):
+                create_partition(cursor, table, _add_months(this_month, offset))
+
+
+def convert_to_partitioned(schema_editor, model, column, months_ahead=None):
+    """Turn ``model``'s table into a monthly range-partitioned table (see module docstring)."""
+    months_ahead = settings.WEBHOOK_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    table = model._meta.db_table
+    legacy = f"{table}_unpartitioned"
+    pk = model._meta.pk
+    qn = schema_editor.quote_name
+
+    with schema_editor.connection.cursor() as cursor:
+        if is_partitioned(cursor, table):
+            return
+
+        logger.info(f"Converting {table} to a table partitioned by {column}")
+
+        cursor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(legacy)}')
+        cursor.execute(
+            f'CREATE TABLE {qn(table)} (LIKE {qn(legacy)} INCLUDING DEFAULTS) '
+            f'PARTITION BY RANGE ({qn(column)})'
+        )
+
+        # Auto-increment ids: identity columns don't carry over, use a plain sequence
+        if isinstance(pk, models.AutoField):
+            sequence = f"{table}_{pk.column}_part_seq"
+            cursor.execute(f'CREATE SEQUENCE {qn(sequence)} OWNED BY {qn(table)}.{qn(pk.column)}')
+            cursor.execute(
+                f'SELECT setval(%s, COALESCE((SELECT MAX({qn(pk.column)}) FROM {qn(legacy)}), 0) + 1, false)',
+                [sequence]
+            )
+            cursor.execute(f"ALTER TABLE {qn(table)} ALTER COLUMN {qn(pk.column)} SET DEFAULT nextval('{sequence}')")
+
+        cursor.execute(f'SELECT MIN({qn(column)}) FROM {qn(legacy)}')
+        oldest = cursor.fetchone()[0] or timezone.now()
+        month = _month_start(oldest)
+        last_month = _add_months(_month_start(timezone.now()), months_ahead)
+        while month <= last_month:
+            create_partition(cursor, table, month)
+            month = _add_months(month, 1)
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {qn(table + "_default")} PARTITION OF {qn(table)} DEFAULT')
+
+        cursor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {qn(legacy)}')
+        # CASCADE also drops foreign keys pointing at the old table
+        cursor.execute(f'DROP TABLE {qn(legacy)} CASCADE')
+
+        cursor.execute(f'ALTER TABLE {qn(table)} ADD PRIMARY KEY ({qn(pk.column)}, {qn(column)})')
+
+        for field in model._meta.local_fields:
+            if field.remote_field is None or not field.db_constraint:
+                continue
+            schema_editor.execute(schema_editor._create_index_sql(model, fields=[field]))
+            if not is_partitioned(cursor, field.related_model._meta.db_table):
+                schema_editor.execute(schema_editor._create_fk_sql(model, field, "_fk_%(to_table)s_%(to_column)s"))
+
+        # Foreign keys from other tables into this one were dropped above and can't
+        # come back: referencing a partitioned table needs a unique index on id alone
+        for related in model._meta.related_objects:
+            if not getattr(related.field, 'db_constraint', False):
+                continue
+            logger.warning(
+                f"Foreign key {related.related_model._meta.db_table}.{related.field.column} -> {table} "
+                f"is no longer enforced by the database"
+            )
+
+        for constraint in model._meta.constraints:
+            logger.warning(f"Constraint {constraint.name} on {table} is no longer enforced by the database")
+
+    for index in model._meta.indexes:
+        schema_editor.add_index(model, index)
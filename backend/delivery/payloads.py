@@ -0,0 +1,100 @@
+"""
+Payload encoding, storage compression and transport encoding.
+
+Storage (WEBHOOK_PAYLOAD_COMPRESSION = '' | 'gzip' | 'zstd'):
+    With compression on, a new event's (or message's) payload is only kept as
+    its encoded body, compressed when it's at least
+    WEBHOOK_PAYLOAD_COMPRESSION_MIN_BYTES and that actually saves space; the
+    payload JSON column is left NULL. Compressed bodies are recognised by the
+    gzip / zstd magic bytes (canonical JSON never starts with those), so rows
+    written with any setting can always be read back, and nothing is
+    decompressed until the body or payload is actually needed.
+    'zstd' needs the optional zstandard package.
+
+Transport (Destination.gzip_requests):
+    Deliveries to destinations that opt in are sent gzip-compressed with
+    Content-Encoding: gzip. The signature covers those exact compressed bytes.
+    A body stored as gzip is sent as-is, without recompressing it.
+"""
+import gzip
+import json
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for WEBHOOK_PAYLOAD_COMPRESSION = 'zstd'
+    zstandard = None
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def encode_payload(payload):
+    """
+    Canonical JSON encoding of an event payload.
+
+    These exact bytes are computed once, stored on the Event, signed and sent
+    on every attempt, so what the receiver gets is byte-for-byte what we signed.
+    Keys are sorted and separators compact, so the same payload always encodes
+    to the same bytes.
+    """
+    return json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def gzip_compress(body):
+    # mtime=0 keeps the output deterministic: the same body always compresses to the same bytes
+    return gzip.compress(body, compresslevel=settings.WEBHOOK_GZIP_LEVEL, mtime=0)
+
+
+def _zstd():
+    if zstandard is None:
+        raise ImproperlyConfigured("WEBHOOK_PAYLOAD_COMPRESSION = 'zstd' requires the zstandard package")
+    return zstandard
+
+
+def compress_body(body, codec=None):
+    """The stored form of an encoded body (compressed only if that's worth it)."""
+    codec = settings.WEBHOOK_PAYLOAD_COMPRESSION if codec is None else codec
+    if not codec or len(body) < settings.WEBHOOK_PAYLOAD_COMPRESSION_MIN_BYTES:
+        return body
+    if codec == 'gzip':
+        compressed = gzip_compress(body)
+    elif codec == 'zstd':
+        compressed = _zstd().ZstdCompressor(level=settings.WEBHOOK_ZSTD_LEVEL).compress(body)
+    else:
+        raise ImproperlyConfigured(f"Unknown WEBHOOK_PAYLOAD_COMPRESSION: {codec!r}")
+    return compressed if len(compressed) < len(body) else body
+
+
+def decompress_body(stored):
+    """The canonical encoded bytes of a stored body, whatever it was stored as."""
+    stored = bytes(stored)
+    if stored.startswith(GZIP_MAGIC):
+        return gzip.decompress(stored)
+    if stored.startswith(ZSTD_MAGIC):
+        return _zstd().ZstdDecompressor().decompress(stored)
+    return stored
+
+
+def decode_payload(stored):
+    return json.loads(decompress_body(stored))
+
+
+def storage_fields(payload, body=None):
+    """{'payload': ..., 'body': ...} to save for a new event or message (``body``: if already encoded)."""
+    body = encode_payload(payload) if body is None else body
+    if not settings.WEBHOOK_PAYLOAD_COMPRESSION:
+        return {'payload': payload, 'body': body}
+    return {'payload': None, 'body': compress_body(body)}
+
+
+def transport_body(stored, gzip_requested):
+    """The bytes to sign and send for a stored body."""
+    if not gzip_requested:
+        return decompress_body(stored)
+    stored = bytes(stored)
+    if stored.startswith(GZIP_MAGIC):
+        return stored
+    return gzip_compress(decompress_body(stored))
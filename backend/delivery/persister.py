@@ -0,0 +1,154 @@
+"""
+Drains the write-ahead ingestion stream into the database
+(see delivery/ingest_stream.py). Run with:
+
+    python manage.py run_ingest_persister
+
+A batch is written with one INSERT. If the database rejects it for its data
+(DataError, IntegrityError, or a value the driver refuses), the batch is
+written again row by row and the rows that still fail are dead-lettered, so
+one bad event doesn't keep the good ones of its batch from ever being
+stored. Malformed entries are dead-lettered right away. Any other error
+leaves the batch unacknowledged, to be retried once it's reclaimed.
+"""
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+
+import redis
+from django.conf import settings
+from django.db import DataError, IntegrityError, close_old_connections, transaction
+
+from . import ingest_stream
+from .models import Destination, Event
+from .payloads import storage_fields
+from .tasks import enqueue_deliveries
+
+logger = logging.getLogger(__name__)
+
+
+# Errors that come back however often a row is retried
+REJECTED_ERRORS = (DataError, IntegrityError, ValueError)
+
+
+def _event_from(fields):
+    body = fields['body'].encode('utf-8')
+    return Event(
+        id=uuid.UUID(fields['id']),
+        destination_id=uuid.UUID(fields['destination']),
+        idempotency_key=fields['key'] or None,
+        **storage_fields(json.loads(body), body),
+    )
+
+
+def _insert(events):
+    """INSERT ``events`` in one statement; returns the ids stored afterwards."""
+    with transaction.atomic():
+        if 'event' in settings.WEBHOOK_PARTITIONED_MODELS:
+            # The primary key of a partitioned table is (id, created_at), and
+            # created_at is new on every INSERT, so a replayed entry wouldn't
+            # conflict: leave out the ids that are already stored
+            existing = set(Event.objects.filter(id__in=[event.id for event in events]).values_list('id', flat=True))
+            events_to_insert = [event for event in events if event.id not in existing]
+        else:
+            events_to_insert = events
+        # Rows left by an earlier attempt at this batch, and idempotency key
+        # conflicts, are skipped
+        Event.objects.bulk_create(events_to_insert, ignore_conflicts=True)
+        return set(Event.objects.filter(id__in=[event.id for event in events]).values_list('id', flat=True))
+
+
+def persist(entries):
+    """
+    Write the events of ``entries`` [(entry id, fields)] with one bulk_create
+    and enqueue their deliveries. Entries that can't be persisted are
+    dead-lettered. Returns how many events exist afterwards.
+    """
+    events = []
+    entry_of = {}
+    for entry_id, fields in entries:
+        try:
+            event = _event_from(fields)
+        except (KeyError, TypeError, ValueError) as exc:
+            logger.error(f"Dead-lettering malformed ingestion entry {entry_id}: {exc!r}")
+            ingest_stream.dead_letter(entry_id, fields, f"Malformed entry: {exc!r}")
+            continue
+        events.append(event)
+        entry_of[event.id] = (entry_id, fields)
+
+    # Loaded once for the whole batch: enqueue_deliveries() routes by destination.
+    # Destinations deleted since the event was accepted are missing here
+    destinations = Destination.objects.in_bulk({event.destination_id for event in events})
+    dropped = [event.id for event in events if event.destination_id not in destinations]
+    if dropped:
+        logger.warning(f"Dropping {len(dropped)} buffered events whose destination no longer exists")
+    events = [event for event in events if event.destination_id in destinations]
+    for event in events:
+        event.destination = destinations[event.destination_id]
+
+    if not events:
+        return 0
+    try:
+        stored = _insert(events)
+    except REJECTED_ERRORS as exc:
+        # Find the culprit(s): everything else in the batch still gets stored
+        logger.warning(f"Batch of {len(events)} buffered events was rejected ({exc!r}), inserting them one by one")
+        stored = set()
+        for event in events:
+            try:
+                stored |= _insert([event])
+            except REJECTED_ERRORS as exc:
+                entry_id, fields = entry_of[event.id]
+                logger.error(f"Dead-lettering ingestion entry {entry_id} (event {event.id}): {exc!r}")
+                ingest_stream.dead_letter(entry_id, fields, repr(exc))
+
+    events = [event for event in events if event.id in stored]
+    enqueue_deliveries(events)
+    return len(events)
+
+
+class Persister:
+
+    def __init__(self, consumer=None, batch_size=None, block_ms=None):
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.batch_size = batch_size or settings.WEBHOOK_INGEST_BATCH_SIZE
+        self.block_ms = block_ms or settings.WEBHOOK_INGEST_BLOCK_MS
+        self._stopping = False
+
+    def stop(self):
+        self._stopping = True
+
+    def run_once(self):
+        """Persist one batch (crashed consumers' entries first). Returns how many entries were handled."""
+        entries = ingest_stream.reclaim(self.consumer, self.batch_size)
+        if entries:
+            logger.warning(f"Reclaimed {len(entries)} ingestion entries left pending by another persister")
+        else:
+            entries = ingest_stream.read(self.consumer, self.batch_size, self.block_ms)
+        if not entries:
+            return 0
+
+        close_old_connections()
+        persisted = persist(entries)
+        ingest_stream.ack([entry_id for entry_id, _ in entries])
+        logger.info(f"Persisted {persisted} of {len(entries)} buffered events")
+        return len(entries)
+
+    def run(self):
+        ingest_stream.ensure_group()
+        logger.info(f"Ingest persister {self.consumer} started (batch_size={self.batch_size})")
+        while not self._stopping:
+            try:
+                self.run_once()
+            except redis.RedisError as exc:
+                logger.error(f"Ingestion stream unavailable: {exc}")
+                time.sleep(1)
+            except Exception:
+                # Database or broker down, ...: nothing was acknowledged, the
+                # batch is reclaimed once it has been idle long enough
+                logger.exception("Could not persist buffered events")
+                time.sleep(1)
+        logger.info("Ingest persister stopped")
@@ -0,0 +1,131 @@
+"""
+Per-destination rate limits and concurrency caps, enforced across every
+worker replica through Redis.
+
+    Destination.max_requests_per_second   -> token bucket (bursts of up to 1s worth of tokens)
+    Destination.max_concurrent_deliveries -> semaphore of expiring leases
+
+Both are optional; a destination with neither set never touches Redis here.
+Deliveries over the limit aren't failed: the caller defers them for
+retry_after seconds without using up a retry.
+
+Leases expire on their own after WEBHOOK_CONCURRENCY_LEASE_SECONDS, so a
+worker that dies mid-delivery can't hold a slot forever. If Redis itself
+is unavailable, deliveries are allowed.
+"""
+import logging
+import random
+import time
+import uuid
+
+import redis
+from django.conf import settings
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] = bucket hash
+# ARGV    = now, rate (tokens/sec)
+# Returns {allowed (0/1), wait_ms}
+_TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local capacity = rate
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+
+local allowed = 0
+local wait_ms = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait_ms = math.ceil((1 - tokens) / rate * 1000)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return {allowed, wait_ms}
+"""
+
+# KEYS[1] = zset of lease ids scored by expiry time
+# ARGV    = now, limit, lease_expires_at, lease_id
+_SEMAPHORE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+    redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[3]) - tonumber(ARGV[1])) + 1)
+    return 1
+end
+return 0
+"""
+
+
+def _concurrency_key(destination_id):
+    return f"webhook:concurrency:{destination_id}"
+
+
+def _rate_key(destination_id):
+    return f"webhook:rate:{destination_id}"
+
+
+def _throttle_delay():
+    # Jittered, so deferred deliveries don't all come back at the same instant
+    return settings.WEBHOOK_THROTTLE_RETRY_DELAY * random.uniform(1, 2)
+
+
+def acquire(destination):
+    """
+    Try to take a delivery slot for this destination.
+
+    Returns (allowed, retry_after_seconds, lease). Pass the lease to
+    release() once the HTTP call is done.
+    """
+    if not destination.max_requests_per_second and not destination.max_concurrent_deliveries:
+        return True, 0, None
+
+    client = get_redis()
+    now = time.time()
+    lease = None
+
+    try:
+        if destination.max_concurrent_deliveries:
+            lease = uuid.uuid4().hex
+            acquired = client.eval(
+                _SEMAPHORE_SCRIPT, 1, _concurrency_key(destination.id),
+                now, destination.max_concurrent_deliveries,
+                now + settings.WEBHOOK_CONCURRENCY_LEASE_SECONDS, lease,
+            )
+            if not acquired:
+                return False, _throttle_delay(), None
+
+        if destination.max_requests_per_second:
+            allowed, wait_ms = client.eval(
+                _TOKEN_BUCKET_SCRIPT, 1, _rate_key(destination.id),
+                now, destination.max_requests_per_second,
+            )
+            if not allowed:
+                release(destination, lease)
+                return False, wait_ms / 1000 + random.uniform(0, 0.1), None
+
+    except redis.RedisError as exc:
+        logger.warning(f"Rate limiter unavailable, allowing delivery: {exc}")
+        return True, 0, None
+
+    return True, 0, lease
+
+
+def release(destination, lease):
+    """Give back a concurrency slot taken by acquire()."""
+    if lease is None:
+        return
+    try:
+        get_redis().zrem(_concurrency_key(destination.id), lease)
+    except redis.RedisError as exc:
+        # The lease expires by itself after WEBHOOK_CONCURRENCY_LEASE_SECONDS
+        logger.warning(f"Rate limiter unavailable, could not release slot: {exc}")
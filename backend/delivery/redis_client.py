@@ -0,0 +1,23 @@
+import redis
+from django.conf import settings
+
+_client = None
+
+
+def get_redis():
+    """
+    Shared Redis client for state that all worker replicas need to see
+    (circuit breakers, rate limits, ...).
+
+    redis-py's connection pool notices when it's used from a forked
+    process and reconnects, so one lazily created client per process is enough.
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            settings.WEBHOOK_REDIS_URL,
+            decode_responses=True,
+            socket_timeout=settings.WEBHOOK_REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.WEBHOOK_REDIS_SOCKET_TIMEOUT,
+        )
+    return _client
@@ -0,0 +1,110 @@
+"""
+Content-addressed storage for captured response bodies.
+
+Most destinations answer every delivery with the same few bodies ("ok", an
+empty JSON object, the same error page), so instead of a copy per
+DeliveryAttempt each distinct body is stored once in ResponseBody, keyed by
+the SHA-256 of its text, and attempts point at it (response_content).
+
+Writing a body is an INSERT ... ON CONFLICT that only bumps the existing
+row's created_at, batched for buffered attempts. Each process remembers the
+hashes it wrote recently (an LRU of WEBHOOK_RESPONSE_BODY_CACHE_SIZE
+entries, each trusted for WEBHOOK_RESPONSE_BODY_CACHE_TTL seconds), so a
+repeated body costs no query.
+
+Retention deletes bodies no attempt references any more, but never one
+written within the cache TTL: a hash a process still trusts always has its
+row. An old body can't be assumed to be in use, since an event older than
+the retention period can still record a fresh attempt (deferrals don't use
+up retries), so the bump on every write is what keeps it alive. An attempt
+pointing at a purged body anyway (e.g. replayed from a spool much later)
+reads as having no body.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ResponseBody
+
+# sha256 -> monotonic time it was last written, least recently used first
+_known = OrderedDict()
+_lock = threading.Lock()
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _is_known(digest, now):
+    seen_at = _known.get(digest)
+    if seen_at is None or now - seen_at > settings.WEBHOOK_RESPONSE_BODY_CACHE_TTL:
+        return False
+    _known.move_to_end(digest)
+    return True
+
+
+def _remember(digests, now):
+    for digest in digests:
+        _known[digest] = now
+        _known.move_to_end(digest)
+    while len(_known) > settings.WEBHOOK_RESPONSE_BODY_CACHE_SIZE:
+        _known.popitem(last=False)
+
+
+def store(rows):
+    """
+    Move the 'response_body' text of DeliveryAttempt field dicts into
+    ResponseBody rows (one bulk INSERT for the bodies not seen recently)
+    and replace it with a 'response_content_id' reference. Returns ``rows``.
+    """
+    bodies = {}
+    for fields in rows:
+        text = fields.pop('response_body', None)
+        if text is None:
+            continue
+        digest = content_hash(text)
+        bodies[digest] = text
+        fields['response_content_id'] = digest
+
+    now = time.monotonic()
+    with _lock:
+        missing = [digest for digest in bodies if not _is_known(digest, now)]
+    if missing:
+        ResponseBody.objects.bulk_create(
+            [ResponseBody(sha256=digest, body=bodies[digest]) for digest in missing],
+            update_conflicts=True, unique_fields=['sha256'], update_fields=['created_at'],
+        )
+        with _lock:
+            _remember(missing, now)
+    return rows
+
+
+def forget():
+    """Drop the cache of known hashes (e.g. after the bodies were deleted)."""
+    with _lock:
+        _known.clear()
+
+
+def purge_orphans(chunk_size=None, deadline=None):
+    """Delete bodies that no attempt references any more. Returns how many were deleted."""
+    chunk_size = chunk_size or settings.WEBHOOK_RETENTION_CHUNK_SIZE
+    # Bodies written recently may still be waiting for their (buffered)
+    # attempts, and are trusted by the caches of the processes that wrote them
+    cutoff = timezone.now() - timedelta(seconds=settings.WEBHOOK_RESPONSE_BODY_CACHE_TTL)
+    orphans = ResponseBody.objects.filter(created_at__lt=cutoff, attempts__isnull=True)
+    deleted = 0
+    while deadline is None or time.monotonic() < deadline:
+        digests = list(orphans.values_list('sha256', flat=True)[:chunk_size])
+        if not digests:
+            break
+        ResponseBody.objects.filter(sha256__in=digests, attempts__isnull=True).delete()
+        with _lock:
+            for digest in digests:
+                _known.pop(digest, None)
+        deleted += len(digests)
+    return deleted
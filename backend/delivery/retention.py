@@ -0,0 +1,190 @@
+"""
+Retention: archive old events (with their delivery attempts) to compressed
+NDJSON files, then delete them from the database.
+
+How long events are kept depends on their status (WEBHOOK_RETENTION_DAYS),
+e.g. SUCCESS for 7 days and FAILED for 30. Events still PENDING/PROCESSING
+are never touched.
+
+Work is done in chunks of WEBHOOK_RETENTION_CHUNK_SIZE events:
+    1. read the chunk (events + attempts) and append it to the archive file
+    2. flush the archive to disk
+    3. delete the chunk in its own short transaction
+so no long-running transaction or lock is ever held, and memory stays flat.
+
+Archives use the same NDJSON format as the event export (delivery/exports.py):
+one event per line with its attempts nested.
+
+Fan-out messages are deleted along with their last delivery, and response
+bodies (delivery/response_bodies.py) once no attempt references them. Archived lines
+carry the message payload, so restored deliveries come back as standalone
+events.
+
+Restore with: python manage.py restore_archive <file>
+"""
+import gzip
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import response_bodies
+from .exports import EVENT_FIELDS, attach_attempts, attach_message_payloads, to_ndjson
+from .models import DeliveryAttempt, Destination, Event, Message
+
+logger = logging.getLogger(__name__)
+
+
+def archive_expired_events(status, older_than_days, archive_dir=None, chunk_size=None, deadline=None):
+    """
+    Archive and delete ``status`` events older than ``older_than_days``.
+
+    Stops early (between chunks) once time.monotonic() passes ``deadline``;
+    the next run picks up where this one left off.
+    Returns (path of the archive file or None, number of events archived).
+    """
+    archive_dir = Path(archive_dir or settings.WEBHOOK_ARCHIVE_DIR)
+    chunk_size = chunk_size or settings.WEBHOOK_RETENTION_CHUNK_SIZE
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+
+    expired = Event.objects.filter(status=status, created_at__lt=cutoff).order_by('created_at', 'id')
+
+    path = None
+    archive = None
+    archived = 0
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            event_ids = list(expired.values_list('id', flat=True)[:chunk_size])
+            if not event_ids:
+                break
+
+            if archive is None:
+                archive_dir.mkdir(parents=True, exist_ok=True)
+                path = archive_dir / f"events-{status.lower()}-{timezone.now():%Y%m%dT%H%M%S}.ndjson.gz"
+                archive = gzip.open(path, 'wt', encoding='utf-8')
+
+            message_ids = _write_chunk(archive, event_ids)
+            archive.flush()
+            os.fsync(archive.fileno())
+
+            # Rows are only deleted once they're safely in the archive
+            with transaction.atomic():
+                Event.objects.filter(id__in=event_ids).delete()
+                # Messages whose every delivery is now gone
+                Message.objects.filter(id__in=message_ids, deliveries__isnull=True).delete()
+
+            archived += len(event_ids)
+    finally:
+        if archive is not None:
+            archive.close()
+
+    if archived:
+        logger.info(f"Archived {archived} {status} events older than {older_than_days} days to {path}")
+    return path, archived
+
+
+def _write_chunk(archive, event_ids):
+    """Append the events to the archive; returns the ids of the messages they were fanned out from."""
+    events = list(Event.objects.filter(id__in=event_ids).order_by('created_at', 'id').values(*EVENT_FIELDS))
+    archive.write(to_ndjson(attach_attempts(attach_message_payloads(events))))
+    return {event['message_id'] for event in events if event['message_id'] is not None}
+
+
+def run_retention():
+    """Apply WEBHOOK_RETENTION_DAYS to every configured status, within WEBHOOK_RETENTION_MAX_SECONDS."""
+    # Stay well inside the Celery task time limit so we never get killed mid-chunk
+    deadline = time.monotonic() + settings.WEBHOOK_RETENTION_MAX_SECONDS
+    results = {}
+    for status, days in settings.WEBHOOK_RETENTION_DAYS.items():
+        path, archived = archive_expired_events(status, days, deadline=deadline)
+        results[status] = {"archived": archived, "archive": str(path) if path else None}
+    results['response_bodies_purged'] = response_bodies.purge_orphans(deadline=deadline)
+    return results
+
+
+@contextmanager
+def _keep_timestamps():
+    # created_at / timestamp are auto_now_add, which would overwrite restored values
+    fields = [Event._meta.get_field('created_at'), DeliveryAttempt._meta.get_field('timestamp')]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def restore_archive(path, batch_size=None):
+    """
+    Load an archive file back into the database.
+
+    Events that already exist are left alone (and their attempts skipped),
+    so restoring the same file twice is harmless. Events whose destination
+    has been deleted since are skipped. Fanned out events are restored as
+    standalone events carrying their payload. Returns (events, attempts) restored.
+    """
+    batch_size = batch_size or settings.WEBHOOK_RETENTION_CHUNK_SIZE
+    restored_events = 0
+    restored_attempts = 0
+
+    with gzip.open(path, 'rt', encoding='utf-8') as archive, _keep_timestamps():
+        batch = []
+        for line in archive:
+            if line.strip():
+                batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                events, attempts = _restore_batch(batch)
+                restored_events += events
+                restored_attempts += attempts
+                batch = []
+        if batch:
+            events, attempts = _restore_batch(batch)
+            restored_events += events
+            restored_attempts += attempts
+
+    return restored_events, restored_attempts
+
+
+def _restore_batch(rows):
+    existing = {
+        str(pk) for pk in
+        Event.objects.filter(id__in=[row['id'] for row in rows]).values_list('id', flat=True)
+    }
+    destinations = {
+        str(pk) for pk in
+        Destination.objects.filter(id__in={row['destination_id'] for row in rows}).values_list('id', flat=True)
+    }
+
+    events = []
+    attempts = []
+    for row in rows:
+        row_attempts = row.pop('attempts', [])
+        # The message may be gone, but its payload is on the line itself
+        row.pop('message_id', None)
+        if row['id'] in existing:
+            continue
+        if row['destination_id'] not in destinations:
+            logger.warning(f"Skipping event {row['id']}: destination {row['destination_id']} no longer exists")
+            continue
+
+        row['created_at'] = parse_datetime(row['created_at'])
+        events.append(Event(**row))
+        for attempt in row_attempts:
+            attempt['timestamp'] = parse_datetime(attempt['timestamp'])
+            attempts.append(attempt)
+
+    response_bodies.store(attempts)
+    with transaction.atomic():
+        Event.objects.bulk_create(events)
+        DeliveryAttempt.objects.bulk_create([DeliveryAttempt(**attempt) for attempt in attempts])
+
+    return len(events), len(attempts)
@@ -0,0 +1,45 @@
+"""
+Which Celery queue a destination's deliveries go to.
+
+With every delivery on one queue, a backlog for a single slow or busy
+destination delays everyone else. Deliveries are spread over several
+queues instead (WEBHOOK_DELIVERY_QUEUES):
+
+    Destination.delivery_queue set  -> that queue (one of WEBHOOK_ISOLATED_QUEUES)
+    tier 'priority'                 -> deliveries.priority
+    tier 'bulk'                     -> deliveries.bulk
+    tier 'standard' (default)       -> deliveries.shard<N>, N = hash of the destination id
+
+Workers started without -Q consume every queue and take turns between them,
+so a flooded queue only gets its share of the workers. To give a queue more
+weight, run extra workers that consume only that queue (see the
+celery_worker_priority service in docker-compose.yml).
+
+Moving a noisy destination out of the way needs no redeploy:
+
+    PATCH /api/destinations/<id>/ {"delivery_queue": "deliveries.isolated"}
+
+New and deferred deliveries for it go to the isolated queue from then on;
+retries already scheduled stay on the queue they were published to.
+"""
+import zlib
+
+from django.conf import settings
+
+TIER_QUEUES = {
+    'priority': 'deliveries.priority',
+    'bulk': 'deliveries.bulk',
+}
+
+
+def shard_for(destination_id):
+    """Stable shard number for a destination (the same in every process)."""
+    return zlib.crc32(str(destination_id).encode()) % settings.WEBHOOK_DELIVERY_SHARDS
+
+
+def queue_for(destination):
+    if destination.delivery_queue:
+        return destination.delivery_queue
+    if destination.tier in TIER_QUEUES:
+        return TIER_QUEUES[destination.tier]
+    return f"deliveries.shard{shard_for(destination.id)}"
@@ -0,0 +1,122 @@
+"""
+Delayed deliveries (retries, deferrals) kept in Redis until they're due,
+instead of as Celery countdown/ETA tasks.
+
+With the Redis broker, a countdown task is handed to a worker right away
+and sits in that worker's memory until it's due. During a long outage that
+means huge numbers of pending retries held in worker RAM, and redelivered
+again after every visibility timeout. Here a delayed delivery is only a
+member of a sorted set scored by its due time:
+
+    webhook:scheduled           due time -> {"task", "args", "retries", "queue"}
+    webhook:scheduled:inflight  taken by a dispatcher, not yet published
+
+The dispatch_due_retries task (celery beat, every WEBHOOK_RETRY_DISPATCH_INTERVAL
+seconds) moves everything that's due onto its Celery queue in batches of
+WEBHOOK_RETRY_DISPATCH_BATCH, all published through one producer. Entries
+are only removed from the in-flight set after they're published; entries a
+crashed dispatcher left behind go back to the schedule after
+WEBHOOK_RETRY_VISIBILITY_TIMEOUT seconds (at-least-once, which the tasks'
+conditional status updates already tolerate).
+
+Every delay gets +/- WEBHOOK_RETRY_JITTER of random jitter, so deliveries
+that failed together don't all come back at the same instant. If Redis is
+unavailable, schedule() falls back to a Celery countdown.
+"""
+import json
+import logging
+import random
+import time
+
+import redis
+from celery import current_app
+from django.conf import settings
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_KEY = 'webhook:scheduled'
+INFLIGHT_KEY = 'webhook:scheduled:inflight'
+
+# KEYS[1] = schedule, KEYS[2] = in-flight
+# ARGV    = now, limit, visibility_deadline
+# Returns the members handed to this dispatcher
+_CLAIM_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, member in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], member)
+    redis.call('ZADD', KEYS[1], ARGV[1], member)
+end
+
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, member in ipairs(due) do
+    redis.call('ZREM', KEYS[1], member)
+    redis.call('ZADD', KEYS[2], ARGV[3], member)
+end
+return due
+"""
+
+
+def jittered(delay):
+    jitter = settings.WEBHOOK_RETRY_JITTER
+    return max(0, delay * random.uniform(1 - jitter, 1 + jitter))
+
+
+def schedule(task, args, delay, retries, queue, now=None, jitter=True):
+    """
+    Run ``task(*args)`` on ``queue`` in about ``delay`` seconds, as its retry
+    number ``retries``. Returns the actual (jittered) delay.
+
+    ``now`` (epoch seconds) is the moment the delay counts from: pass the one
+    a due time stored elsewhere (e.g. Event.next_attempt_at) is computed from,
+    so both agree. ``jitter=False`` keeps the delay exact.
+    """
+    if jitter:
+        delay = jittered(delay)
+    if now is None:
+        now = time.time()
+    member = json.dumps(
+        {"task": task.name, "args": list(args), "retries": retries, "queue": queue},
+        sort_keys=True,
+    )
+    try:
+        get_redis().zadd(SCHEDULE_KEY, {member: now + delay})
+    except redis.RedisError as exc:
+        logger.warning(f"Retry scheduler unavailable, falling back to a Celery countdown: {exc}")
+        task.apply_async(tuple(args), countdown=delay, retries=retries, queue=queue)
+    return delay
+
+
+def dispatch_due(batch_size=None, max_batches=100):
+    """Publish every delivery that's due. Returns how many were published."""
+    batch_size = batch_size or settings.WEBHOOK_RETRY_DISPATCH_BATCH
+    client = get_redis()
+    published = 0
+
+    for _ in range(max_batches):
+        now = time.time()
+        members = client.eval(
+            _CLAIM_SCRIPT, 2, SCHEDULE_KEY, INFLIGHT_KEY,
+            now, batch_size, now + settings.WEBHOOK_RETRY_VISIBILITY_TIMEOUT,
+        )
+        if not members:
+            break
+
+        with current_app.producer_or_acquire() as producer:
+            for member in members:
+                spec = json.loads(member)
+                current_app.tasks[spec['task']].apply_async(
+                    tuple(spec['args']),
+                    retries=spec['retries'],
+                    queue=spec['queue'],
+                    producer=producer,
+                )
+
+        client.zrem(INFLIGHT_KEY, *members)
+        published += len(members)
+
+        if len(members) < batch_size:
+            break
+
+    return published
@@ -1,5 +1,7 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Destination, Event
+from . import circuit_breaker, latency
+from .models import Destination, Event, EventType, Message, Subscription
 import re
 
 
@@ -31,17 +33,140 @@ class FlexibleURLField(serializers.CharField):
 
 class DestinationSerializer(serializers.ModelSerializer):
     url = FlexibleURLField()
+    circuit = serializers.SerializerMethodField()
+    latency = serializers.SerializerMethodField()
     
     class Meta:
         model = Destination
-        fields = ['id', 'url', 'secret_key', 'is_active', 'created_at']
-        read_only_fields = ['id', 'secret_key', 'created_at']
+        fields = [
+            'id', 'url', 'secret_key', 'secret_version', 'secret_rotated_at', 'is_active',
+            'max_requests_per_second', 'max_concurrent_deliveries',
+            'batch_max_size', 'batch_linger_ms', 'batch_max_bytes', 'gzip_requests', 'ordered', 'tier', 'delivery_queue',
+            'connect_timeout', 'read_timeout', 'retry_policy', 'retry_base_delay', 'retry_max_delay', 'max_retries',
+            'circuit', 'latency', 'created_at',
+        ]
+        read_only_fields = ['id', 'secret_key', 'secret_version', 'secret_rotated_at', 'created_at']
+
+    def validate_delivery_queue(self, value):
+        # Only queues that workers actually consume
+        if value and value not in settings.WEBHOOK_ISOLATED_QUEUES:
+            raise serializers.ValidationError(
+                f"Must be one of: {', '.join(settings.WEBHOOK_ISOLATED_QUEUES)}"
+            )
+        return value
+
+    def validate(self, attrs):
+        batch_max_size = attrs.get('batch_max_size', getattr(self.instance, 'batch_max_size', None))
+        ordered = attrs.get('ordered', getattr(self.instance, 'ordered', False))
+        if ordered and (batch_max_size or 0) > 1:
+            raise serializers.ValidationError("Ordered delivery can't be combined with batched delivery")
+
+        connect_timeout = attrs.get('connect_timeout', getattr(self.instance, 'connect_timeout', None))
+        read_timeout = attrs.get('read_timeout', getattr(self.instance, 'read_timeout', None))
+        if 'connect_timeout' in attrs or 'read_timeout' in attrs:
+            # Without an override a timeout can still reach its MAX (see delivery/latency.py)
+            total = (
+                (connect_timeout or settings.WEBHOOK_CONNECT_TIMEOUT_MAX)
+                + (read_timeout or settings.WEBHOOK_READ_TIMEOUT_MAX)
+            )
+            limit = latency.max_override()
+            if total > limit:
+                field = 'read_timeout' if 'read_timeout' in attrs else 'connect_timeout'
+                raise serializers.ValidationError({
+                    field: f"Connect and read timeouts together can be at most {limit:g} seconds "
+                           f"(the delivery leases expire after that), got {total:g}"
+                })
+        return attrs
+
+    def get_circuit(self, obj):
+        # Live circuit breaker state, shared by all workers through Redis
+        # (a list reads every destination's at once, into context['live_state'])
+        live_state = self.context.get('live_state')
+        if live_state is not None:
+            return live_state[obj.id]['circuit']
+        return circuit_breaker.get_state(obj.id)
+
+    def get_latency(self, obj):
+        # Observed latency and the timeouts the next delivery will use
+        live_state = self.context.get('live_state')
+        estimate = live_state[obj.id]['latency'] if live_state is not None else latency.get_estimate(obj.id)
+        connect_timeout, read_timeout = latency.timeouts_from(obj, estimate)
+        return {**(estimate or {}), "connect_timeout": connect_timeout, "read_timeout": read_timeout}
 
 
 class EventSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Event
-        fields = ['id', 'destination', 'payload', 'created_at']
+        fields = ['id', 'destination', 'message', 'payload', 'status', 'attempts_count', 'created_at']
+        read_only_fields = ['id', 'message', 'status', 'attempts_count', 'created_at']
+        # Nullable on the model (fanned out events keep it on the message), required here
+        extra_kwargs = {'payload': {'required': True, 'allow_null': False}}
+
+    def __init__(self, *args, **kwargs):
+        # Optional projection, e.g. EventSerializer(events, many=True, fields=['id', 'status'])
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if 'payload' in data and data['payload'] is None:
+            # On the message, or stored compressed in the body
+            data['payload'] = instance.get_payload()
+        return data
+
+
+class EventTypeSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = EventType
+        fields = ['id', 'name', 'description', 'created_at']
+        read_only_fields = ['id', 'created_at']
+
+
+class SubscriptionSerializer(serializers.ModelSerializer):
+    event_type = serializers.SlugRelatedField(slug_field='name', queryset=EventType.objects.all())
+
+    class Meta:
+        model = Subscription
+        fields = ['id', 'event_type', 'destination', 'is_active', 'created_at']
+        read_only_fields = ['id', 'created_at']
+
+
+class MessageSerializer(serializers.ModelSerializer):
+    event_type = serializers.SlugRelatedField(slug_field='name', queryset=EventType.objects.all())
+
+    class Meta:
+        model = Message
+        fields = ['id', 'event_type', 'payload', 'created_at']
         read_only_fields = ['id', 'created_at']
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if data['payload'] is None:
+            data['payload'] = instance.get_payload()
+        return data
+
+
+class BulkEventItemSerializer(serializers.Serializer):
+    """
+    Validates a single item of a bulk ingestion request.
+
+    Destinations are looked up in ``context['destinations']`` (fetched once
+    for the whole batch) instead of running one query per item.
+    """
+
+    destination = serializers.UUIDField()
+    payload = serializers.JSONField()
+    # Same role as the Idempotency-Key header of POST /api/events/
+    idempotency_key = serializers.CharField(max_length=255, required=False, allow_null=True)
+
+    def validate_destination(self, value):
+        destination = self.context['destinations'].get(value)
+        if destination is None:
+            raise serializers.ValidationError(f'Invalid pk "{value}" - object does not exist.')
+        return destination
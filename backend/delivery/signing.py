@@ -0,0 +1,74 @@
+"""
+HMAC-SHA256 signing of outgoing deliveries.
+
+hmac.new(key, ...) derives the inner/outer key pads from scratch every time,
+which is a real share of the cost for small payloads. We key an HMAC object
+once per destination secret, cache it per worker process, and .copy() it
+for each message.
+
+Secret rotation: right after Destination.rotate_secret() both the new and the
+previous secret are active for WEBHOOK_SECRET_ROTATION_GRACE_SECONDS, and the
+X-Webhook-Signature header carries both signatures, comma separated
+(new one first). Receivers can switch secrets at their own pace.
+"""
+import hashlib
+import hmac
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+# Max destinations we keep pre-keyed HMACs for, per worker process
+MAX_CACHED_SIGNERS = 1024
+
+# (destination_id, secret_version) -> (secrets, pre-keyed hmac objects), LRU order
+_signers = OrderedDict()
+_lock = threading.Lock()
+
+
+def _active_secrets(destination):
+    secrets = [str(destination.secret_key)]
+
+    if destination.previous_secret_key and destination.secret_rotated_at:
+        grace_ends = destination.secret_rotated_at + timedelta(seconds=settings.WEBHOOK_SECRET_ROTATION_GRACE_SECONDS)
+        if timezone.now() < grace_ends:
+            secrets.append(destination.previous_secret_key)
+
+    return tuple(secrets)
+
+
+def _get_keyed_hmacs(destination):
+    cache_key = (destination.id, destination.secret_version)
+    secrets = _active_secrets(destination)
+
+    with _lock:
+        entry = _signers.get(cache_key)
+        # Also rebuild if the secret was edited directly or the grace window ended
+        if entry is not None and entry[0] == secrets:
+            _signers.move_to_end(cache_key)
+            return entry[1]
+
+    keyed = tuple(
+        hmac.new(secret.encode('utf-8'), digestmod=hashlib.sha256)
+        for secret in secrets
+    )
+
+    with _lock:
+        _signers[cache_key] = (secrets, keyed)
+        _signers.move_to_end(cache_key)
+        while len(_signers) > MAX_CACHED_SIGNERS:
+            _signers.popitem(last=False)
+
+    return keyed
+
+
+def sign(destination, body):
+    """Return the X-Webhook-Signature header value for ``body``."""
+    signatures = []
+    for keyed in _get_keyed_hmacs(destination):
+        mac = keyed.copy()
+        mac.update(body)
+        signatures.append(mac.hexdigest())
+    return ','.join(signatures)
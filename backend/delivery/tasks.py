@@ -1,101 +1,306 @@
 import hashlib
 import hmac
 import requests
+import redis
 import logging
+import time
+from datetime import timedelta
 from celery import shared_task
+from django.conf import settings
+from django.db.models import F
 from django.utils import timezone
-from .models import Event, Destination, DeliveryAttempt
+from . import (
+    attempt_recorder, batching, circuit_breaker, http_client, latency, metrics, ordering, partitioning, payloads,
+    rate_limits, retention, routing, scheduler, signing,
+)
+from .models import Event, Destination
+from .payloads import encode_payload
 
 logger = logging.getLogger(__name__)
 
+# Statuses an event can still be delivered from
+ACTIVE_STATUSES = ('PENDING', 'PROCESSING')
+
+# How long a claimed batch may stay in flight before another flush may take it over
+BATCH_LEASE_SECONDS = settings.WEBHOOK_READ_TIMEOUT_MAX * 2
+
+
+def set_event_status(event_id, status, from_statuses=ACTIVE_STATUSES, **fields):
+    """
+    Move an event to ``status`` with a single conditional UPDATE.
+
+    Only the given columns are written (never the payload), and only if the
+    event is still in one of ``from_statuses``, so a duplicate or late task
+    can't overwrite a final state. Returns True if the row was updated.
+    """
+    updated = Event.objects.filter(id=event_id, status__in=from_statuses).update(status=status, **fields)
+    return updated > 0
+
+
+def set_events_status(event_ids, status, from_statuses=ACTIVE_STATUSES, **fields):
+    """set_event_status() for many events in one UPDATE. Returns the number updated."""
+    return Event.objects.filter(id__in=event_ids, status__in=from_statuses).update(status=status, **fields)
+
+
+def get_stored_body(event):
+    """
+    An event's body as stored (possibly compressed, see delivery/payloads.py).
+
+    Encoded once at ingestion; events stored before that get encoded
+    on their first attempt and saved, so retries never re-encode.
+    Fanned out events share the bytes stored once on their message.
+    """
+    if event.message_id is not None:
+        return bytes(event.message.body)
+    if event.body is None:
+        event.body = payloads.compress_body(encode_payload(event.payload))
+        Event.objects.filter(id=event.id, body__isnull=True).update(body=event.body)
+    return bytes(event.body)
+
+
+def get_event_body(event):
+    """The canonical encoded payload bytes of an event."""
+    return payloads.decompress_body(get_stored_body(event))
+
+
+def get_delivery_body(event, destination):
+    """The exact bytes to sign and send for an event (gzipped if the destination asked for it)."""
+    return payloads.transport_body(get_stored_body(event), destination.gzip_requests)
+
+
+def build_delivery_headers(event, destination, body):
+    """Build the signed headers sent along with an event delivery."""
+    headers = {
+        'Content-Type': 'application/json',
+        'X-Webhook-Signature': signing.sign(destination, body),
+        'X-Event-ID': str(event.id),
+        'User-Agent': 'WebhookDeliverySystem/1.0'
+    }
+    if destination.gzip_requests:
+        headers['Content-Encoding'] = 'gzip'
+    return headers
+
+
+def build_batch_headers(events, destination, body):
+    """Signed headers for a batched delivery; the event ids are in the body."""
+    headers = {
+        'Content-Type': 'application/json',
+        'X-Webhook-Signature': signing.sign(destination, body),
+        'X-Webhook-Batch-Size': str(len(events)),
+        'User-Agent': 'WebhookDeliverySystem/1.0'
+    }
+    if destination.gzip_requests:
+        headers['Content-Encoding'] = 'gzip'
+    return headers
+
+
+def send_delivery(destination, body, headers):
+    """
+    POST a delivery. Returns (response_status_code, response_body, timings);
+    network errors are reported as status code 0. ``timings`` holds the
+    DeliveryAttempt duration_ms and ttfb_ms (None if no response came back).
+
+    Timeouts adapt to the destination's observed latency (delivery/latency.py).
+    Only the first WEBHOOK_RESPONSE_CAPTURE_BYTES of the response are read.
+    """
+    connect_timeout, read_timeout = latency.timeouts_for(destination)
+    started = time.monotonic()
+
+    def elapsed_ms():
+        return round((time.monotonic() - started) * 1000)
+
+    try:
+        response = http_client.post(
+            url=destination.url,
+            data=body,
+            headers=headers,
+            timeout=(connect_timeout, read_timeout),
+            stream=True,
+        )
+        captured = http_client.read_capped(response)
+        # requests' elapsed stops once the response headers are parsed
+        timings = {'duration_ms': elapsed_ms(), 'ttfb_ms': round(response.elapsed.total_seconds() * 1000)}
+        latency.observe(destination.id, timings['duration_ms'] / 1000)
+        
+        logger.info(f"Webhook delivered to {destination.url}, status: {response.status_code}")
+        return response.status_code, captured.decode(response.encoding or 'utf-8', errors='replace'), timings
+        
+    except requests.exceptions.Timeout as exc:
+        if isinstance(exc, requests.exceptions.ReadTimeout):
+            # Counts as a (slow) sample, so the estimate backs off
+            latency.observe(destination.id, read_timeout)
+        logger.error(f"Timeout delivering to {destination.url}")
+        return (
+            0,
+            f"Request timeout (connect {connect_timeout:.1f}s, read {read_timeout:.1f}s)",
+            {'duration_ms': elapsed_ms(), 'ttfb_ms': None},
+        )
+        
+    except requests.exceptions.ConnectionError:
+        logger.error(f"Connection error to {destination.url}")
+        return 0, "Connection error - destination unreachable", {'duration_ms': elapsed_ms(), 'ttfb_ms': None}
+        
+    except Exception as e:
+        logger.error(f"Unexpected error delivering webhook: {str(e)}")
+        return 0, f"Unexpected error: {str(e)}", {'duration_ms': elapsed_ms(), 'ttfb_ms': None}
+
+
+def get_retry_delay(retries, destination=None):
+    """
+    Seconds to wait before retry number ``retries + 1``, following the
+    destination's backoff policy. Default: exponential, 60s, 120s, 240s, ...
+    """
+    if destination is None:
+        return 60 * (2 ** retries)
+
+    base = destination.retry_base_delay
+    if destination.retry_policy == 'fixed':
+        delay = base
+    elif destination.retry_policy == 'linear':
+        delay = base * (retries + 1)
+    else:
+        delay = base * (2 ** retries)
+
+    if destination.retry_max_delay:
+        delay = min(delay, destination.retry_max_delay)
+    return delay
+
+
+def get_max_retries(task, destination=None):
+    if destination is not None and destination.max_retries is not None:
+        return destination.max_retries
+    return task.max_retries
+
+
+def get_retry_queue(task, destination=None):
+    """The queue a retry goes to: the destination's current one, else the one this run came from."""
+    if destination is not None:
+        return routing.queue_for(destination)
+    return (task.request.delivery_info or {}).get('routing_key')
+
+
+def defer_delivery(task, event_id, destination, countdown):
+    """
+    Schedule a delivery to run later WITHOUT using up one of its retries.
+
+    Used when we choose not to attempt a delivery right now (open circuit,
+    destination over its rate limit),
+    as opposed to a retry, which counts against max_retries.
+    For an ordered destination the whole destination waits: the event keeps
+    blocking the ones behind it until its next_attempt_at.
+    """
+    if destination.ordered:
+        # The wake-up and next_attempt_at count from the same moment
+        now = timezone.now()
+        countdown = scheduler.schedule(
+            deliver_ordered, (str(destination.id),), countdown, 0, routing.queue_for(destination), now=now.timestamp()
+        )
+        Event.objects.filter(id=event_id).update(next_attempt_at=now + timedelta(seconds=countdown))
+        return
+    scheduler.schedule(task, (event_id,), countdown, task.request.retries, routing.queue_for(destination))
+
+
 @shared_task(
     bind=True,              
     max_retries=3,          
     default_retry_delay=60  
 )
-def process_webhook_event(self, event_id):
+def process_webhook_event(self, event_id, in_order=False):
 
+    destination = None
     try:
         # Fetch event and destination from database
+        # (payloads are skipped, we only need the pre-encoded body)
         try:
-            event = Event.objects.select_related('destination').get(id=event_id)
+            event = (
+                Event.objects.select_related('destination', 'message')
+                .defer('payload', 'message__payload')
+                .get(id=event_id)
+            )
         except Event.DoesNotExist:
             logger.error(f"Event {event_id} not found in database")
             return {"status": "error", "message": "Event not found"}
         
+        # Duplicate or late task for an event that's already done
+        if event.status not in ACTIVE_STATUSES:
+            logger.warning(f"Event {event_id} is already {event.status}, skipping delivery")
+            return {"status": "skipped", "message": f"Event is already {event.status}"}
+        
         destination = event.destination
         
         if not destination.is_active:
             logger.warning(f"Destination {destination.id} is inactive, skipping delivery")
-            event.status = 'FAILED'
-            event.save()
+            set_event_status(event_id, 'FAILED')
             return {"status": "skipped", "message": "Destination is inactive"}
         
-        event.status = 'PROCESSING'
-        event.attempts_count += 1
-        event.save()
+        # Ordered destinations are only delivered head first, by deliver_ordered
+        if destination.ordered and not in_order:
+            deliver_ordered.apply_async((str(destination.id),), queue=routing.queue_for(destination))
+            return {"status": "queued_in_order", "event_id": str(event_id)}
         
-        logger.info(f"Processing event {event_id} for destination {destination.url}")
+        # Destination is known to be down: park the event without an HTTP call
+        allowed, retry_after = circuit_breaker.allow_request(destination.id)
+        if not allowed:
+            logger.info(f"Circuit open for destination {destination.id}, parking event {event_id} for {retry_after}s")
+            defer_delivery(self, event_id, destination, retry_after)
+            return {
+                "status": "deferred",
+                "event_id": str(event_id),
+                "reason": "circuit_open",
+                "retry_after": retry_after
+            }
         
-        import json
-        payload_string = json.dumps(event.payload, sort_keys=True)
+        # Over the destination's rate limit / concurrency cap: try again shortly
+        allowed, retry_after, lease = rate_limits.acquire(destination)
+        if not allowed:
+            circuit_breaker.release_probe(destination.id)
+            logger.info(f"Destination {destination.id} is over its limits, deferring event {event_id} by {retry_after:.2f}s")
+            defer_delivery(self, event_id, destination, retry_after)
+            return {
+                "status": "deferred",
+                "event_id": str(event_id),
+                "reason": "rate_limited",
+                "retry_after": retry_after
+            }
         
-        signature = hmac.new(
-            key=str(destination.secret_key).encode('utf-8'),
-            msg=payload_string.encode('utf-8'),
-            digestmod=hashlib.sha256
-        ).hexdigest()
+        # The concurrency slot is given back however this ends
+        try:
+            if event.attempts_count == 0:
+                metrics.observe('webhook_enqueue_latency_seconds', [(timezone.now() - event.created_at).total_seconds()])
+
+            if not set_event_status(event_id, 'PROCESSING', attempts_count=F('attempts_count') + 1, next_attempt_at=None):
+                # Another task finished it since we fetched it
+                circuit_breaker.release_probe(destination.id)
+                logger.warning(f"Event {event_id} finished concurrently, skipping delivery")
+                return {"status": "skipped", "message": "Event is no longer pending"}
         
-        headers = {
-            'Content-Type': 'application/json',
-            'X-Webhook-Signature': signature,  
-            'X-Event-ID': str(event.id),        
-            'User-Agent': 'WebhookDeliverySystem/1.0'
-        }
+            logger.info(f"Processing event {event_id} for destination {destination.url}")
         
-        try:
-            response = requests.post(
-                url=destination.url,
-                json=event.payload,
-                headers=headers,
-                timeout=30
-            )
-            
-            response_status_code = response.status_code
-            response_body = response.text[:1000]  
-            
-            logger.info(f"Webhook delivered to {destination.url}, status: {response_status_code}")
-            
-        except requests.exceptions.Timeout:
-            logger.error(f"Timeout delivering to {destination.url}")
-            response_status_code = 0
-            response_body = "Request timeout after 30 seconds"
-            
-        except requests.exceptions.ConnectionError:
-            logger.error(f"Connection error to {destination.url}")
-            response_status_code = 0
-            response_body = "Connection error - destination unreachable"
-            
-        except Exception as e:
-            logger.error(f"Unexpected error delivering webhook: {str(e)}")
-            response_status_code = 0
-            response_body = f"Unexpected error: {str(e)}"
+            body = get_delivery_body(event, destination)
+            headers = build_delivery_headers(event, destination, body)
+        
+            response_status_code, response_body, timings = send_delivery(destination, body, headers)
+        finally:
+            rate_limits.release(destination, lease)
+        
+        circuit_breaker.record_result(destination.id, response_status_code)
                 
         is_successful = 200 <= response_status_code < 300
         is_client_error = 400 <= response_status_code < 500
         
 
-        DeliveryAttempt.objects.create(
-            event=event,
+        attempt_recorder.recorder.record(
+            event_id=event.id,
             status='SUCCESS' if is_successful else 'FAILED',
             response_status_code=response_status_code,
             response_body=response_body,
-            timestamp=timezone.now()
+            timestamp=timezone.now(),
+            **timings
         )
+        metrics.record_attempt(str(destination.id), is_successful, timings['duration_ms'] / 1000)
         
         if is_successful:
-            event.status = 'SUCCESS'
-            event.save()
+            set_event_status(event_id, 'SUCCESS', from_statuses=('PROCESSING',))
             logger.info(f" Event {event_id} delivered successfully!")
             return {
                 "status": "success",
@@ -104,8 +309,8 @@ def process_webhook_event(self, event_id):
             }
         
         elif is_client_error:
-            event.status = 'FAILED'
-            event.save()
+            set_event_status(event_id, 'FAILED', from_statuses=('PROCESSING',))
+            metrics.inc('webhook_events_failed_total', reason='client_error')
             logger.error(f" Client error {response_status_code}, not retrying")
             return {
                 "status": "failed",
@@ -123,27 +328,43 @@ def process_webhook_event(self, event_id):
     
     except Exception as exc:
         
-        if self.request.retries < self.max_retries:
+        max_retries = get_max_retries(self, destination)
+        if self.request.retries < max_retries:
+            # Default policy:
             # Retry 1: 60 seconds
             # Retry 2: 120 seconds (2^1 * 60)
             # Retry 3: 240 seconds (2^2 * 60)
-            retry_delay = 60 * (2 ** self.request.retries)
+            # Scheduled in Redis (delivery/scheduler.py), not as a Celery countdown.
+            # An ordered destination resumes as a whole, this event first
+            if in_order and destination is not None:
+                retry_task, retry_args = deliver_ordered, (str(destination.id),)
+            else:
+                retry_task, retry_args = self, (event_id,)
+            now = timezone.now()
+            retry_delay = scheduler.schedule(
+                retry_task, retry_args, get_retry_delay(self.request.retries, destination), self.request.retries + 1,
+                get_retry_queue(self, destination), now=now.timestamp()
+            )
+            Event.objects.filter(id=event_id, status='PROCESSING').update(
+                next_attempt_at=now + timedelta(seconds=retry_delay)
+            )
             
             logger.warning(
-                f"Retry {self.request.retries + 1}/{self.max_retries} "
-                f"for event {event_id} in {retry_delay} seconds"
+                f"Retry {self.request.retries + 1}/{max_retries} "
+                f"for event {event_id} in {retry_delay:.0f} seconds ({exc})"
             )
             
-            raise self.retry(exc=exc, countdown=retry_delay)
+            metrics.inc('webhook_delivery_retries_total')
+            return {
+                "status": "retry_scheduled",
+                "event_id": str(event_id),
+                "retry_in": retry_delay
+            }
         else:
             logger.error(f" Max retries reached for event {event_id}, marking as FAILED")
             
-            try:
-                event = Event.objects.get(id=event_id)
-                event.status = 'FAILED'
-                event.save()
-            except Event.DoesNotExist:
-                pass
+            set_event_status(event_id, 'FAILED')
+            metrics.inc('webhook_events_failed_total', reason='max_retries')
             
             return {
                 "status": "failed",
@@ -152,13 +373,357 @@ def process_webhook_event(self, event_id):
             }
 
 
+@shared_task
+def deliver_ordered(destination_id):
+    """
+    Deliver an ordered destination's events one at a time, oldest first
+    (see delivery/ordering.py). Safe to publish any number of times: only
+    the run holding the destination's lease delivers anything.
+    """
+    try:
+        token = ordering.acquire(destination_id)
+    except redis.RedisError as exc:
+        # Without the lease the order can't be guaranteed: pause and try again
+        logger.error(f"Ordering lease unavailable for destination {destination_id}: {exc}")
+        destination = Destination.objects.filter(id=destination_id).first()
+        if destination is not None:
+            deliver_ordered.apply_async(
+                (destination_id,), countdown=settings.WEBHOOK_ORDERED_RETRY_DELAY, queue=routing.queue_for(destination)
+            )
+        return {"status": "deferred", "reason": "lease_unavailable"}
+    if token is None:
+        return {"status": "skipped", "message": "Another run is delivering this destination"}
+
+    delivered = 0
+    outcome = 'drained'
+    deadline = time.monotonic() + settings.WEBHOOK_ORDERED_MAX_SECONDS_PER_RUN
+    try:
+        destination = Destination.objects.filter(id=destination_id).first()
+        if destination is None:
+            logger.error(f"Destination {destination_id} not found in database")
+            return {"status": "error", "message": "Destination not found"}
+
+        if not destination.ordered:
+            # Switched off since: the events still waiting get tasks of their own
+            enqueue_deliveries(list(
+                Event.objects.filter(destination=destination, status__in=ACTIVE_STATUSES)
+                .select_related('destination').defer('payload', 'body')
+            ))
+            return {"status": "skipped", "message": "Destination is no longer ordered"}
+
+        while True:
+            head = (
+                Event.objects.filter(destination_id=destination_id, status__in=ACTIVE_STATUSES)
+                .order_by('created_at', 'id')
+                .only('id', 'next_attempt_at', 'attempts_count')
+                .first()
+            )
+            if head is None:
+                break
+            now = timezone.now()
+            if head.next_attempt_at and head.next_attempt_at > now:
+                # Waiting for a retry or deferred: everything behind it waits too.
+                # The wake-up scheduled with it can fire a little early (clocks
+                # differ between hosts), so make sure a run follows right when it's due
+                scheduler.schedule(
+                    deliver_ordered, (str(destination_id),), (head.next_attempt_at - now).total_seconds(), 0,
+                    routing.queue_for(destination), now=now.timestamp(), jitter=False
+                )
+                outcome = 'blocked'
+                break
+            if delivered >= settings.WEBHOOK_ORDERED_MAX_PER_RUN or (delivered and time.monotonic() >= deadline):
+                # Hand over to a fresh task so one busy destination doesn't keep a worker forever,
+                # and a slow one isn't cut off mid-request by the soft time limit
+                outcome = 'yielded'
+                break
+
+            result = process_webhook_event.apply(
+                (str(head.id),), {'in_order': True}, retries=head.attempts_count
+            ).result
+            delivered += 1
+            if isinstance(result, dict) and result.get('status') in ('deferred', 'retry_scheduled'):
+                outcome = 'blocked'
+                break
+            if not ordering.renew(destination_id, token):
+                logger.warning(f"Lost the ordering lease for destination {destination_id}")
+                outcome = 'lost_lease'
+                break
+    finally:
+        try:
+            ordering.release(destination_id, token)
+        except redis.RedisError as exc:
+            logger.warning(f"Could not release the ordering lease for destination {destination_id}: {exc}")
+
+    # Events that arrived while we held the lease found it taken: pick them up
+    if outcome in ('yielded', 'lost_lease') or (
+        outcome == 'drained' and Event.objects.filter(destination_id=destination_id, status__in=ACTIVE_STATUSES).exists()
+    ):
+        deliver_ordered.apply_async((destination_id,), queue=routing.queue_for(destination))
+
+    if delivered:
+        logger.info(f"Delivered {delivered} events in order to destination {destination_id} ({outcome})")
+    return {"status": outcome, "destination_id": str(destination_id), "delivered": delivered}
+
+
+@shared_task(ignore_result=True)
+def dispatch_due_retries():
+    """Frequent (celery beat): publish scheduled retries and deferrals that are due."""
+    published = scheduler.dispatch_due()
+    if published:
+        logger.info(f"Dispatched {published} scheduled deliveries")
+    return published
+
+
+@shared_task(ignore_result=True)
+def create_future_partitions():
+    """Nightly (celery beat): add upcoming monthly partitions, a no-op unless partitioning is on."""
+    partitioning.ensure_future_partitions()
+
+
+@shared_task(ignore_result=True)
+def purge_expired_events():
+    """Periodic (celery beat): archive and delete events past their retention period."""
+    results = retention.run_retention()
+    logger.info(f"Retention run finished: {results}")
+    return results
+
+
+@shared_task(
+    bind=True,
+    max_retries=3,
+    default_retry_delay=60
+)
+def deliver_batch(self, destination_id, event_ids=None):
+    """
+    Deliver the next batch of due events for a destination in one request
+    (see delivery/batching.py).
+
+    Scheduled with no event_ids to claim a new batch; retries carry the ids
+    of the batch they're retrying, so it's sent again as a whole.
+    """
+    destination = None
+    try:
+        try:
+            destination = Destination.objects.get(id=destination_id)
+        except Destination.DoesNotExist:
+            logger.error(f"Destination {destination_id} not found in database")
+            return {"status": "error", "message": "Destination not found"}
+
+        if event_ids is None:
+            batching.clear_flush(destination_id)
+            if not batching.is_batched(destination):
+                # Switched off since: the events still waiting get tasks of their own
+                enqueue_deliveries(list(
+                    Event.objects.filter(destination=destination, status__in=ACTIVE_STATUSES)
+                    .select_related('destination').defer('payload', 'body')
+                ))
+                return {"status": "skipped", "message": "Destination is no longer batched"}
+            events = Event.objects.filter(destination=destination)
+        else:
+            events = Event.objects.filter(id__in=event_ids)
+
+        if not destination.is_active:
+            logger.warning(f"Destination {destination_id} is inactive, skipping delivery")
+            events.filter(status__in=ACTIVE_STATUSES).update(status='FAILED', next_attempt_at=None)
+            return {"status": "skipped", "message": "Destination is inactive"}
+
+        allowed, retry_after = circuit_breaker.allow_request(destination.id)
+        reason = 'circuit_open'
+        lease = None
+        if allowed:
+            allowed, retry_after, lease = rate_limits.acquire(destination)
+            reason = 'rate_limited'
+        if not allowed:
+            if reason == 'rate_limited':
+                circuit_breaker.release_probe(destination.id)
+            logger.info(f"Deferring batch for destination {destination_id} by {retry_after:.2f}s ({reason})")
+            retry_after = scheduler.schedule(
+                self, (destination_id, event_ids), retry_after, self.request.retries, routing.queue_for(destination)
+            )
+            if event_ids is not None:
+                # Keep the claimed events from being taken over while we wait
+                events.filter(status='PROCESSING').update(
+                    next_attempt_at=timezone.now() + timedelta(seconds=retry_after + BATCH_LEASE_SECONDS)
+                )
+            return {"status": "deferred", "reason": reason, "retry_after": retry_after}
+
+        # The concurrency slot is given back however this ends
+        try:
+            if event_ids is None:
+                claimed, more_pending = batching.claim_batch(destination, get_event_body, BATCH_LEASE_SECONDS)
+                now = timezone.now()
+                metrics.observe('webhook_enqueue_latency_seconds', [
+                    (now - event.created_at).total_seconds() for event, _ in claimed if event.attempts_count == 0
+                ])
+                if more_pending:
+                    # Don't make the rest wait another linger period
+                    deliver_batch.apply_async((destination_id,), queue=routing.queue_for(destination))
+            else:
+                retrying = list(
+                    events.filter(status='PROCESSING')
+                    .select_related('message').defer('payload', 'message__payload')
+                    .order_by('created_at', 'id')
+                )
+                events.filter(status='PROCESSING').update(
+                    attempts_count=F('attempts_count') + 1,
+                    next_attempt_at=timezone.now() + timedelta(seconds=BATCH_LEASE_SECONDS),
+                )
+                claimed = [(event, get_event_body(event)) for event in retrying]
+
+            if not claimed:
+                circuit_breaker.release_probe(destination.id)
+                return {"status": "skipped", "message": "No events to deliver"}
+
+            event_ids = [str(event.id) for event, _ in claimed]
+            logger.info(f"Processing batch of {len(event_ids)} events for destination {destination.url}")
+
+            body = batching.encode_batch(claimed)
+            if destination.gzip_requests:
+                body = payloads.gzip_compress(body)
+            headers = build_batch_headers(event_ids, destination, body)
+            response_status_code, response_body, timings = send_delivery(destination, body, headers)
+        finally:
+            rate_limits.release(destination, lease)
+
+        circuit_breaker.record_result(destination.id, response_status_code)
+
+        is_successful = 200 <= response_status_code < 300
+        is_client_error = 400 <= response_status_code < 500
+
+        # The one response is the outcome of every event in the batch
+        timestamp = timezone.now()
+        attempt_recorder.recorder.record_many([
+            dict(
+                event_id=event.id,
+                status='SUCCESS' if is_successful else 'FAILED',
+                response_status_code=response_status_code,
+                response_body=response_body,
+                timestamp=timestamp,
+                **timings
+            )
+            for event, _ in claimed
+        ])
+        metrics.record_attempt(str(destination.id), is_successful, timings['duration_ms'] / 1000, count=len(claimed))
+
+        if is_successful:
+            set_events_status(event_ids, 'SUCCESS', from_statuses=('PROCESSING',), next_attempt_at=None)
+            logger.info(f" Batch of {len(event_ids)} events delivered successfully!")
+            return {"status": "success", "event_ids": event_ids, "status_code": response_status_code}
+
+        elif is_client_error:
+            set_events_status(event_ids, 'FAILED', from_statuses=('PROCESSING',), next_attempt_at=None)
+            metrics.inc('webhook_events_failed_total', len(event_ids), reason='client_error')
+            logger.error(f" Client error {response_status_code}, not retrying")
+            return {
+                "status": "failed",
+                "event_ids": event_ids,
+                "reason": "client_error",
+                "status_code": response_status_code
+            }
+
+        else:
+            logger.warning(f" Server error {response_status_code}, will retry...")
+            raise Exception(f"Server error or network issue (code: {response_status_code})")
+
+    except Exception as exc:
+
+        max_retries = get_max_retries(self, destination)
+        if self.request.retries < max_retries:
+            retry_delay = scheduler.schedule(
+                self, (destination_id, event_ids), get_retry_delay(self.request.retries, destination),
+                self.request.retries + 1,
+                get_retry_queue(self, destination)
+            )
+
+            logger.warning(
+                f"Retry {self.request.retries + 1}/{max_retries} "
+                f"for batch to destination {destination_id} in {retry_delay:.0f} seconds ({exc})"
+            )
+
+            if event_ids is not None:
+                set_events_status(
+                    event_ids, 'PROCESSING', from_statuses=('PROCESSING',),
+                    next_attempt_at=timezone.now() + timedelta(seconds=retry_delay + BATCH_LEASE_SECONDS)
+                )
+                metrics.inc('webhook_delivery_retries_total', len(event_ids))
+            return {"status": "retry_scheduled", "event_ids": event_ids, "retry_in": retry_delay}
+        else:
+            logger.error(f" Max retries reached for batch to destination {destination_id}, marking as FAILED")
+
+            if event_ids is not None:
+                failed = set_events_status(event_ids, 'FAILED', next_attempt_at=None)
+                metrics.inc('webhook_events_failed_total', failed, reason='max_retries')
+
+            return {
+                "status": "failed",
+                "event_ids": event_ids,
+                "reason": "max_retries_exceeded"
+            }
+
+
+def enqueue_deliveries(events):
+    """
+    Queue delivery tasks for many events at once.
+
+    All messages are published through a single producer, so a batch of
+    N events costs one broker connection instead of N separate .delay() calls.
+    Each goes to its destination's queue (see delivery/routing.py).
+    Events for destinations with batched delivery on don't get a task of
+    their own: one deliver_batch flush is scheduled per destination instead.
+    Ordered destinations likewise get one deliver_ordered task each.
+
+    In the 'async' delivery mode nothing is published: the delivery engine
+    (python manage.py run_delivery_engine) picks PENDING events straight
+    from the database.
+    """
+    if not events or settings.WEBHOOK_DELIVERY_MODE == 'async':
+        return
+
+    batched = {}
+    ordered = {}
+    with process_webhook_event.app.producer_or_acquire() as producer:
+        for event in events:
+            if event.destination.ordered:
+                ordered[event.destination_id] = event.destination
+                continue
+            if batching.is_batched(event.destination):
+                batched[event.destination_id] = event.destination
+                continue
+            process_webhook_event.apply_async(
+                (str(event.id),),
+                producer=producer,
+                queue=routing.queue_for(event.destination)
+            )
+
+        for destination in batched.values():
+            if batching.reserve_flush(destination):
+                deliver_batch.apply_async(
+                    (str(destination.id),),
+                    countdown=destination.batch_linger_ms / 1000,
+                    producer=producer,
+                    queue=routing.queue_for(destination)
+                )
+
+        for destination in ordered.values():
+            deliver_ordered.apply_async((str(destination.id),), producer=producer, queue=routing.queue_for(destination))
+
+
 # helper function to verify webhook signature when recieving them
 
 def verify_webhook_signature(payload, signature, secret_key):
-    import json
-    
+    """
+    Check an X-Webhook-Signature header against a received webhook.
+
+    Pass the raw request body bytes: they are exactly what was signed
+    (still gzip-compressed for destinations with gzip_requests on).
+    A str is encoded as UTF-8, and a dict is re-encoded canonically
+    (only safe if it was parsed from an unmodified body).
+
+    During a secret rotation the header holds several comma separated
+    signatures; it's valid if any of them matches.
+    """
     if isinstance(payload, dict):
-        payload = json.dumps(payload, sort_keys=True)
+        payload = encode_payload(payload)
     
     if isinstance(payload, str):
         payload = payload.encode('utf-8')
@@ -169,4 +734,7 @@ def verify_webhook_signature(payload, signature, secret_key):
         digestmod=hashlib.sha256
     ).hexdigest()
     
-    return hmac.compare_digest(expected_signature, signature)
+    return any(
+        hmac.compare_digest(expected_signature, candidate.strip())
+        for candidate in signature.split(',')
+    )
@@ -1,3 +1,1836 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import hmac
+import json
+import tempfile
+import threading
+import uuid
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipIf
 
-# Create your tests here.
+import redis
+from kombu.exceptions import OperationalError
+from django.conf import settings
+from django.db import DataError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import (
+    attempt_recorder, batching, circuit_breaker, engine, http_client, ingest_stream, latency, metrics, rate_limits, response_bodies, retention,
+    routing, scheduler, signing,
+)
+from .engine import claim_events, park_event, record_outcome
+from .exports import iter_ndjson
+from .models import DeliveryAttempt, Destination, Event, EventType, Message, ResponseBody
+from .pagination import EventCursorPagination
+from .payloads import encode_payload
+from .persister import Persister, persist
+from .tasks import (
+    deliver_batch, deliver_ordered, enqueue_deliveries, get_event_body, get_retry_delay, process_webhook_event,
+    verify_webhook_signature,
+)
+
+try:
+    import fakeredis
+except ImportError:  # optional, see requirements.txt: the Redis-backed tests are skipped without it
+    fakeredis = None
+
+
+@skipIf(fakeredis is None, "needs fakeredis[lua]")
+class FakeRedisMixin:
+    """Runs the Redis-backed modules (Lua scripts included) against an in-memory fakeredis."""
+
+    def setUp(self):
+        super().setUp()
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        patcher = mock.patch('delivery.redis_client._client', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class FakeClock:
+    """Stands in for time.time() in a module under test: mock.patch('delivery.<module>.time', FakeClock())."""
+
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@mock.patch('delivery.tasks.metrics')
+@mock.patch('delivery.tasks.latency.observe')
+@mock.patch('delivery.tasks.latency.get_estimate', return_value=None)
+@mock.patch('delivery.tasks.circuit_breaker.record_result')
+@mock.patch('delivery.tasks.circuit_breaker.allow_request', return_value=(True, 0))
+class DeliveryQueryBudgetTests(TestCase):
+    """
+    Locks in the SQL cost of one delivery attempt:
+    SELECT event + destination, UPDATE -> PROCESSING, INSERT attempt, UPDATE -> final status.
+
+    A response body the worker has stored before costs nothing extra; a new
+    one adds a single INSERT into ResponseBody.
+    """
+
+    def setUp(self):
+        self.destination = Destination.objects.create(url='http://receiver:8000/hook')
+        payload = {'action': 'push', 'commits': [1, 2, 3]}
+        self.event = Event.objects.create(
+            destination=self.destination,
+            payload=payload,
+            body=encode_payload(payload),
+        )
+        response_bodies.forget()
+        response_bodies.store([{'response_body': 'ok'}])
+
+    def deliver(self, status_code, body=b'ok'):
+        response = mock.Mock(
+            status_code=status_code,
+            encoding='utf-8',
+            elapsed=timedelta(milliseconds=5),
+            iter_content=mock.Mock(return_value=iter([body])),
+        )
+        with mock.patch('delivery.tasks.http_client.post', return_value=response) as post:
+            result = process_webhook_event.apply(args=(str(self.event.id),)).get()
+        return result, post
+
+    def test_successful_delivery_query_budget(self, *mocks):
+        with self.assertNumQueries(4):
+            result, post = self.deliver(200)
+
+        self.assertEqual(result['status'], 'success')
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.status, 'SUCCESS')
+        self.assertEqual(self.event.attempts_count, 1)
+        self.assertEqual(DeliveryAttempt.objects.filter(event=self.event).count(), 1)
+
+        # The stored body is sent as-is
+        self.assertEqual(post.call_args.kwargs['data'], bytes(self.event.body))
+
+    def test_client_error_query_budget(self, *mocks):
+        with self.assertNumQueries(4):
+            result, _ = self.deliver(404)
+
+        self.assertEqual(result['reason'], 'client_error')
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.status, 'FAILED')
+
+    def test_finished_event_is_not_delivered_again(self, *mocks):
+        Event.objects.filter(id=self.event.id).update(status='SUCCESS')
+
+        with self.assertNumQueries(1):
+            result, post = self.deliver(200)
+
+        self.assertEqual(result['status'], 'skipped')
+        post.assert_not_called()
+        self.assertFalse(DeliveryAttempt.objects.exists())
+
+    def test_identical_response_bodies_are_stored_once(self, *mocks):
+        with self.assertNumQueries(5):
+            self.deliver(404, body=b'no such hook')
+
+        second = Event.objects.create(destination=self.destination, payload={}, body=encode_payload({}))
+        self.event = second
+        with self.assertNumQueries(4):
+            self.deliver(404, body=b'no such hook')
+
+        attempts = DeliveryAttempt.objects.select_related('response_content')
+        self.assertEqual([attempt.get_response_body() for attempt in attempts], ['no such hook'] * 2)
+        self.assertEqual(ResponseBody.objects.filter(body='no such hook').count(), 1)
+
+    @override_settings(WEBHOOK_RESPONSE_CAPTURE_BYTES=4)
+    def test_response_capture_is_capped(self, *mocks):
+        self.deliver(200, body=b'x' * 100)
+
+        attempt = DeliveryAttempt.objects.get(event=self.event)
+        self.assertEqual(attempt.get_response_body(), 'xxxx')
+
+    def test_gzip_delivery_is_signed_as_sent(self, *mocks):
+        Destination.objects.filter(id=self.destination.id).update(gzip_requests=True)
+
+        _, post = self.deliver(200)
+
+        sent = post.call_args.kwargs['data']
+        headers = post.call_args.kwargs['headers']
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(sent), bytes(self.event.body))
+        self.assertTrue(verify_webhook_signature(sent, headers['X-Webhook-Signature'], self.destination.secret_key))
+
+
+class EventUpdateTests(TestCase):
+    """Changing an event's payload through the API changes what its next attempt sends."""
+
+    def setUp(self):
+        self.destination = Destination.objects.create(url='http://receiver:8000/hook')
+        self.event = Event.objects.create(
+            destination=self.destination, payload={'v': 1}, body=encode_payload({'v': 1})
+        )
+
+    def patch(self, event, data):
+        return self.client.patch(f'/api/events/{event.id}/', data, content_type='application/json')
+
+    def test_payload_update_re_encodes_the_body(self):
+        response = self.patch(self.event, {'payload': {'v': 2}})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['payload'], {'v': 2})
+        self.event.refresh_from_db()
+        self.assertEqual(get_event_body(self.event), encode_payload({'v': 2}))
+
+    @override_settings(WEBHOOK_PAYLOAD_COMPRESSION='gzip', WEBHOOK_PAYLOAD_COMPRESSION_MIN_BYTES=0)
+    def test_payload_update_with_compression(self):
+        self.patch(self.event, {'payload': {'v': 2}})
+
+        self.event.refresh_from_db()
+        self.assertIsNone(self.event.payload)
+        self.assertEqual(self.event.get_payload(), {'v': 2})
+
+    def test_fanned_out_payload_is_read_only(self):
+        event_type = EventType.objects.create(name='order.created')
+        message = Message.objects.create(event_type=event_type, payload={'v': 1}, body=encode_payload({'v': 1}))
+        event = Event.objects.create(destination=self.destination, message=message)
+
+        response = self.patch(event, {'payload': {'v': 2}})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(bytes(Message.objects.get().body), encode_payload({'v': 1}))
+
+
+@mock.patch('delivery.views.metrics')
+@mock.patch('delivery.fanout.enqueue_deliveries')
+class FanOutTests(TestCase):
+    """Event types, subscriptions and messages published to every subscriber."""
+
+    def test_dotted_event_type_is_fanned_out(self, enqueue, metrics):
+        subscribed = Destination.objects.create(url='http://receiver:8000/a')
+        Destination.objects.create(url='http://receiver:8000/b')
+
+        response = self.client.post('/api/event-types/', {'name': 'order.created'}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(
+            '/api/subscriptions/',
+            {'event_type': 'order.created', 'destination': str(subscribed.id)},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/messages/', {'event_type': 'order.created', 'payload': {'id': 1}}, content_type='application/json'
+            )
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual([delivery['destination'] for delivery in response.json()['deliveries']], [str(subscribed.id)])
+        self.assertEqual([event.destination_id for event in enqueue.call_args.args[0]], [subscribed.id])
+        self.assertEqual(Event.objects.get().message.get_payload(), {'id': 1})
+
+    def test_invalid_event_type_name_is_rejected(self, enqueue, metrics):
+        response = self.client.post('/api/event-types/', {'name': 'Order Created'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(WEBHOOK_CIRCUIT_FAILURE_THRESHOLD=3, WEBHOOK_CIRCUIT_COOLDOWN=60, WEBHOOK_CIRCUIT_PROBE_TIMEOUT=45)
+class CircuitBreakerTests(FakeRedisMixin, TestCase):
+    """closed -> open after the threshold -> half open (one probe) after the cooldown -> closed or open again."""
+
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        patcher = mock.patch('delivery.circuit_breaker.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.destination_id = uuid.uuid4()
+
+    def fail(self, times=1):
+        for _ in range(times):
+            circuit_breaker.record_result(self.destination_id, 503)
+
+    def state(self):
+        return circuit_breaker.get_state(self.destination_id)['state']
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail(2)
+        self.assertEqual(circuit_breaker.allow_request(self.destination_id), (True, 0))
+
+        # A 4xx means the destination is up: the count starts over
+        circuit_breaker.record_result(self.destination_id, 404)
+        self.fail(2)
+        self.assertEqual(self.state(), circuit_breaker.CLOSED)
+
+        self.fail()
+        self.assertEqual(self.state(), circuit_breaker.OPEN)
+        self.clock.advance(20)
+        self.assertEqual(circuit_breaker.allow_request(self.destination_id), (False, 40))
+
+    def test_one_probe_after_the_cooldown(self):
+        self.fail(3)
+        self.clock.advance(60)
+
+        self.assertEqual(circuit_breaker.allow_request(self.destination_id), (True, 0))
+        self.assertEqual(self.state(), circuit_breaker.HALF_OPEN)
+        # Everyone else waits for the probe's outcome
+        self.assertEqual(circuit_breaker.allow_request(self.destination_id), (False, 45))
+
+    def test_successful_probe_closes(self):
+        self.fail(3)
+        self.clock.advance(60)
+        circuit_breaker.allow_request(self.destination_id)
+
+        circuit_breaker.record_result(self.destination_id, 200)
+
+        self.assertEqual(circuit_breaker.get_state(self.destination_id)['consecutive_failures'], 0)
+        self.assertEqual(self.state(), circuit_breaker.CLOSED)
+        self.assertEqual(circuit_breaker.allow_request(self.destination_id), (True, 0))
+
+    def test_failed_probe_opens_again(self):
+        self.fail(3)
+        self.clock.advance(60)
+        circuit_breaker.allow_request(self.destination_id)
+
+        self.fail()
+
+        self.assertEqual(self.state(), circuit_breaker.OPEN)
+        self.assertEqual(circuit_breaker.allow_request(self.destination_id), (False, 60))
+        # A new cooldown, then a new probe
+        self.clock.advance(60)
+        self.assertEqual(circuit_breaker.allow_request(self.destination_id), (True, 0))
+
+    def test_released_probe_can_be_taken_again(self):
+        self.fail(3)
+        self.clock.advance(60)
+        circuit_breaker.allow_request(self.destination_id)
+
+        circuit_breaker.release_probe(self.destination_id)
+
+        self.assertEqual(circuit_breaker.allow_request(self.destination_id), (True, 0))
+
+    def test_release_probe_is_a_no_op_when_closed(self):
+        circuit_breaker.release_probe(self.destination_id)
+        self.assertEqual(self.state(), circuit_breaker.CLOSED)
+
+    @mock.patch('delivery.tasks.scheduler.schedule', side_effect=lambda task, args, delay, *rest, **kwargs: delay)
+    @mock.patch('delivery.tasks.rate_limits.acquire', return_value=(False, 1.0, None))
+    def test_probe_deferred_by_the_rate_limits_is_released(self, acquire, schedule):
+        destination = Destination.objects.create(url='http://receiver:8000/hook')
+        event = Event.objects.create(destination=destination, payload={}, body=encode_payload({}))
+        self.destination_id = destination.id
+        self.fail(3)
+        self.clock.advance(60)
+
+        result = process_webhook_event.apply(args=(str(event.id),)).get()
+
+        self.assertEqual(result['reason'], 'rate_limited')
+        # The next delivery can probe right away instead of waiting out the probe timeout
+        self.assertEqual(circuit_breaker.allow_request(destination.id), (True, 0))
+
+    def test_fails_open_without_redis(self):
+        with mock.patch('delivery.circuit_breaker.get_redis', side_effect=redis.ConnectionError):
+            self.assertEqual(circuit_breaker.allow_request(self.destination_id), (True, 0))
+            circuit_breaker.record_result(self.destination_id, 503)
+            self.assertEqual(self.state(), 'unknown')
+
+
+@override_settings(WEBHOOK_CONCURRENCY_LEASE_SECONDS=60)
+class RateLimitTests(FakeRedisMixin, TestCase):
+    """Token bucket (max_requests_per_second) and semaphore (max_concurrent_deliveries), shared through Redis."""
+
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        patcher = mock.patch('delivery.rate_limits.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unlimited_destination_skips_redis(self):
+        destination = Destination(url='http://receiver:8000/hook')
+
+        self.assertEqual(rate_limits.acquire(destination), (True, 0, None))
+        self.assertEqual(self.redis.keys('*'), [])
+
+    def test_token_bucket(self):
+        destination = Destination(url='http://receiver:8000/hook', max_requests_per_second=2)
+
+        self.assertTrue(rate_limits.acquire(destination)[0])
+        self.assertTrue(rate_limits.acquire(destination)[0])
+        allowed, retry_after, _ = rate_limits.acquire(destination)
+        self.assertFalse(allowed)
+        self.assertGreaterEqual(retry_after, 0.5)
+        self.assertLess(retry_after, 0.61)
+
+        # Refills at the configured rate
+        self.clock.advance(0.5)
+        self.assertTrue(rate_limits.acquire(destination)[0])
+        self.assertFalse(rate_limits.acquire(destination)[0])
+
+    def test_semaphore(self):
+        destination = Destination(url='http://receiver:8000/hook', max_concurrent_deliveries=2)
+
+        first = rate_limits.acquire(destination)
+        second = rate_limits.acquire(destination)
+        self.assertTrue(first[0] and second[0])
+        self.assertFalse(rate_limits.acquire(destination)[0])
+
+        rate_limits.release(destination, first[2])
+        third = rate_limits.acquire(destination)
+        self.assertTrue(third[0])
+        self.assertFalse(rate_limits.acquire(destination)[0])
+
+        # A worker that died holding its slots: the leases expire
+        self.clock.advance(61)
+        self.assertTrue(rate_limits.acquire(destination)[0])
+
+    def test_denied_by_the_bucket_gives_the_slot_back(self):
+        destination = Destination(url='http://receiver:8000/hook', max_requests_per_second=1, max_concurrent_deliveries=1)
+
+        lease = rate_limits.acquire(destination)[2]
+        rate_limits.release(destination, lease)
+        self.assertFalse(rate_limits.acquire(destination)[0])
+
+        self.assertEqual(self.redis.zcard(f"webhook:concurrency:{destination.id}"), 0)
+
+    def test_allows_without_redis(self):
+        destination = Destination(url='http://receiver:8000/hook', max_concurrent_deliveries=1)
+        with mock.patch.object(self.redis, 'eval', side_effect=redis.ConnectionError):
+            self.assertEqual(rate_limits.acquire(destination), (True, 0, None))
+
+    @mock.patch('delivery.tasks.metrics')
+    @mock.patch('delivery.tasks.scheduler.schedule', side_effect=lambda task, args, delay, *rest, **kwargs: delay)
+    def test_slot_is_released_when_the_delivery_blows_up(self, schedule, metrics):
+        destination = Destination.objects.create(url='http://receiver:8000/hook', max_concurrent_deliveries=1)
+        event = Event.objects.create(destination=destination, payload={}, body=encode_payload({}))
+
+        with mock.patch('delivery.tasks.build_delivery_headers', side_effect=RuntimeError('boom')):
+            result = process_webhook_event.apply(args=(str(event.id),)).get()
+
+        self.assertEqual(result['status'], 'retry_scheduled')
+        self.assertTrue(rate_limits.acquire(destination)[0])
+
+
+@mock.patch('delivery.views.metrics')
+@mock.patch('delivery.views.enqueue_deliveries')
+@mock.patch('delivery.idempotency.remember')
+@mock.patch('delivery.idempotency.lookup', side_effect=lambda pairs: {})
+class IdempotentIngestionTests(TestCase):
+    """A retried POST /api/events/ returns the original event, without a second INSERT or enqueue."""
+
+    def setUp(self):
+        self.destination = Destination.objects.create(url='http://receiver:8000/hook')
+
+    def post(self, payload, key=None):
+        return self.client.post(
+            '/api/events/',
+            {'destination': str(self.destination.id), 'payload': payload},
+            content_type='application/json',
+            headers={'Idempotency-Key': key} if key else {},
+        )
+
+    def test_retry_with_the_same_key_returns_the_original_event(self, lookup, remember, enqueue, metrics):
+        first = self.post({'order': 1}, key='order-1')
+        retry = self.post({'order': 1}, key='order-1')
+
+        self.assertEqual(retry.status_code, 202)
+        self.assertEqual(retry.json()['task_id'], first.json()['task_id'])
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Event.objects.count(), 1)
+        self.assertEqual(enqueue.call_count, 1)
+
+    def test_cached_key_skips_the_insert(self, lookup, remember, enqueue, metrics):
+        lookup.side_effect = lambda pairs: {(self.destination.id, 'order-1'): 'original-id'}
+
+        # Only the destination lookup done by the serializer
+        with self.assertNumQueries(1):
+            response = self.post({'order': 1}, key='order-1')
+
+        self.assertEqual(response.json()['task_id'], 'original-id')
+        enqueue.assert_not_called()
+
+    def test_payload_hash_when_the_destination_opts_in(self, lookup, remember, enqueue, metrics):
+        self.post({'order': 1})
+        self.post({'order': 1})
+        self.assertEqual(Event.objects.count(), 2)
+
+        Destination.objects.filter(id=self.destination.id).update(deduplicate_payloads=True)
+        Event.objects.all().delete()
+        self.post({'order': 1})
+        self.post({'order': 1})
+        self.post({'order': 2})
+        self.assertEqual(Event.objects.count(), 2)
+
+
+@mock.patch('delivery.views.metrics')
+@mock.patch('delivery.views.enqueue_deliveries')
+@mock.patch('delivery.idempotency.remember')
+@mock.patch('delivery.idempotency.lookup', side_effect=lambda pairs: {})
+class BulkIngestionTests(TestCase):
+    """POST /api/events/bulk/: one result per item, one INSERT and one enqueue per request."""
+
+    def setUp(self):
+        self.destination = Destination.objects.create(url='http://receiver:8000/hook')
+
+    def post(self, items):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/events/bulk/', items, content_type='application/json')
+
+    def item(self, n, **extra):
+        return {'destination': str(self.destination.id), 'payload': {'n': n}, **extra}
+
+    def test_every_item_gets_its_own_result(self, lookup, remember, enqueue, metrics):
+        response = self.post([
+            self.item(0),
+            {'destination': str(self.destination.id)},
+            {'destination': str(uuid.uuid4()), 'payload': {}},
+            'not an event',
+            self.item(4),
+        ])
+
+        self.assertEqual(response.status_code, 202)
+        body = response.json()
+        self.assertEqual([result['status'] for result in body['results']],
+                         ['accepted', 'rejected', 'rejected', 'rejected', 'accepted'])
+        self.assertIn('payload', body['results'][1]['errors'])
+        self.assertIn('destination', body['results'][2]['errors'])
+        self.assertEqual((body['accepted'], body['rejected'], body['duplicates']), (2, 3, 0))
+
+        stored = Event.objects.order_by('created_at')
+        self.assertEqual({str(event.id) for event in stored}, {body['results'][0]['task_id'], body['results'][4]['task_id']})
+        self.assertEqual({bytes(event.body) for event in stored}, {encode_payload({'n': 0}), encode_payload({'n': 4})})
+        self.assertEqual(len(enqueue.call_args.args[0]), 2)
+
+    def test_all_items_rejected(self, lookup, remember, enqueue, metrics):
+        response = self.post([{'payload': {}}, {'destination': 'nope', 'payload': {}}])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['rejected'], 2)
+        self.assertFalse(Event.objects.exists())
+        enqueue.assert_not_called()
+
+    @override_settings(WEBHOOK_BULK_MAX_EVENTS=2)
+    def test_item_count_limit(self, lookup, remember, enqueue, metrics):
+        response = self.post([self.item(n) for n in range(3)])
+
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(Event.objects.exists())
+
+    def test_not_a_list(self, lookup, remember, enqueue, metrics):
+        response = self.post(self.item(0))
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_query_budget(self, lookup, remember, enqueue, metrics):
+        other = Destination.objects.create(url='http://receiver:8000/other')
+        items = [self.item(n) for n in range(50)] + [{'destination': str(other.id), 'payload': {}}]
+
+        # SELECT destinations, SAVEPOINT, INSERT, RELEASE SAVEPOINT
+        with self.assertNumQueries(4):
+            response = self.post(items)
+
+        self.assertEqual(response.json()['accepted'], 51)
+        self.assertEqual(Event.objects.count(), 51)
+        enqueue.assert_called_once()
+
+    def test_repeated_key_in_one_request(self, lookup, remember, enqueue, metrics):
+        response = self.post([self.item(0, idempotency_key='k'), self.item(0, idempotency_key='k')])
+
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['accepted', 'duplicate'])
+        self.assertEqual(results[0]['task_id'], results[1]['task_id'])
+        self.assertEqual(Event.objects.count(), 1)
+
+    def test_ndjson_body(self, lookup, remember, enqueue, metrics):
+        body = '\n'.join(json.dumps(self.item(n)) for n in range(3))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/events/bulk/', body, content_type='application/x-ndjson')
+
+        self.assertEqual(response.json()['accepted'], 3)
+
+
+@mock.patch('delivery.persister.enqueue_deliveries')
+class IngestPersisterTests(TestCase):
+    """Buffered ingestion: stream entries become events, and replaying them is harmless."""
+
+    def setUp(self):
+        self.destination = Destination.objects.create(url='http://receiver:8000/hook')
+
+    def entry(self, payload, key=''):
+        fields = {
+            'id': str(uuid.uuid4()),
+            'destination': str(self.destination.id),
+            'body': encode_payload(payload).decode('utf-8'),
+            'key': key,
+        }
+        return ('0-0', fields)
+
+    def test_replayed_entries_are_not_persisted_twice(self, enqueue):
+        entries = [self.entry({'n': n}) for n in range(3)]
+
+        self.assertEqual(persist(entries), 3)
+        # A persister that crashed before acknowledging: the batch is reclaimed and persisted again
+        self.assertEqual(persist(entries), 3)
+
+        self.assertEqual(Event.objects.count(), 3)
+        self.assertEqual(Event.objects.get(id=entries[0][1]['id']).get_payload(), {'n': 0})
+
+    def test_idempotency_key_conflicts_are_dropped(self, enqueue):
+        first, retry = self.entry({'n': 1}, key='order-1'), self.entry({'n': 1}, key='order-1')
+
+        self.assertEqual(persist([first, retry]), 1)
+
+        self.assertEqual(list(Event.objects.values_list('id', flat=True)), [uuid.UUID(first[1]['id'])])
+        self.assertEqual([event.id for event in enqueue.call_args.args[0]], [uuid.UUID(first[1]['id'])])
+
+
+class IngestPersisterQueryTests(TestCase):
+    """persist() costs the same few queries however many events and destinations a batch has."""
+
+    def entries(self, destinations, count):
+        return [
+            ('0-0', {
+                'id': str(uuid.uuid4()),
+                'destination': str(destinations[n % len(destinations)].id),
+                'body': encode_payload({'n': n}).decode('utf-8'),
+                'key': '',
+            })
+            for n in range(count)
+        ]
+
+    def test_persist_query_budget(self):
+        destinations = [Destination.objects.create(url=f'http://receiver:8000/{n}') for n in range(3)]
+        entries = self.entries(destinations, 10)
+
+        # SELECT destinations, SAVEPOINT, INSERT, SELECT stored ids, RELEASE SAVEPOINT
+        with mock.patch.object(process_webhook_event.app, 'producer_or_acquire'), \
+                mock.patch.object(process_webhook_event, 'apply_async') as publish, \
+                self.assertNumQueries(5):
+            self.assertEqual(persist(entries), 10)
+
+        self.assertEqual(publish.call_count, 10)
+
+    @override_settings(WEBHOOK_PARTITIONED_MODELS=['event'])
+    def test_replay_into_partitioned_events_is_deduplicated_by_id(self):
+        destinations = [Destination.objects.create(url='http://receiver:8000/hook')]
+        entries = self.entries(destinations, 3)
+
+        with mock.patch('delivery.persister.enqueue_deliveries') as enqueue:
+            persist(entries)
+            # Everything is already stored: no INSERT at all
+            with self.assertNumQueries(5):
+                self.assertEqual(persist(entries), 3)
+
+        self.assertEqual(Event.objects.count(), 3)
+        self.assertEqual(len(enqueue.call_args.args[0]), 3)
+
+
+@mock.patch('delivery.tasks.metrics')
+@mock.patch('delivery.tasks.latency.observe')
+@mock.patch('delivery.tasks.latency.get_estimate', return_value=None)
+@mock.patch('delivery.tasks.circuit_breaker.record_result')
+@mock.patch('delivery.tasks.circuit_breaker.allow_request', return_value=(True, 0))
+@mock.patch('delivery.tasks.ordering.release')
+@mock.patch('delivery.tasks.ordering.renew', return_value=True)
+@mock.patch('delivery.tasks.ordering.acquire', return_value='token')
+class OrderedDeliveryTests(TestCase):
+    """Destination.ordered: events go out one at a time, oldest first, and a retrying head blocks the rest."""
+
+    def setUp(self):
+        self.destination = Destination.objects.create(url='http://receiver:8000/hook', ordered=True)
+        start = timezone.now() - timedelta(minutes=5)
+        self.events = []
+        for n in range(3):
+            event = Event.objects.create(destination=self.destination, payload={'n': n}, body=encode_payload({'n': n}))
+            Event.objects.filter(id=event.id).update(created_at=start + timedelta(seconds=n))
+            self.events.append(event)
+
+    def run_ordered(self, status_codes):
+        responses = [
+            mock.Mock(
+                status_code=status_code,
+                encoding='utf-8',
+                elapsed=timedelta(milliseconds=5),
+                iter_content=mock.Mock(return_value=iter([b'ok'])),
+            )
+            for status_code in status_codes
+        ]
+        with mock.patch('delivery.tasks.http_client.post', side_effect=responses) as post, \
+                mock.patch('delivery.tasks.scheduler.schedule', side_effect=lambda task, args, delay, *rest, **kwargs: delay) as schedule, \
+                mock.patch.object(deliver_ordered, 'apply_async') as requeue:
+            result = deliver_ordered.apply(args=(str(self.destination.id),)).get()
+        sent = [json.loads(call.kwargs['data']) for call in post.call_args_list]
+        return result, sent, schedule, requeue
+
+    def test_events_are_delivered_oldest_first(self, *mocks):
+        result, sent, _, requeue = self.run_ordered([200, 200, 200])
+
+        self.assertEqual(result['delivered'], 3)
+        self.assertEqual(sent, [{'n': 0}, {'n': 1}, {'n': 2}])
+        self.assertEqual(Event.objects.filter(status='SUCCESS').count(), 3)
+        requeue.assert_not_called()
+
+    def test_retrying_head_blocks_later_events(self, *mocks):
+        result, sent, schedule, _ = self.run_ordered([200, 503])
+
+        self.assertEqual(result['status'], 'blocked')
+        self.assertEqual(sent, [{'n': 0}, {'n': 1}])
+        # The destination resumes as a whole, with the retrying event first
+        self.assertIs(schedule.call_args.args[0], deliver_ordered)
+        self.assertEqual(schedule.call_args.args[1], (str(self.destination.id),))
+        head = Event.objects.get(id=self.events[1].id)
+        self.assertEqual(head.status, 'PROCESSING')
+        self.assertIsNotNone(head.next_attempt_at)
+        self.assertEqual(Event.objects.get(id=self.events[2].id).status, 'PENDING')
+
+        # The retry's wake-up counts from the same moment as next_attempt_at
+        wake_up = schedule.call_args.kwargs['now'] + schedule.call_args.args[2]
+        self.assertAlmostEqual(wake_up, head.next_attempt_at.timestamp(), places=3)
+
+        # Woken up early (by a new event, or a clock ahead): nothing is sent,
+        # and another run is scheduled for when the head is due
+        result, sent, schedule, _ = self.run_ordered([])
+        self.assertEqual((result['status'], sent), ('blocked', []))
+        schedule.assert_called_once()
+        self.assertIs(schedule.call_args.args[0], deliver_ordered)
+        self.assertFalse(schedule.call_args.kwargs['jitter'])
+        wake_up = schedule.call_args.kwargs['now'] + schedule.call_args.args[2]
+        self.assertAlmostEqual(wake_up, head.next_attempt_at.timestamp(), places=3)
+
+    @override_settings(WEBHOOK_ORDERED_MAX_SECONDS_PER_RUN=150)
+    def test_slow_destination_hands_over_before_the_time_limit(self, *mocks):
+        clock = FakeClock()
+        responses = iter([200, 200, 200])
+
+        def post(*args, **kwargs):
+            clock.advance(100)
+            return mock.Mock(
+                status_code=next(responses), encoding='utf-8', elapsed=timedelta(seconds=100),
+                iter_content=mock.Mock(return_value=iter([b'ok'])),
+            )
+
+        with mock.patch('delivery.tasks.time', clock), \
+                mock.patch('delivery.tasks.http_client.post', side_effect=post), \
+                mock.patch.object(deliver_ordered, 'apply_async') as requeue:
+            result = deliver_ordered.apply(args=(str(self.destination.id),)).get()
+
+        self.assertEqual((result['status'], result['delivered']), ('yielded', 2))
+        self.assertEqual(Event.objects.get(id=self.events[2].id).status, 'PENDING')
+        requeue.assert_called_once()
+
+    def test_failed_head_does_not_block(self, *mocks):
+        result, sent, _, _ = self.run_ordered([400, 200, 200])
+
+        self.assertEqual(sent, [{'n': 0}, {'n': 1}, {'n': 2}])
+        self.assertEqual(Event.objects.get(id=self.events[0].id).status, 'FAILED')
+        self.assertEqual(Event.objects.filter(status='SUCCESS').count(), 2)
+
+    def test_run_without_the_lease_does_nothing(self, acquire, *mocks):
+        acquire.return_value = None
+
+        result, sent, _, _ = self.run_ordered([])
+
+        self.assertEqual((result['status'], sent), ('skipped', []))
+
+    @mock.patch('delivery.engine.close_old_connections')
+    def test_async_engine_only_claims_the_head(self, *mocks):
+        claimed = claim_events(10)
+
+        self.assertEqual([event.id for event in claimed], [self.events[0].id])
+        self.assertEqual(claim_events(10), [])
+
+
+@mock.patch('delivery.tasks.metrics')
+@mock.patch('delivery.tasks.latency.observe')
+@mock.patch('delivery.tasks.latency.get_estimate', return_value=None)
+@mock.patch('delivery.tasks.circuit_breaker.record_result')
+@mock.patch('delivery.tasks.circuit_breaker.allow_request', return_value=(True, 0))
+class BatchedDeliveryTests(FakeRedisMixin, TestCase):
+    """batch_max_size > 1: one pending flush per destination, which sends the oldest due events as one array."""
+
+    def setUp(self):
+        super().setUp()
+        self.destination = Destination.objects.create(
+            url='http://receiver:8000/hook', batch_max_size=3, batch_linger_ms=500
+        )
+        start = timezone.now() - timedelta(minutes=5)
+        self.events = []
+        for n in range(5):
+            event = Event.objects.create(destination=self.destination, payload={'n': n}, body=encode_payload({'n': n}))
+            Event.objects.filter(id=event.id).update(created_at=start + timedelta(seconds=n))
+            self.events.append(event)
+
+    def test_one_flush_per_linger_window(self, *mocks):
+        with mock.patch.object(process_webhook_event.app, 'producer_or_acquire'), \
+                mock.patch.object(process_webhook_event, 'apply_async') as single, \
+                mock.patch.object(deliver_batch, 'apply_async') as flush:
+            enqueue_deliveries(self.events[:2])
+            enqueue_deliveries(self.events[2:])
+            self.assertEqual(flush.call_count, 1)
+            self.assertEqual(flush.call_args.kwargs['countdown'], 0.5)
+
+            # Once the flush starts, new events schedule the next one
+            batching.clear_flush(self.destination.id)
+            enqueue_deliveries(self.events[:1])
+
+        self.assertEqual(flush.call_count, 2)
+        single.assert_not_called()
+
+    def test_claim_respects_size_and_bytes(self, *mocks):
+        claimed, more_pending = batching.claim_batch(self.destination, get_event_body, 60)
+        self.assertEqual([event.id for event, _ in claimed], [event.id for event in self.events[:3]])
+        self.assertTrue(more_pending)
+        self.assertEqual(Event.objects.filter(status='PROCESSING').count(), 3)
+
+        # The claimed ones are leased: the next claim gets the rest
+        claimed, more_pending = batching.claim_batch(self.destination, get_event_body, 60)
+        self.assertEqual([event.id for event, _ in claimed], [event.id for event in self.events[3:]])
+        self.assertFalse(more_pending)
+
+    def test_byte_cap(self, *mocks):
+        one_element = len(batching.encode_batch([(self.events[0], encode_payload({'n': 0}))]))
+        Destination.objects.filter(id=self.destination.id).update(batch_max_bytes=one_element + 10)
+        self.destination.refresh_from_db()
+
+        claimed, more_pending = batching.claim_batch(self.destination, get_event_body, 60)
+
+        self.assertEqual(len(claimed), 1)
+        self.assertTrue(more_pending)
+
+    def test_pending_flush_hands_over_once_batching_is_off(self, *mocks):
+        Destination.objects.filter(id=self.destination.id).update(batch_max_size=None)
+
+        with mock.patch('delivery.tasks.http_client.post') as post, \
+                mock.patch.object(process_webhook_event.app, 'producer_or_acquire'), \
+                mock.patch.object(process_webhook_event, 'apply_async') as single, \
+                mock.patch.object(deliver_batch, 'apply_async') as flush:
+            result = deliver_batch.apply(args=(str(self.destination.id),)).get()
+
+        self.assertEqual(result['status'], 'skipped')
+        post.assert_not_called()
+        flush.assert_not_called()
+        # Nothing claimed: every waiting event goes out on its own
+        self.assertEqual(
+            sorted(call.args[0][0] for call in single.call_args_list), sorted(str(event.id) for event in self.events)
+        )
+        self.assertFalse(Event.objects.exclude(status='PENDING').exists())
+
+    def test_flush_sends_one_signed_array(self, *mocks):
+        response = mock.Mock(
+            status_code=200, encoding='utf-8', elapsed=timedelta(milliseconds=5),
+            iter_content=mock.Mock(return_value=iter([b'ok'])),
+        )
+        with mock.patch('delivery.tasks.http_client.post', return_value=response) as post, \
+                mock.patch.object(deliver_batch, 'apply_async') as more:
+            result = deliver_batch.apply(args=(str(self.destination.id),)).get()
+
+        self.assertEqual(result['status'], 'success')
+        sent = post.call_args.kwargs['data']
+        self.assertEqual(json.loads(sent), [{'id': str(event.id), 'payload': {'n': n}} for n, event in enumerate(self.events[:3])])
+        self.assertTrue(verify_webhook_signature(
+            sent, post.call_args.kwargs['headers']['X-Webhook-Signature'], self.destination.secret_key
+        ))
+        self.assertEqual(Event.objects.filter(status='SUCCESS').count(), 3)
+        self.assertEqual(DeliveryAttempt.objects.count(), 3)
+        # Two events are still waiting: flushed right away instead of after another linger period
+        more.assert_called_once()
+
+
+class RoutingTests(TestCase):
+    """Which queue a destination's deliveries go to."""
+
+    def test_queue_rules(self):
+        self.assertEqual(routing.queue_for(Destination(tier='priority')), 'deliveries.priority')
+        self.assertEqual(routing.queue_for(Destination(tier='bulk')), 'deliveries.bulk')
+        # A pinned queue wins over the tier
+        pinned = Destination(tier='priority', delivery_queue='deliveries.isolated')
+        self.assertEqual(routing.queue_for(pinned), 'deliveries.isolated')
+
+    @override_settings(WEBHOOK_DELIVERY_SHARDS=4)
+    def test_standard_tier_is_sharded_by_destination(self):
+        destination_id = uuid.UUID('12345678-1234-5678-1234-567812345678')
+        queue = routing.queue_for(Destination(id=destination_id))
+
+        # Stable across calls (and processes: crc32, not hash())
+        self.assertEqual(queue, routing.queue_for(Destination(id=destination_id)))
+        self.assertEqual(queue, f"deliveries.shard{routing.shard_for(destination_id)}")
+        shards = {routing.shard_for(uuid.uuid4()) for _ in range(200)}
+        self.assertEqual(shards, {0, 1, 2, 3})
+
+    def test_tasks_are_published_to_the_destination_queue(self):
+        destination = Destination.objects.create(url='http://receiver:8000/hook', tier='bulk')
+        event = Event.objects.create(destination=destination, payload={}, body=encode_payload({}))
+
+        with mock.patch.object(process_webhook_event.app, 'producer_or_acquire'), \
+                mock.patch.object(process_webhook_event, 'apply_async') as publish:
+            enqueue_deliveries([event])
+
+        self.assertEqual(publish.call_args.kwargs['queue'], 'deliveries.bulk')
+
+    @override_settings(WEBHOOK_ISOLATED_QUEUES=['deliveries.isolated'])
+    def test_only_consumed_queues_can_be_pinned(self):
+        destination = Destination.objects.create(url='http://receiver:8000/hook')
+        url = f'/api/destinations/{destination.id}/'
+
+        response = self.client.patch(url, {'delivery_queue': 'deliveries.nowhere'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        with mock.patch('delivery.serializers.circuit_breaker.get_state', return_value={}), \
+                mock.patch('delivery.serializers.latency.get_estimate', return_value=None):
+            response = self.client.patch(url, {'delivery_queue': 'deliveries.isolated'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        destination.refresh_from_db()
+        self.assertEqual(routing.queue_for(destination), 'deliveries.isolated')
+
+
+class RetryPolicyTests(TestCase):
+
+    def test_backoff_policies(self):
+        self.assertEqual([get_retry_delay(n) for n in range(3)], [60, 120, 240])
+
+        exponential = Destination(retry_policy='exponential', retry_base_delay=10, retry_max_delay=50)
+        self.assertEqual([get_retry_delay(n, exponential) for n in range(4)], [10, 20, 40, 50])
+        linear = Destination(retry_policy='linear', retry_base_delay=10)
+        self.assertEqual([get_retry_delay(n, linear) for n in range(3)], [10, 20, 30])
+        fixed = Destination(retry_policy='fixed', retry_base_delay=10)
+        self.assertEqual([get_retry_delay(n, fixed) for n in range(3)], [10, 10, 10])
+
+    @override_settings(WEBHOOK_RETRY_JITTER=0.2)
+    def test_jitter_stays_within_bounds(self):
+        delays = [scheduler.jittered(100) for _ in range(200)]
+        self.assertTrue(all(80 <= delay <= 120 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+
+@override_settings(WEBHOOK_RETRY_JITTER=0, WEBHOOK_RETRY_VISIBILITY_TIMEOUT=60)
+class SchedulerTests(FakeRedisMixin, TestCase):
+    """Delayed deliveries wait in a sorted set and are published once due, at least once."""
+
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        patcher = mock.patch('delivery.scheduler.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.task = mock.Mock()
+        self.task.name = 'delivery.tasks.process_webhook_event'
+        self.app = mock.MagicMock(tasks={self.task.name: self.task})
+        patcher = mock.patch('delivery.scheduler.current_app', self.app)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_published_once_due(self):
+        self.assertEqual(scheduler.schedule(self.task, ('event-1',), 30, 2, 'deliveries.shard1'), 30)
+
+        self.assertEqual(scheduler.dispatch_due(), 0)
+        self.clock.advance(30)
+        self.assertEqual(scheduler.dispatch_due(), 1)
+
+        self.task.apply_async.assert_called_once_with(
+            ('event-1',), retries=2, queue='deliveries.shard1', producer=mock.ANY
+        )
+        self.assertEqual(self.redis.zcard(scheduler.SCHEDULE_KEY), 0)
+        self.assertEqual(self.redis.zcard(scheduler.INFLIGHT_KEY), 0)
+        self.assertEqual(scheduler.dispatch_due(), 0)
+
+    def test_due_time_can_count_from_a_given_moment(self):
+        scheduler.schedule(self.task, ('event-1',), 30, 0, 'deliveries.shard0', now=self.clock.time() - 10, jitter=False)
+
+        self.clock.advance(19)
+        self.assertEqual(scheduler.dispatch_due(), 0)
+        self.clock.advance(1)
+        self.assertEqual(scheduler.dispatch_due(), 1)
+
+    def test_due_entries_are_published_in_batches(self):
+        for n in range(5):
+            scheduler.schedule(self.task, (f'event-{n}',), n, 1, 'deliveries.shard0')
+        self.clock.advance(10)
+
+        self.assertEqual(scheduler.dispatch_due(batch_size=2), 5)
+        self.assertEqual(self.app.producer_or_acquire.call_count, 3)
+        self.assertEqual(
+            [call.args[0] for call in self.task.apply_async.call_args_list],
+            [(f'event-{n}',) for n in range(5)],
+        )
+
+    def test_entries_of_a_crashed_dispatcher_come_back(self):
+        scheduler.schedule(self.task, ('event-1',), 0, 1, 'deliveries.shard0')
+        self.task.apply_async.side_effect = ConnectionError('broker down')
+        with self.assertRaises(ConnectionError):
+            scheduler.dispatch_due()
+        self.task.apply_async.side_effect = None
+
+        # Still in flight: not handed out twice right away
+        self.assertEqual(scheduler.dispatch_due(), 0)
+        self.clock.advance(61)
+        self.assertEqual(scheduler.dispatch_due(), 1)
+
+    def test_falls_back_to_a_countdown_without_redis(self):
+        with mock.patch.object(self.redis, 'zadd', side_effect=redis.ConnectionError):
+            scheduler.schedule(self.task, ('event-1',), 30, 2, 'deliveries.shard1')
+
+        self.task.apply_async.assert_called_once_with(('event-1',), countdown=30, retries=2, queue='deliveries.shard1')
+
+
+class RetentionTests(TestCase):
+    """Expired events are archived with their attempts, deleted, and can be restored from the archive."""
+
+    def setUp(self):
+        self.destination = Destination.objects.create(url='http://receiver:8000/hook')
+        self.archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.archive_dir.cleanup)
+        response_bodies.forget()
+
+    def event(self, status, days_old, **fields):
+        fields.setdefault('payload', {'status': status, 'days': days_old})
+        event = Event.objects.create(destination=self.destination, status=status, **fields)
+        Event.objects.filter(id=event.id).update(created_at=timezone.now() - timedelta(days=days_old))
+        attempt = dict(event_id=event.id, status='SUCCESS', response_status_code=200, response_body=f'ok {event.id}')
+        response_bodies.store([attempt])
+        DeliveryAttempt.objects.create(**attempt)
+        return Event.objects.get(id=event.id)
+
+    def archive(self, **kwargs):
+        return retention.archive_expired_events('SUCCESS', 7, archive_dir=self.archive_dir.name, chunk_size=2, **kwargs)
+
+    def test_archive_and_restore_round_trip(self):
+        expired = [self.event('SUCCESS', 10 + n) for n in range(3)]
+        kept = [self.event('SUCCESS', 1), self.event('FAILED', 10), self.event('PENDING', 10)]
+
+        path, archived = self.archive()
+
+        self.assertEqual(archived, 3)
+        self.assertEqual(set(Event.objects.values_list('id', flat=True)), {event.id for event in kept})
+        self.assertEqual(DeliveryAttempt.objects.count(), 3)
+
+        self.assertEqual(retention.restore_archive(path), (3, 3))
+        for original in expired:
+            restored = Event.objects.get(id=original.id)
+            self.assertEqual(restored.created_at, original.created_at)
+            self.assertEqual(restored.get_payload(), original.payload)
+            attempt = DeliveryAttempt.objects.select_related('response_content').get(event=restored)
+            self.assertEqual(attempt.get_response_body(), f'ok {original.id}')
+
+        # Restoring twice is harmless
+        self.assertEqual(retention.restore_archive(path), (0, 0))
+        self.assertEqual(Event.objects.count(), 6)
+
+    def test_fanned_out_events_keep_their_payload(self):
+        message = Message.objects.create(
+            event_type=EventType.objects.create(name='order.created'), payload={'id': 1}, body=encode_payload({'id': 1})
+        )
+        event = self.event('SUCCESS', 10, message=message, payload=None)
+
+        path, _ = self.archive()
+
+        # Deleted along with its last delivery, but the line carries the payload
+        self.assertFalse(Message.objects.exists())
+        retention.restore_archive(path)
+        restored = Event.objects.get(id=event.id)
+        self.assertIsNone(restored.message_id)
+        self.assertEqual(restored.get_payload(), {'id': 1})
+
+    def test_stops_at_the_deadline(self):
+        for n in range(3):
+            self.event('SUCCESS', 10 + n)
+
+        _, archived = self.archive(deadline=0)
+
+        self.assertEqual(archived, 0)
+        self.assertEqual(Event.objects.count(), 3)
+
+
+class ExportTests(TestCase):
+    """GET /api/events/export/: one NDJSON line per event with its attempts, streamed chunk by chunk."""
+
+    def setUp(self):
+        self.destination = Destination.objects.create(url='http://receiver:8000/hook')
+        start = timezone.now() - timedelta(hours=1)
+        self.events = []
+        for n in range(5):
+            event = Event.objects.create(
+                destination=self.destination, payload={'n': n}, status='FAILED' if n % 2 else 'SUCCESS'
+            )
+            Event.objects.filter(id=event.id).update(created_at=start + timedelta(seconds=n))
+            DeliveryAttempt.objects.create(event=event, status='FAILED', response_status_code=500, response_body='oops')
+            self.events.append(event)
+
+    def export(self, query=''):
+        response = self.client.get(f'/api/events/export/{query}')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def lines(self, data):
+        return [json.loads(line) for line in data.decode('utf-8').splitlines()]
+
+    def test_lines_in_order_with_attempts(self):
+        lines = self.lines(self.export())
+
+        self.assertEqual([line['id'] for line in lines], [str(event.id) for event in self.events])
+        self.assertEqual(lines[0]['payload'], {'n': 0})
+        self.assertEqual([(a['response_status_code'], a['response_body']) for a in lines[0]['attempts']], [(500, 'oops')])
+
+    def test_filters_apply(self):
+        lines = self.lines(self.export('?status=FAILED'))
+        self.assertEqual([line['payload']['n'] for line in lines], [1, 3])
+
+    def test_gzip_stream(self):
+        response = self.client.get('/api/events/export/?gzip=true')
+
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        data = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(data, self.export())
+
+    def test_compressed_payloads_are_decoded(self):
+        Event.objects.filter(id=self.events[0].id).update(payload=None, body=gzip.compress(encode_payload({'n': 0})))
+
+        self.assertEqual(self.lines(self.export())[0]['payload'], {'n': 0})
+
+    def test_one_attempts_query_per_chunk(self):
+        # The events cursor, then one attempts query for each of the 3 chunks
+        with self.assertNumQueries(4):
+            data = b''.join(iter_ndjson(Event.objects.order_by('created_at'), chunk_size=2))
+        self.assertEqual(len(self.lines(data)), 5)
+
+
+class EventListTests(TestCase):
+    """GET /api/events/: cursor pages that don't shift under inserts, and ?fields= projections."""
+
+    def setUp(self):
+        self.destination = Destination.objects.create(url='http://receiver:8000/hook')
+        start = timezone.now() - timedelta(hours=1)
+        for n in range(7):
+            event = Event.objects.create(destination=self.destination, payload={'n': n})
+            # Pairs of identical timestamps: the id breaks the tie
+            Event.objects.filter(id=event.id).update(created_at=start + timedelta(seconds=n // 2))
+
+    def walk(self, url, on_page=None):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            ids += [event['id'] for event in page['results']]
+            if on_page:
+                on_page()
+            url = page['next']
+        return ids
+
+    def test_walks_every_event_once_in_order(self):
+        ids = self.walk('/api/events/?page_size=2')
+
+        expected = [str(pk) for pk in Event.objects.order_by('created_at', 'id').values_list('id', flat=True)]
+        self.assertEqual(ids, expected)
+
+    def test_pages_are_stable_under_inserts(self):
+        before = set(str(pk) for pk in Event.objects.values_list('id', flat=True))
+
+        ids = self.walk(
+            '/api/events/?page_size=3',
+            on_page=lambda: Event.objects.create(destination=self.destination, payload={'new': True}),
+        )
+
+        # Nothing skipped or repeated; events created meanwhile show up at the end
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertTrue(before <= set(ids))
+
+    @mock.patch.object(EventCursorPagination, 'max_page_size', 5)
+    def test_page_size_is_capped(self):
+        response = self.client.get('/api/events/?page_size=1000')
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_fields_projection(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/events/?fields=id,status')
+
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'status'})
+        # The payload column isn't even read
+        self.assertFalse(any('"payload"' in query['sql'] for query in queries.captured_queries))
+
+        response = self.client.get(f'/api/events/{Event.objects.first().id}/?fields=payload')
+        self.assertEqual(set(response.json()), {'payload'})
+
+    def test_unknown_field_is_rejected(self):
+        response = self.client.get('/api/events/?fields=id,secret')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(WEBHOOK_SECRET_ROTATION_GRACE_SECONDS=3600)
+class SigningTests(TestCase):
+    """HMAC signatures, and both secrets signing during a rotation's grace window."""
+
+    def setUp(self):
+        self.destination = Destination.objects.create(url='http://receiver:8000/hook')
+        self.body = encode_payload({'order': 1})
+
+    def test_signature_is_plain_hmac_sha256(self):
+        expected = hmac.new(str(self.destination.secret_key).encode(), self.body, hashlib.sha256).hexdigest()
+
+        self.assertEqual(signing.sign(self.destination, self.body), expected)
+        # The pre-keyed HMAC is reused, not consumed
+        self.assertEqual(signing.sign(self.destination, self.body), expected)
+        self.assertFalse(verify_webhook_signature(b'tampered', expected, self.destination.secret_key))
+
+    @mock.patch('delivery.serializers.latency.get_estimate', return_value=None)
+    @mock.patch('delivery.serializers.circuit_breaker.get_state', return_value={})
+    def test_both_secrets_sign_during_the_grace_window(self, *mocks):
+        old_secret = str(self.destination.secret_key)
+        signing.sign(self.destination, self.body)
+
+        response = self.client.post(f'/api/destinations/{self.destination.id}/rotate-secret/')
+        self.assertEqual(response.status_code, 200)
+        self.destination.refresh_from_db()
+        new_secret = str(self.destination.secret_key)
+        self.assertNotEqual(new_secret, old_secret)
+
+        header = signing.sign(self.destination, self.body)
+        new_signature, old_signature = header.split(',')
+        self.assertTrue(verify_webhook_signature(self.body, new_signature, new_secret))
+        self.assertTrue(verify_webhook_signature(self.body, old_signature, old_secret))
+        # Receivers on either secret accept the combined header
+        self.assertTrue(verify_webhook_signature(self.body, header, old_secret))
+        self.assertTrue(verify_webhook_signature(self.body, header, new_secret))
+
+        # Once the grace window is over only the new secret signs
+        Destination.objects.filter(id=self.destination.id).update(secret_rotated_at=timezone.now() - timedelta(hours=2))
+        self.destination.refresh_from_db()
+        header = signing.sign(self.destination, self.body)
+        self.assertNotIn(',', header)
+        self.assertFalse(verify_webhook_signature(self.body, header, old_secret))
+
+    def test_edited_secret_is_picked_up(self):
+        signing.sign(self.destination, self.body)
+        Destination.objects.filter(id=self.destination.id).update(secret_key=uuid.uuid4())
+        self.destination.refresh_from_db()
+
+        header = signing.sign(self.destination, self.body)
+
+        self.assertTrue(verify_webhook_signature(self.body, header, self.destination.secret_key))
+
+
+class AttemptRecorderTests(TestCase):
+    """Buffered attempt writes: flushed by size, by age and on shutdown; spooled attempts survive a dead worker."""
+
+    def setUp(self):
+        destination = Destination.objects.create(url='http://receiver:8000/hook')
+        self.event = Event.objects.create(destination=destination, payload={}, body=encode_payload({}))
+        response_bodies.forget()
+        self.clock = FakeClock()
+        for patcher in (
+            mock.patch('delivery.attempt_recorder.time', self.clock),
+            # No background flusher: the tests decide when time passes
+            mock.patch.object(attempt_recorder.threading, 'Thread'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def recorder(self, batch_size=3, flush_interval=60, spool_dir=None):
+        recorder = attempt_recorder.AttemptRecorder(batch_size, flush_interval, spool_dir=spool_dir)
+        self.addCleanup(lambda: recorder._spool and recorder._spool.close())
+        return recorder
+
+    def spool_dir(self):
+        spool_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(spool_dir.cleanup)
+        return spool_dir.name
+
+    def record(self, recorder, status='FAILED'):
+        recorder.record(
+            event_id=self.event.id, status=status, response_status_code=500, response_body='oops',
+            timestamp=timezone.now(), duration_ms=5, ttfb_ms=1,
+        )
+
+    def test_attempts_are_written_in_one_insert_when_the_buffer_is_full(self):
+        recorder = self.recorder()
+        with self.assertNumQueries(0):
+            self.record(recorder)
+            self.record(recorder)
+
+        # One INSERT for the response body, one for the three attempts
+        with self.assertNumQueries(2):
+            self.record(recorder)
+        self.assertEqual(DeliveryAttempt.objects.filter(event=self.event).count(), 3)
+
+    def test_buffer_is_flushed_once_the_interval_has_passed(self):
+        recorder = self.recorder(batch_size=100)
+        self.record(recorder)
+        self.assertFalse(DeliveryAttempt.objects.exists())
+
+        self.clock.advance(61)
+        self.record(recorder)
+
+        self.assertEqual(DeliveryAttempt.objects.count(), 2)
+
+    def test_buffer_is_flushed_when_the_worker_shuts_down(self):
+        recorder = self.recorder(batch_size=100)
+        self.record(recorder, status='SUCCESS')
+
+        with mock.patch.object(attempt_recorder, 'recorder', recorder):
+            attempt_recorder._flush_on_shutdown()
+
+        attempt = DeliveryAttempt.objects.select_related('response_content').get()
+        self.assertEqual((attempt.status, attempt.get_response_body()), ('SUCCESS', 'oops'))
+
+    def test_failed_flush_keeps_the_attempts_for_the_next_one(self):
+        spool_dir = self.spool_dir()
+        recorder = self.recorder(batch_size=100, spool_dir=spool_dir)
+        self.record(recorder)
+
+        with mock.patch.object(DeliveryAttempt.objects, 'bulk_create', side_effect=RuntimeError), \
+                self.assertLogs('delivery.attempt_recorder', 'ERROR'):
+            recorder.flush()
+        self.assertFalse(DeliveryAttempt.objects.exists())
+        self.assertEqual(len(recorder._buffer), 1)
+        self.assertTrue(recorder._spool_path().read_text())
+
+        recorder.flush()
+        self.assertEqual(DeliveryAttempt.objects.count(), 1)
+        self.assertEqual(recorder._spool_path().read_text(), '')
+
+    def test_spool_of_a_dead_worker_is_replayed_on_start(self):
+        spool_dir = self.spool_dir()
+        dead = self.recorder(batch_size=100, spool_dir=spool_dir)
+        self.record(dead)
+        self.record(dead, status='SUCCESS')
+
+        # The owner still holds its lock: its spool is left alone
+        fresh = self.recorder(batch_size=100, spool_dir=spool_dir)
+        fresh.replay_spools()
+        self.assertFalse(DeliveryAttempt.objects.exists())
+
+        # ... until it dies without flushing
+        spool_path = dead._spool_path()
+        dead._spool.close()
+        with self.assertLogs('delivery.attempt_recorder', 'WARNING'):
+            fresh.replay_spools()
+
+        attempts = DeliveryAttempt.objects.select_related('response_content').order_by('status')
+        self.assertEqual([attempt.status for attempt in attempts], ['FAILED', 'SUCCESS'])
+        self.assertEqual({attempt.get_response_body() for attempt in attempts}, {'oops'})
+        self.assertFalse(spool_path.exists())
+
+
+@mock.patch('delivery.metrics._queue_depths', return_value={'webhooks': 3})
+class MetricsTests(FakeRedisMixin, TestCase):
+    """GET /metrics renders from Redis and degrades to what it could read."""
+
+    def test_recorded_samples_are_rendered(self, depths):
+        metrics.inc('webhook_events_ingested_total', 2, source='events')
+        metrics.record_attempt('d1', True, 0.2)
+
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('webhook_events_ingested_total{source="events"} 2', text)
+        self.assertIn('webhook_delivery_duration_seconds_bucket{destination="d1",le="0.25"} 1', text)
+        self.assertIn('webhook_queue_depth{queue="webhooks"} 3', text)
+        self.assertIn('webhook_scheduled_deliveries 0', text)
+
+    def test_queue_depths_are_served_without_redis(self, depths):
+        pipeline = type(self.redis.pipeline())
+        with mock.patch.object(pipeline, 'execute', side_effect=redis.ConnectionError), \
+                self.assertLogs('delivery.metrics', 'WARNING'):
+            response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('webhook_queue_depth{queue="webhooks"} 3', text)
+        self.assertIn('# TYPE webhook_scheduled_deliveries gauge', text)
+        self.assertNotIn('webhook_scheduled_deliveries None', text)
+
+
+@mock.patch('delivery.serializers.latency.get_estimate', return_value=None)
+@mock.patch('delivery.serializers.circuit_breaker.get_state', return_value={})
+class DestinationTimeoutTests(TestCase):
+    """Per-destination timeout overrides can't outlive the leases held during a delivery."""
+
+    def setUp(self):
+        self.destination = Destination.objects.create(url='http://receiver:8000/hook')
+
+    def patch(self, data):
+        return self.client.patch(
+            f'/api/destinations/{self.destination.id}/', data, content_type='application/json'
+        )
+
+    def test_read_timeout_beyond_the_shortest_lease_is_rejected(self, *mocks):
+        # Default connect timeout (10s) + 120s against the 45s circuit probe timeout
+        response = self.patch({'read_timeout': 120})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('read_timeout', response.json())
+        self.destination.refresh_from_db()
+        self.assertIsNone(self.destination.read_timeout)
+
+    def test_timeouts_within_the_lease_are_accepted(self, *mocks):
+        response = self.patch({'connect_timeout': 5, 'read_timeout': 35})
+
+        self.assertEqual(response.status_code, 200)
+        self.destination.refresh_from_db()
+        self.assertEqual((self.destination.connect_timeout, self.destination.read_timeout), (5, 35))
+
+        # The stored read timeout counts when only the connect timeout changes
+        response = self.patch({'connect_timeout': 10})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('connect_timeout', response.json())
+
+    @override_settings(WEBHOOK_ORDERED_LEASE_SECONDS=20)
+    def test_limit_follows_the_configured_leases(self, *mocks):
+        self.assertEqual(self.patch({'connect_timeout': 5, 'read_timeout': 15}).status_code, 400)
+        self.assertEqual(self.patch({'connect_timeout': 5, 'read_timeout': 10}).status_code, 200)
+
+
+@mock.patch('delivery.persister.enqueue_deliveries')
+@override_settings(WEBHOOK_INGEST_MODE='stream')
+class IngestStreamTests(FakeRedisMixin, TestCase):
+    """Buffered ingestion end to end: backpressure, keys reserved in Redis, acks, reclaims and dead letters."""
+
+    def setUp(self):
+        super().setUp()
+        self.destination = Destination.objects.create(url='http://receiver:8000/hook')
+        ingest_stream.ensure_group()
+
+    def post(self, payload, key=None):
+        return self.client.post(
+            '/api/events/',
+            {'destination': str(self.destination.id), 'payload': payload},
+            content_type='application/json',
+            headers={'Idempotency-Key': key} if key else {},
+        )
+
+    def drain(self):
+        Persister('persister-1', block_ms=1).run_once()
+
+    @override_settings(WEBHOOK_INGEST_MAX_LAG=1, WEBHOOK_INGEST_RETRY_AFTER=7)
+    def test_full_buffer_answers_503_with_retry_after(self, enqueue):
+        self.assertEqual(self.post({'n': 1}).status_code, 202)
+
+        response = self.post({'n': 2})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+        self.assertEqual(ingest_stream.lag(), 1)
+        self.assertFalse(Event.objects.exists())
+
+    @override_settings(WEBHOOK_INGEST_MAX_LAG=1)
+    def test_idempotency_key_is_reserved_until_the_event_is_buffered(self, enqueue):
+        first = self.post({'n': 1}, key='order-1')
+        retry = self.post({'n': 1}, key='order-1')
+        self.assertEqual(retry.json()['task_id'], first.json()['task_id'])
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+        # Refused for backpressure: the key is given back, so the producer's retry isn't a "duplicate"
+        self.assertEqual(self.post({'n': 2}, key='order-2').status_code, 503)
+        self.drain()
+        accepted = self.post({'n': 2}, key='order-2')
+        self.assertEqual(accepted.status_code, 202)
+        self.assertNotIn('Idempotent-Replayed', accepted)
+        self.drain()
+
+        self.assertEqual(
+            set(Event.objects.values_list('id', flat=True)),
+            {uuid.UUID(first.json()['task_id']), uuid.UUID(accepted.json()['task_id'])},
+        )
+
+    def test_entries_are_acknowledged_only_once_persisted(self, enqueue):
+        for n in range(2):
+            self.post({'n': n})
+
+        with mock.patch('delivery.persister.persist', side_effect=DataError('database is down')):
+            with self.assertRaises(DataError):
+                self.drain()
+        self.assertEqual(ingest_stream.lag(), 2)
+        self.assertEqual(self.redis.xpending(ingest_stream.STREAM_KEY, ingest_stream.GROUP)['pending'], 2)
+
+        with override_settings(WEBHOOK_INGEST_CLAIM_IDLE_MS=0):
+            self.drain()
+        self.assertEqual(Event.objects.count(), 2)
+        self.assertEqual(ingest_stream.lag(), 0)
+
+    @override_settings(WEBHOOK_INGEST_CLAIM_IDLE_MS=0)
+    def test_entries_of_a_dead_persister_are_reclaimed(self, enqueue):
+        self.post({'n': 1})
+        self.assertEqual(len(ingest_stream.read('crashed', 10, 1)), 1)
+
+        with self.assertLogs('delivery.persister', 'WARNING'):
+            self.drain()
+
+        self.assertEqual(Event.objects.count(), 1)
+        self.assertEqual(self.redis.xpending(ingest_stream.STREAM_KEY, ingest_stream.GROUP)['pending'], 0)
+
+    def test_rejected_and_malformed_entries_are_dead_lettered(self, enqueue):
+        bulk_create = Event.objects.bulk_create
+
+        def rejecting(events, **kwargs):
+            # E.g. a \u0000 in a payload, which jsonb refuses
+            if any(event.idempotency_key == 'poison' for event in events):
+                raise DataError('unsupported Unicode escape sequence')
+            return bulk_create(events, **kwargs)
+
+        for n in range(2):
+            self.post({'n': n})
+        self.post({'n': 2}, key='poison')
+        self.redis.xadd(ingest_stream.STREAM_KEY, {'id': 'not-a-uuid'})
+
+        with mock.patch.object(Event.objects, 'bulk_create', side_effect=rejecting), \
+                self.assertLogs('delivery.persister', 'ERROR'):
+            self.drain()
+
+        self.assertEqual(
+            sorted(event.get_payload()['n'] for event in Event.objects.all()), [0, 1]
+        )
+        self.assertEqual(len(enqueue.call_args.args[0]), 2)
+        malformed, rejected = [fields for _, fields in self.redis.xrange(ingest_stream.DEAD_LETTER_KEY)]
+        self.assertEqual(malformed['error'], "Malformed entry: KeyError('body')")
+        self.assertIn('unsupported Unicode escape sequence', rejected['error'])
+        self.assertEqual(rejected['key'], 'poison')
+        # Nothing is left to fail again
+        self.assertEqual(ingest_stream.lag(), 0)
+
+    @mock.patch('delivery.persister.time.sleep')
+    def test_persister_keeps_running_after_errors(self, sleep, enqueue):
+        persister = Persister('persister-1', block_ms=1)
+        outcomes = iter([OperationalError('broker down'), KeyError('body'), redis.ConnectionError('redis down')])
+
+        def run_once():
+            exc = next(outcomes, None)
+            if exc is None:
+                persister.stop()
+                return 0
+            raise exc
+
+        with mock.patch.object(persister, 'run_once', side_effect=run_once), \
+                self.assertLogs('delivery.persister', 'ERROR') as logs:
+            persister.run()
+
+        self.assertEqual(sleep.call_count, 3)
+        self.assertEqual(len(logs.records), 3)
+
+
+@mock.patch('delivery.engine.metrics')
+@mock.patch('delivery.engine.close_old_connections')
+@override_settings(WEBHOOK_RETRY_JITTER=0)
+class DeliveryEngineTests(TestCase):
+    """WEBHOOK_DELIVERY_MODE=async: claims with a lease, and the same transitions and backoff as the Celery task."""
+
+    def setUp(self):
+        self.destination = Destination.objects.create(url='http://receiver:8000/hook', max_retries=2)
+        self.event = Event.objects.create(destination=self.destination, payload={}, body=encode_payload({}))
+
+    def outcome(self, event, status_code):
+        timings = {'duration_ms': 5, 'ttfb_ms': 1}
+        status = record_outcome(event, status_code, 'body', timings)
+        event.refresh_from_db()
+        return status
+
+    def test_claimed_events_are_leased(self, *mocks):
+        [claimed] = claim_events(10)
+
+        self.assertEqual((claimed.status, claimed.attempts_count), ('PROCESSING', 1))
+        self.assertAlmostEqual(
+            (claimed.next_attempt_at - timezone.now()).total_seconds(), engine.LEASE_SECONDS, delta=5
+        )
+        self.assertEqual(claim_events(10), [])
+
+    def test_stale_lease_is_taken_over(self, *mocks):
+        claim_events(10)
+        # The engine holding it died mid-delivery
+        Event.objects.filter(id=self.event.id).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+
+        [claimed] = claim_events(10)
+
+        self.assertEqual((claimed.id, claimed.attempts_count), (self.event.id, 2))
+
+    def test_inactive_destination_fails_its_events(self, *mocks):
+        Destination.objects.filter(id=self.destination.id).update(is_active=False)
+
+        self.assertEqual(claim_events(10), [])
+        self.assertEqual(Event.objects.get(id=self.event.id).status, 'FAILED')
+
+    def test_success(self, *mocks):
+        [event] = claim_events(10)
+
+        self.assertEqual(self.outcome(event, 200), 'SUCCESS')
+        self.assertIsNone(event.next_attempt_at)
+        self.assertEqual(DeliveryAttempt.objects.get().status, 'SUCCESS')
+
+    def test_server_error_is_retried_with_backoff_until_the_last_retry(self, *mocks):
+        for attempt in range(2):
+            Event.objects.filter(id=self.event.id).update(next_attempt_at=timezone.now())
+            [event] = claim_events(10)
+            self.assertEqual(self.outcome(event, 503), 'PROCESSING')
+            # The destination's policy: exponential from 60s
+            self.assertAlmostEqual(
+                (event.next_attempt_at - timezone.now()).total_seconds(), 60 * 2 ** attempt, delta=5
+            )
+
+        Event.objects.filter(id=self.event.id).update(next_attempt_at=timezone.now())
+        [event] = claim_events(10)
+        with self.assertLogs('delivery.engine', 'ERROR'):
+            self.assertEqual(self.outcome(event, 503), 'FAILED')
+        self.assertEqual(event.attempts_count, 3)
+        self.assertEqual(DeliveryAttempt.objects.filter(status='FAILED').count(), 3)
+
+    def test_client_error_is_not_retried(self, *mocks):
+        [event] = claim_events(10)
+
+        with self.assertLogs('delivery.engine', 'ERROR'):
+            self.assertEqual(self.outcome(event, 404), 'FAILED')
+
+    def test_parking_does_not_use_up_a_retry(self, *mocks):
+        [event] = claim_events(10)
+        park_event(event, 30)
+
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts_count), ('PENDING', 0))
+        self.assertAlmostEqual((event.next_attempt_at - timezone.now()).total_seconds(), 30, delta=5)
+        # Not due yet
+        self.assertEqual(claim_events(10), [])
+
+        # A retrying event stays PROCESSING, with the attempt it was parked on given back
+        Event.objects.filter(id=self.event.id).update(next_attempt_at=None)
+        [event] = claim_events(10)
+        self.outcome(event, 503)
+        Event.objects.filter(id=self.event.id).update(next_attempt_at=timezone.now())
+        [event] = claim_events(10)
+        park_event(event, 30)
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts_count), ('PROCESSING', 1))
+
+
+class CookieSettingHandler(BaseHTTPRequestHandler):
+    """A receiver that sets a cookie on every response and remembers the Cookie headers it got."""
+
+    received_cookies = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.received_cookies.append(self.headers.get('Cookie'))
+        self.send_response(200)
+        self.send_header('Set-Cookie', 'session=abc; Path=/')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(WEBHOOK_HTTP_POOL_SIZE=2, WEBHOOK_HTTP_IDLE_TIMEOUT=90, WEBHOOK_HTTP_MAX_CONNECTIONS_PER_HOST=3)
+class HttpClientTests(TestCase):
+    """One pooled session per origin, bounded by LRU and idle eviction, and no cookies between deliveries."""
+
+    def setUp(self):
+        http_client.close_all()
+        self.addCleanup(http_client.close_all)
+        self.clock = FakeClock()
+        patcher = mock.patch('delivery.http_client.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_one_session_per_origin(self):
+        first = http_client.get_session('http://receiver-a:8000/hook')
+
+        self.assertIs(http_client.get_session('HTTP://Receiver-A:8000/other?x=1'), first)
+        self.assertIsNot(http_client.get_session('http://receiver-b:8000/hook'), first)
+        self.assertIsNot(http_client.get_session('https://receiver-a:8000/hook'), first)
+
+    def test_connection_pool_is_sized_per_origin(self):
+        adapter = http_client.get_session('https://receiver-a/hook').get_adapter('https://receiver-a/hook')
+
+        self.assertEqual(adapter._pool_maxsize, 3)
+        self.assertEqual(adapter._pool_connections, 1)
+
+    def test_least_recently_used_origin_is_closed_when_the_pool_is_full(self):
+        a = http_client.get_session('http://receiver-a/hook')
+        b = http_client.get_session('http://receiver-b/hook')
+        http_client.get_session('http://receiver-a/hook')
+
+        with mock.patch.object(a, 'close') as close_a, mock.patch.object(b, 'close') as close_b:
+            http_client.get_session('http://receiver-c/hook')
+
+        close_b.assert_called_once()
+        close_a.assert_not_called()
+        self.assertIs(http_client.get_session('http://receiver-a/hook'), a)
+        self.assertIsNot(http_client.get_session('http://receiver-b/hook'), b)
+
+    def test_idle_origins_are_closed(self):
+        idle = http_client.get_session('http://receiver-a/hook')
+        self.clock.advance(60)
+        busy = http_client.get_session('http://receiver-b/hook')
+        self.clock.advance(31)
+
+        with mock.patch.object(idle, 'close') as close_idle, mock.patch.object(busy, 'close') as close_busy:
+            http_client.get_session('http://receiver-b/hook')
+
+        close_idle.assert_called_once()
+        close_busy.assert_not_called()
+        self.assertIsNot(http_client.get_session('http://receiver-a/hook'), idle)
+
+    def test_cookies_are_not_kept(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), CookieSettingHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        CookieSettingHandler.received_cookies = []
+        url = f'http://127.0.0.1:{server.server_port}/hook'
+
+        for _ in range(2):
+            response = http_client.post(url, data=b'{}', timeout=5)
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(CookieSettingHandler.received_cookies, [None, None])
+        self.assertEqual(len(http_client.get_session(url).cookies), 0)
+
+
+@override_settings(
+    WEBHOOK_LATENCY_MIN_SAMPLES=3, WEBHOOK_READ_TIMEOUT_MIN=2, WEBHOOK_READ_TIMEOUT_MAX=30,
+    WEBHOOK_CONNECT_TIMEOUT_MAX=10,
+)
+class LatencyTests(FakeRedisMixin, TestCase):
+    """The smoothed latency estimate and the delivery timeouts derived from it."""
+
+    def setUp(self):
+        super().setUp()
+        self.destination = Destination.objects.create(url='http://receiver:8000/hook')
+
+    def observe(self, *seconds):
+        for value in seconds:
+            latency.observe(self.destination.id, value)
+
+    def test_estimate_is_smoothed_like_tcp_rtt(self):
+        self.assertIsNone(latency.get_estimate(self.destination.id))
+
+        self.observe(0.1)
+        self.assertEqual(latency.get_estimate(self.destination.id), {'srtt_ms': 100, 'rttvar_ms': 50, 'samples': 1})
+
+        self.observe(0.2)
+        # rttvar = 3/4 * 50 + 1/4 * |100 - 200|, srtt = 7/8 * 100 + 1/8 * 200
+        self.assertEqual(latency.get_estimate(self.destination.id), {'srtt_ms': 112.5, 'rttvar_ms': 62.5, 'samples': 2})
+
+    def test_max_timeouts_until_enough_samples(self):
+        self.observe(0.1, 0.1)
+
+        self.assertEqual(latency.timeouts_for(self.destination), (10, 30))
+
+    def test_read_timeout_follows_the_estimate_within_its_bounds(self):
+        self.observe(1, 1, 1)
+        # srtt 1000ms, rttvar ~ 281ms: 1s + 4 * 0.28s
+        connect, read = latency.timeouts_for(self.destination)
+        self.assertAlmostEqual(read, 2.125, places=3)
+
+        # A slow receiver only gets a longer read timeout, not a longer connect timeout
+        self.observe(20, 20, 20)
+        self.assertEqual(latency.timeouts_for(self.destination), (10, 30))
+
+        fast = Destination.objects.create(url='http://fast:8000/hook')
+        for _ in range(3):
+            latency.observe(fast.id, 0.01)
+        self.assertEqual(latency.timeouts_for(fast), (10, 2))
+
+    def test_overrides_win(self):
+        self.observe(0.01, 0.01, 0.01)
+        self.destination.read_timeout = 5
+        self.assertEqual(latency.timeouts_for(self.destination), (10, 5))
+
+        # Both overridden: the estimate isn't even read
+        self.destination.connect_timeout = 3
+        with mock.patch.object(latency, 'get_estimate') as get_estimate:
+            self.assertEqual(latency.timeouts_for(self.destination), (3, 5))
+        get_estimate.assert_not_called()
+
+    def test_max_timeouts_without_redis(self):
+        self.observe(0.01, 0.01, 0.01)
+
+        with mock.patch.object(self.redis, 'hgetall', side_effect=redis.ConnectionError), \
+                self.assertLogs('delivery.latency', 'WARNING'):
+            self.assertEqual(latency.timeouts_for(self.destination), (10, 30))
+
+
+class DestinationListTests(FakeRedisMixin, TestCase):
+    """GET /api/destinations/ reads every destination's circuit and latency state in one Redis round trip."""
+
+    def setUp(self):
+        super().setUp()
+        self.destinations = [Destination.objects.create(url=f'http://receiver:8000/{n}') for n in range(3)]
+
+    def get(self):
+        response = self.client.get('/api/destinations/')
+        self.assertEqual(response.status_code, 200)
+        return {item['id']: item for item in response.json()}
+
+    @override_settings(WEBHOOK_CIRCUIT_FAILURE_THRESHOLD=1, WEBHOOK_LATENCY_MIN_SAMPLES=1)
+    def test_live_state_of_the_whole_list_in_one_round_trip(self):
+        failing, measured, _ = self.destinations
+        circuit_breaker.record_failure(failing.id)
+        latency.observe(measured.id, 0.5)
+
+        pipeline = type(self.redis.pipeline())
+        with mock.patch.object(pipeline, 'execute', autospec=True, side_effect=pipeline.execute) as execute, \
+                mock.patch.object(self.redis, 'hgetall') as single:
+            items = self.get()
+
+        execute.assert_called_once()
+        single.assert_not_called()
+        self.assertEqual(items[str(failing.id)]['circuit']['state'], 'open')
+        self.assertEqual(items[str(measured.id)]['circuit']['state'], 'closed')
+        self.assertEqual(items[str(measured.id)]['latency']['srtt_ms'], 500)
+        self.assertEqual(items[str(failing.id)]['latency']['read_timeout'], settings.WEBHOOK_READ_TIMEOUT_MAX)
+
+    def test_list_without_redis(self):
+        pipeline = type(self.redis.pipeline())
+        with mock.patch.object(pipeline, 'execute', side_effect=redis.ConnectionError), \
+                self.assertLogs('delivery.views', 'WARNING'):
+            items = self.get()
+
+        self.assertEqual(len(items), 3)
+        self.assertEqual({item['circuit']['state'] for item in items.values()}, {'unknown'})
+
+
+class ResponseBodyTests(TestCase):
+    """Deduplicated response bodies: purged once unreferenced, never while a process may still reuse them."""
+
+    def setUp(self):
+        response_bodies.forget()
+        self.addCleanup(response_bodies.forget)
+        destination = Destination.objects.create(url='http://receiver:8000/hook')
+        self.event = Event.objects.create(destination=destination, payload={}, body=encode_payload({}))
+
+    def age(self, text, days=100):
+        ResponseBody.objects.filter(sha256=response_bodies.content_hash(text)).update(
+            created_at=timezone.now() - timedelta(days=days)
+        )
+
+    def test_unreferenced_old_bodies_are_purged(self):
+        response_bodies.store([{'response_body': 'gone'}, {'response_body': 'fresh'}])
+        self.age('gone')
+
+        self.assertEqual(response_bodies.purge_orphans(), 1)
+        self.assertEqual(list(ResponseBody.objects.values_list('body', flat=True)), ['fresh'])
+
+        # Not trusted from the cache any more: written again when it comes back
+        with self.assertNumQueries(1):
+            response_bodies.store([{'response_body': 'gone'}])
+        self.assertTrue(ResponseBody.objects.filter(body='gone').exists())
+
+    def test_writing_an_old_body_again_keeps_it_from_being_purged(self):
+        response_bodies.store([{'response_body': 'ok'}])
+        self.age('ok')
+        # Another process (empty cache) writes it for a new attempt that's still buffered
+        response_bodies.forget()
+        [fields] = response_bodies.store([{'response_body': 'ok'}])
+
+        self.assertEqual(response_bodies.purge_orphans(), 0)
+
+        attempt = DeliveryAttempt.objects.create(event=self.event, status='SUCCESS', **fields)
+        self.assertEqual(DeliveryAttempt.objects.get(id=attempt.id).get_response_body(), 'ok')
+
+    def test_attempt_whose_body_was_purged_reads_as_empty(self):
+        [fields] = response_bodies.store([{'response_body': 'ok'}])
+        attempt = DeliveryAttempt.objects.create(event=self.event, status='SUCCESS', **fields)
+        ResponseBody.objects.all().delete()
+
+        self.assertIsNone(DeliveryAttempt.objects.get(id=attempt.id).get_response_body())
@@ -1,9 +1,32 @@
-from rest_framework import viewsets, status
+import logging
+import random
+import time
+import uuid
+
+import redis
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from rest_framework import mixins, viewsets, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
-from .models import Destination, Event
-from .serializers import DestinationSerializer, EventSerializer
-from .tasks import process_webhook_event  
+from rest_framework.decorators import action, api_view
+from rest_framework.parsers import JSONParser
+from . import circuit_breaker, fanout, idempotency, ingest_stream, latency, metrics
+from .exports import iter_ndjson
+from .models import Destination, Event, EventType, Message, Subscription
+from .pagination import EventCursorPagination
+from .parsers import NDJSONParser
+from .payloads import decode_payload, encode_payload, storage_fields
+from .redis_client import get_redis
+from .serializers import (
+    BulkEventItemSerializer, DestinationSerializer, EventSerializer, EventTypeSerializer,
+    MessageSerializer, SubscriptionSerializer,
+)
+from .tasks import enqueue_deliveries
+
+logger = logging.getLogger(__name__)
 
 # These endpoints let you manage webhook destinations (where webhooks go)
 # Automatically creates these routes:
@@ -12,12 +35,57 @@ from .tasks import process_webhook_event
 # - GET    /api/destinations/:id/   → Get specific destination
 # - PUT    /api/destinations/:id/   → Update destination
 # - DELETE /api/destinations/:id/   → Delete destination
+# - POST   /api/destinations/:id/rotate-secret/ → Rotate the signing secret
 # ============================================================================
 
+def live_state(destinations):
+    """
+    {destination id: {'circuit': ..., 'latency': ...}} for DestinationSerializer,
+    read in one Redis round trip instead of two per destination.
+    """
+    pipe = get_redis().pipeline(transaction=False)
+    for destination in destinations:
+        pipe.hgetall(circuit_breaker.state_key(destination.id))
+        pipe.hgetall(latency.estimate_key(destination.id))
+    try:
+        replies = pipe.execute() if destinations else []
+    except redis.RedisError as exc:
+        logger.warning(f"Circuit breaker and latency state unavailable: {exc}")
+        replies = [None] * (2 * len(destinations))
+
+    return {
+        destination.id: {'circuit': circuit_breaker.state_from(circuit), 'latency': latency.estimate_from(estimate)}
+        for destination, circuit, estimate in zip(destinations, replies[::2], replies[1::2])
+    }
+
+
 class DestinationViewSet(viewsets.ModelViewSet):
     queryset = Destination.objects.all()
     serializer_class = DestinationSerializer
 
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        destinations = list(queryset) if page is None else page
+
+        context = {**self.get_serializer_context(), 'live_state': live_state(destinations)}
+        serializer = self.get_serializer(destinations, many=True, context=context)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['post'], url_path='rotate-secret')
+    def rotate_secret(self, request, pk=None):
+        """
+        POST /api/destinations/:id/rotate-secret/
+
+        Issues a new secret. For WEBHOOK_SECRET_ROTATION_GRACE_SECONDS deliveries
+        are signed with both the new and the old secret.
+        """
+        destination = self.get_object()
+        destination.rotate_secret()
+        return Response(self.get_serializer(destination).data)
+
 
 class EventViewSet(viewsets.ModelViewSet):
     """
@@ -40,24 +108,191 @@ class EventViewSet(viewsets.ModelViewSet):
     [Meanwhile, in the background...]
       ↓
     Celery worker delivers webhook (can take as long as needed)
+
+    GET /api/events/
+    Cursor paginated (follow "next"), oldest first. Optional query params:
+      ?status=FAILED,PENDING          one or more statuses
+      ?destination=<uuid>
+      ?created_after=<ISO datetime>   inclusive
+      ?created_before=<ISO datetime>  exclusive
+      ?fields=id,status,created_at    only these fields (skips the payload column in SQL)
+
+    GET /api/events/export/
+    Streams every matching event (same filters) with its delivery attempts as NDJSON.
+    ?gzip=true compresses the stream on the fly.
     """
     
     queryset = Event.objects.all()
     serializer_class = EventSerializer
+    pagination_class = EventCursorPagination
+
+    def get_requested_fields(self):
+        """Field names from ?fields=, or None to return everything."""
+        if self.action not in ('list', 'retrieve') or 'fields' not in self.request.query_params:
+            return None
+
+        fields = [name.strip() for name in self.request.query_params['fields'].split(',') if name.strip()]
+        unknown = set(fields) - set(EventSerializer.Meta.fields)
+        if unknown:
+            raise ValidationError({"fields": f"Unknown fields: {', '.join(sorted(unknown))}"})
+        return fields
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        fields = self.get_requested_fields()
+        if fields is not None:
+            # Only SELECT what we're going to return; 'id' and 'created_at' keep the cursor working
+            columns = {'id', 'created_at'} | set(fields)
+            if 'payload' in fields:
+                # Fanned out events read their payload from the message
+                queryset = queryset.select_related('message')
+                columns |= {'message', 'message__payload'}
+                if settings.WEBHOOK_PAYLOAD_COMPRESSION:
+                    # Payloads stored compressed only live in the body
+                    columns |= {'body', 'message__body'}
+            queryset = queryset.only(*columns)
+        elif settings.WEBHOOK_PAYLOAD_COMPRESSION:
+            queryset = queryset.select_related('message')
+        else:
+            # The encoded body is never part of the API response
+            queryset = queryset.select_related('message').defer('body', 'message__body')
+
+        if self.action not in ('list', 'export'):
+            return queryset
+
+        params = self.request.query_params
+
+        if params.get('status'):
+            queryset = queryset.filter(status__in=params['status'].split(','))
+
+        if params.get('destination'):
+            try:
+                queryset = queryset.filter(destination_id=uuid.UUID(params['destination']))
+            except ValueError:
+                raise ValidationError({"destination": "Must be a valid UUID."})
+
+        for param, lookup in (('created_after', 'created_at__gte'), ('created_before', 'created_at__lt')):
+            if params.get(param):
+                value = parse_datetime(params[param])
+                if value is None:
+                    raise ValidationError({param: "Must be an ISO 8601 datetime."})
+                queryset = queryset.filter(**{lookup: value})
+
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
+
+    def perform_create(self, serializer, idempotency_key=None, body=None):
+        # Encode the payload ONCE; every delivery attempt signs and sends these bytes
+        serializer.save(idempotency_key=idempotency_key, **storage_fields(serializer.validated_data['payload'], body))
+
+    def perform_update(self, serializer):
+        if 'payload' not in serializer.validated_data:
+            serializer.save()
+            return
+        # Deliveries sign and send the stored body, so it's re-encoded with the payload
+        if serializer.instance.message_id is not None:
+            raise ValidationError({"payload": "A fanned out event's payload lives on its message and can't be changed."})
+        serializer.save(**storage_fields(serializer.validated_data['payload']))
+
+    def replay(self, event_id):
+        """The answer to a duplicate: the original event, nothing inserted or enqueued."""
+        return Response(
+            {
+                "message": "Request accepted. Processing in background.",
+                "task_id": event_id
+            },
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Idempotent-Replayed': 'true'}
+        )
+
+    def create_buffered(self, destination, body, key):
+        """
+        WEBHOOK_INGEST_MODE = 'stream': append the event to the write-ahead
+        buffer instead of INSERTing it (delivery/ingest_stream.py).
+        Returns None if Redis is unavailable, to fall back to a direct INSERT.
+        """
+        event_id = uuid.uuid4()
+        pair = (destination.id, key)
+        if key is not None:
+            existing = idempotency.claim(pair, event_id)
+            if existing is not None:
+                return self.replay(existing)
+
+        try:
+            ingest_stream.append(event_id, destination.id, body, key)
+        except ingest_stream.Backpressure as exc:
+            if key is not None:
+                idempotency.release(pair, event_id)
+            return Response(
+                {"error": f"{exc}, retry later."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(settings.WEBHOOK_INGEST_RETRY_AFTER)}
+            )
+        except redis.RedisError as exc:
+            logger.warning(f"Ingestion buffer unavailable, writing to the database directly: {exc}")
+            if key is not None:
+                idempotency.release(pair, event_id)
+            return None
+
+        metrics.inc('webhook_events_ingested_total', source='stream')
+        return Response(
+            {
+                "message": "Request accepted. Processing in background.",
+                "task_id": event_id
+            },
+            status=status.HTTP_202_ACCEPTED
+        )
 
     def create(self, request, *args, **kwargs):
         
         # Validate the incoming data
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)  
+
+        # A producer retrying the same request gets the event it already created
+        # (Idempotency-Key header, or a payload hash, see delivery/idempotency.py)
+        destination = serializer.validated_data['destination']
+        body = encode_payload(serializer.validated_data['payload'])
+        key = idempotency.key_for(destination, body, request.headers.get(idempotency.HEADER))
+        if key is not None and len(key) > idempotency.MAX_KEY_LENGTH:
+            raise ValidationError({idempotency.HEADER: f"At most {idempotency.MAX_KEY_LENGTH} characters."})
+
+        if settings.WEBHOOK_INGEST_MODE == 'stream':
+            response = self.create_buffered(destination, body, key)
+            if response is not None:
+                return response
+
+        if key is not None:
+            cached = idempotency.lookup([(destination.id, key)])
+            if cached:
+                return self.replay(cached[(destination.id, key)])
         
         # Save to database (creates a new Event with status='PENDING')
-        self.perform_create(serializer)
+        try:
+            with transaction.atomic():
+                self.perform_create(serializer, idempotency_key=key, body=body)
+        except IntegrityError:
+            # Lost the race against an earlier request with the same key (the
+            # unique constraint is the authoritative check)
+            existing = idempotency.find_existing([(destination.id, key)]) if key is not None else {}
+            if not existing:
+                raise
+            return self.replay(existing[(destination.id, key)])
 
         event_instance = serializer.instance
+        if key is not None:
+            transaction.on_commit(lambda: idempotency.remember({(destination.id, key): event_instance.id}))
         
-        # .delay() sends this task to Redis and returns IMMEDIATELY
-        process_webhook_event.delay(event_instance.id)
+        # Sends the delivery task to Redis and returns IMMEDIATELY
+        # (in 'async' delivery mode the engine picks the event up from the DB)
+        enqueue_deliveries([event_instance])
+        metrics.inc('webhook_events_ingested_total', source='events')
         
         # NOTE: We only pass the event ID, not the whole object
         # Why? Because Celery can't serialize Django model instances
@@ -73,7 +308,200 @@ class EventViewSet(viewsets.ModelViewSet):
             status=status.HTTP_202_ACCEPTED,
             headers=headers
         )
-        
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        GET /api/events/export/
+
+        Streams the export instead of building it in memory, so it works
+        the same for a hundred events or for millions.
+        """
+        queryset = self.get_queryset().order_by('created_at', 'id')
+        compress = request.query_params.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+        response = StreamingHttpResponse(
+            iter_ndjson(queryset, compress=compress),
+            content_type='application/gzip' if compress else 'application/x-ndjson',
+        )
+        filename = 'events.ndjson.gz' if compress else 'events.ndjson'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """
+        POST /api/events/bulk/
+
+        Accepts a JSON array (application/json) or NDJSON (application/x-ndjson)
+        of events and ingests them in one go:
+          - all destinations are fetched with a single query
+          - valid events are saved with one bulk_create
+          - delivery tasks are published over a single broker connection
+          - items may carry an "idempotency_key"; repeats of earlier events
+            (or of each other) come back as "duplicate" with the original task_id
+
+        Every item gets its own result, so one bad item does not reject the batch.
+        """
+        items = request.data
+
+        if not isinstance(items, list):
+            return Response(
+                {"error": "Expected a JSON array or NDJSON body of events."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if len(items) > settings.WEBHOOK_BULK_MAX_EVENTS:
+            return Response(
+                {"error": f"Too many events, max {settings.WEBHOOK_BULK_MAX_EVENTS} per request."},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        # Resolve every referenced destination in ONE query
+        destination_ids = set()
+        for item in items:
+            if isinstance(item, dict):
+                try:
+                    destination_ids.add(uuid.UUID(str(item.get('destination'))))
+                except ValueError:
+                    pass
+        destinations = Destination.objects.in_bulk(destination_ids)
+
+        events = []
+        results = []
+        keyed = {}  # (destination id, idempotency key) -> (event, results of every item with that key)
+        rejected = 0
+        for index, item in enumerate(items):
+            serializer = BulkEventItemSerializer(data=item, context={'destinations': destinations})
+            if not serializer.is_valid():
+                results.append({"index": index, "status": "rejected", "errors": serializer.errors})
+                rejected += 1
+                continue
+
+            data = serializer.validated_data
+            body = encode_payload(data['payload'])
+            key = idempotency.key_for(data['destination'], body, data.get('idempotency_key'))
+            pair = (data['destination'].id, key)
+            if key is not None and pair in keyed:
+                # The same key twice in one request
+                result = {"index": index, "status": "duplicate", "task_id": str(keyed[pair][0].id)}
+                keyed[pair][1].append(result)
+                results.append(result)
+                continue
+
+            event = Event(destination=data['destination'], idempotency_key=key, **storage_fields(data['payload'], body))
+            result = {"index": index, "status": "accepted", "task_id": str(event.id)}
+            if key is not None:
+                keyed[pair] = (event, [result])
+            events.append(event)
+            results.append(result)
+
+        # Items that repeat an earlier request (delivery/idempotency.py): the cache first...
+        duplicates = idempotency.lookup(keyed)
+        events = [event for event in events if (event.destination_id, event.idempotency_key) not in duplicates]
+
+        if events:
+            with transaction.atomic():
+                Event.objects.bulk_create(events, ignore_conflicts=bool(keyed))
+                if keyed:
+                    # ...then the unique constraint: keyed events that weren't inserted already existed
+                    candidates = [event.id for event in events if event.idempotency_key is not None]
+                    inserted = set(Event.objects.filter(id__in=candidates).values_list('id', flat=True))
+                    conflicts = {
+                        (event.destination_id, event.idempotency_key)
+                        for event in events if event.idempotency_key is not None and event.id not in inserted
+                    }
+                    if conflicts:
+                        duplicates.update(idempotency.find_existing(conflicts))
+                    events = [event for event in events if (event.destination_id, event.idempotency_key) not in duplicates]
+                    created = {
+                        (event.destination_id, event.idempotency_key): event.id
+                        for event in events if event.idempotency_key is not None
+                    }
+                    transaction.on_commit(lambda: idempotency.remember(created))
+                # Only publish once the rows are committed, otherwise a fast
+                # worker could look up an event that isn't visible yet
+                transaction.on_commit(lambda: enqueue_deliveries(events))
+            metrics.inc('webhook_events_ingested_total', len(events), source='bulk')
+
+        for pair, event_id in duplicates.items():
+            for result in keyed[pair][1]:
+                result.update(status="duplicate", task_id=str(event_id))
+
+        return Response(
+            {
+                "message": "Request accepted. Processing in background.",
+                "accepted": len(events),
+                "duplicates": len(items) - len(events) - rejected,
+                "rejected": rejected,
+                "results": results,
+            },
+            status=status.HTTP_400_BAD_REQUEST if rejected == len(items) else status.HTTP_202_ACCEPTED
+        )
+
+
+# Fan-out: event types, who subscribes to them, and messages published to them
+# - /api/event-types/            → CRUD, e.g. {"name": "order.created"}
+# - /api/subscriptions/          → CRUD, {"event_type": "order.created", "destination": "<uuid>"}
+# - POST /api/messages/          → Publish to every subscribed destination
+# - GET  /api/messages/:id/      → A published message
+# ============================================================================
+
+class EventTypeViewSet(viewsets.ModelViewSet):
+    queryset = EventType.objects.all()
+    serializer_class = EventTypeSerializer
+
+
+class SubscriptionViewSet(viewsets.ModelViewSet):
+    queryset = Subscription.objects.select_related('event_type')
+    serializer_class = SubscriptionSerializer
+
+
+class MessageViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    POST /api/messages/
+
+    The payload is stored once and delivered to every destination subscribed
+    to the event type. Each destination gets its own event (GET /api/events/:id/)
+    with its own status and attempts.
+    """
+
+    # The body is loaded too: with compression on, it's where the payload is
+    queryset = Message.objects.select_related('event_type')
+    serializer_class = MessageSerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        message, deliveries = fanout.publish(
+            serializer.validated_data['event_type'],
+            serializer.validated_data['payload'],
+        )
+        metrics.inc('webhook_events_ingested_total', len(deliveries), source='messages')
+
+        return Response(
+            {
+                "message": "Request accepted. Processing in background.",
+                "message_id": message.id,
+                "deliveries": [
+                    {"destination": event.destination_id, "task_id": event.id}
+                    for event in deliveries
+                ],
+            },
+            status=status.HTTP_202_ACCEPTED
+        )
+
+
+def metrics_view(request):
+    """
+    GET /metrics
+
+    Prometheus text format; counters are aggregated in Redis across every
+    process (see delivery/metrics.py).
+    """
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 
 @api_view(['POST', 'GET'])
 def echo_webhook(request):
@@ -81,10 +509,42 @@ def echo_webhook(request):
     Echo endpoint for testing webhook deliveries.
     Returns the received payload and headers.
     """
+    if request.headers.get('Content-Encoding') == 'gzip':
+        # Destinations with gzip_requests on get a compressed body
+        payload = decode_payload(request.body)
+    else:
+        payload = request.data
     return Response({
         'message': 'Echo received!',
         'method': request.method,
-        'payload': request.data,
+        'payload': payload,
         'headers': dict(request.headers),
     }, status=status.HTTP_200_OK)
 
+
+FAKE_RECEIVER_DEFAULT_DELAY_MS = {'slow': 500, 'hang': 120000}
+
+
+@api_view(['POST'])
+def fake_receiver(request, behavior):
+    """
+    Stand-in destinations for load tests (benchmarks/load_test.py).
+    Only routed when WEBHOOK_FAKE_RECEIVERS is on.
+
+      /api/receivers/fast/                      200 right away
+      /api/receivers/slow/?delay_ms=500         200 after the delay
+      /api/receivers/flaky/?failure_rate=0.3    500 that often, 200 otherwise
+      /api/receivers/hang/?delay_ms=120000      answers (too) late, so the delivery times out
+    """
+    if behavior not in ('fast', 'slow', 'flaky', 'hang'):
+        return Response({'error': f'Unknown receiver "{behavior}"'}, status=status.HTTP_404_NOT_FOUND)
+
+    if behavior in FAKE_RECEIVER_DEFAULT_DELAY_MS:
+        delay_ms = float(request.query_params.get('delay_ms', FAKE_RECEIVER_DEFAULT_DELAY_MS[behavior]))
+        time.sleep(delay_ms / 1000)
+
+    if behavior == 'flaky' and random.random() < float(request.query_params.get('failure_rate', 0.3)):
+        return Response({'message': 'Simulated failure'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return Response({'message': 'Received'}, status=status.HTTP_200_OK)
+